@@ -0,0 +1,228 @@
+"""
+Script Name: benchmark.py
+Description: This script benchmarks the stages of identify_employees.py on synthetic datasets (see pnl/synthetic.py) of increasing
+size and writes the timings and memory use of each stage to a JSON file, so that regressions can be tracked between versions and
+the scaling limits are known before production data reaches them.
+
+For each number of employees, the datasets are generated (deterministically, from --seed) in a subdirectory of the work directory
+and the pipeline is run in a fresh process:
+- load: load_datasets() for the analysis year (employees and attendance from the files, events and weather from a local HTTP
+  server serving the generated events.json and weather.json)
+- expand_event_windows, join_events_weather, filter_problem_attendance, find_problem_clocks_absences: the joins and filters
+- build_rollups: the weekly rollups of the attendance of each employee (see pnl/rollups.py), which give the seconds worked
+- match_infractions: the infraction matching
+- summarize_infractions: the infraction counts and event lists of each employee
+- output: build_results() and write_results()
+Each stage is recorded with pnl/profiling.py (wall and CPU time, peak RSS, rows in and out). The pipeline is timed --repeat times
+(the fastest run of each stage is kept) and then run once more with tracemalloc to record the peak memory allocated by each stage. The analysis year is --start-year; any
+further --years are generated so that the year filters have data to skip.
+
+Usage:
+- Ensure you have Python 3.12 installed.
+- Run the benchmark: python benchmark.py [--sizes 1000,10000,100000] [--output benchmark.json]
+- Generate a dataset only: python benchmark.py --generate DIR --sizes 10000
+"""
+
+import argparse
+import http.server
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from pnl.fetch import load_datasets
+from pnl.matching import match_infractions
+from pnl.pipeline import (average_hours_per_week, build_results, expand_event_windows, filter_problem_attendance, find_problem_clocks_absences,
+                          join_events_weather, summarize_infractions, write_results)
+from pnl.profiling import Profiler, peak_rss
+from pnl.rollups import WeeklyRollups
+from pnl.synthetic import write_synthetic_datasets
+
+DEFAULT_SIZES = [1000, 10000, 100000] # 1000000 employees is about 260 million attendance records (and tens of GB of JSON) per year
+PARAMETERS_FILE_NAME = 'parameters.json'
+
+# Function to parse the command line arguments
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the stages of identify_employees.py on synthetic datasets.")
+    parser.add_argument('--sizes', default=','.join(str(size) for size in DEFAULT_SIZES),
+                        help="Comma-separated numbers of employees to benchmark (default: %(default)s)")
+    parser.add_argument('--years', type=int, default=1, help="Number of years of attendance, events and weather to generate (default: %(default)s)")
+    parser.add_argument('--start-year', type=int, default=2023, help="First year generated, which is the year analysed (default: %(default)s)")
+    parser.add_argument('--countries', type=int, default=3, help="Number of countries (default: %(default)s)")
+    parser.add_argument('--events-per-country', type=int, default=40, help="Number of events per country per year (default: %(default)s)")
+    parser.add_argument('--late-rate', type=float, default=0.04, help="Share of late clock ins (default: %(default)s)")
+    parser.add_argument('--early-rate', type=float, default=0.03, help="Share of early clock outs (default: %(default)s)")
+    parser.add_argument('--absence-rate', type=float, default=0.02, help="Share of absences (default: %(default)s)")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the generator (default: %(default)s)")
+    parser.add_argument('--repeat', type=int, default=1, help="Number of timed runs of the pipeline per size (default: %(default)s)")
+    parser.add_argument('--cache', action='store_true', help="Load through the columnar cache (the first run builds it)")
+    parser.add_argument('--work-dir', help="Directory for the generated datasets, which are kept and reused by later runs with the same parameters "
+                                           "(default: a temporary directory, removed afterwards)")
+    parser.add_argument('--output', default='benchmark.json', help="JSON file to write the results to (default: %(default)s)")
+    parser.add_argument('--generate', metavar='DIR', help="Only generate the datasets for the first size in DIR")
+    args = parser.parse_args()
+    try:
+        args.sizes = [int(size) for size in args.sizes.split(',')]
+    except ValueError:
+        parser.error("--sizes must be a comma-separated list of integers")
+    if min(args.sizes) < 1 or args.years < 1 or args.countries < 1 or args.repeat < 1:
+        parser.error("--sizes, --years, --countries and --repeat must be positive")
+    if args.late_rate + args.early_rate + args.absence_rate > 1:
+        parser.error("--late-rate, --early-rate and --absence-rate must add up to at most 1")
+    return args
+
+# Function to get the generator parameters for the given number of employees
+def generator_parameters(args, employees):
+    return {
+        'employees': employees,
+        'years': args.years,
+        'start_year': args.start_year,
+        'countries': args.countries,
+        'events_per_country': args.events_per_country,
+        'late_rate': args.late_rate,
+        'early_rate': args.early_rate,
+        'absence_rate': args.absence_rate,
+        'seed': args.seed,
+    }
+
+# Function to generate the datasets in data_dir, unless they were already generated there with the same parameters
+def generate_datasets(data_dir, parameters):
+    parameters_path = os.path.join(data_dir, PARAMETERS_FILE_NAME)
+    try:
+        with open(parameters_path) as f:
+            saved = json.load(f)
+        if saved['parameters'] == parameters:
+            return saved['records'], 0.0
+    except FileNotFoundError:
+        pass
+    start = time.perf_counter()
+    records = write_synthetic_datasets(data_dir, **parameters)
+    seconds = time.perf_counter() - start
+    with open(parameters_path, 'w') as f: # Written last <-- Only complete datasets are reused
+        json.dump({'parameters': parameters, 'records': records}, f)
+    return records, seconds
+
+# Function to serve the events.json and weather.json files of a directory at /events and /weather from a background thread
+def start_data_server(data_dir):
+    class Handler(http.server.SimpleHTTPRequestHandler):
+        def translate_path(self, path):
+            return os.path.join(data_dir, f"{path.split('?')[0].strip('/')}.json")
+        def log_message(self, *args):
+            pass
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+# Function to run the pipeline once, recording each stage with the given profiler (see pnl/profiling.py)
+def run_pipeline(profiler, data_dir, base_url, year, cache_dir):
+    employee_data, attendance_data, events_data, weather_data = profiler.run(
+        'load', load_datasets, os.path.join(data_dir, 'employees.json'), os.path.join(data_dir, 'attendance.json'),
+        f"{base_url}/events", f"{base_url}/weather", year, cache_dir, profiler=profiler)
+    event_windows = profiler.run('expand_event_windows', expand_event_windows, events_data, year)
+    events_weather = profiler.run('join_events_weather', join_events_weather, event_windows, weather_data)
+    employee_attendance = profiler.run('filter_problem_attendance', filter_problem_attendance, employee_data, attendance_data)
+    problem_clocks_absences = profiler.run('find_problem_clocks_absences', find_problem_clocks_absences, employee_attendance, events_weather)
+    seconds_worked = profiler.run('build_rollups', WeeklyRollups.from_attendance, attendance_data).total_seconds_worked()
+    chosen = profiler.run('match_infractions', match_infractions, problem_clocks_absences)
+    summary = profiler.run('summarize_infractions', summarize_infractions, problem_clocks_absences, chosen)
+    def write_output():
+        results = build_results(summary, employee_data, average_hours_per_week(seconds_worked))
+        write_results(results, os.path.join(data_dir, 'results.json'))
+        return results
+    return profiler.run('output', write_output)
+
+# Function to benchmark the pipeline on one generated dataset (run in a fresh process so that its peak RSS is its own)
+def benchmark_dataset(data_dir, year, repeat, use_cache):
+    cache_dir = os.path.join(data_dir, '.pnl_cache') if use_cache else None
+    server, base_url = start_data_server(data_dir)
+    stages = {}
+    total_seconds = None
+    try:
+        # Timed runs <-- Keep the fastest run of each stage (the fetch_* stages run concurrently within load)
+        for _ in range(repeat):
+            profiler = Profiler()
+            run_pipeline(profiler, data_dir, base_url, year, cache_dir)
+            for record in profiler.stages:
+                if record['stage'] not in stages or record['wall_seconds'] < stages[record['stage']]['wall_seconds']:
+                    stages[record['stage']] = record
+            run_seconds = profiler.report()['total_wall_seconds']
+            total_seconds = run_seconds if total_seconds is None else min(total_seconds, run_seconds)
+
+        # Traced run <-- Peak memory allocated by each stage
+        profiler = Profiler(trace_memory=True)
+        try:
+            run_pipeline(profiler, data_dir, base_url, year, cache_dir)
+        finally:
+            tracemalloc.stop()
+        for record in profiler.stages:
+            stages[record['stage']]['peak_memory_bytes'] = record['peak_memory_bytes']
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    return {
+        'stages': list(stages.values()),
+        'total_seconds': total_seconds,
+        'max_rss_bytes': peak_rss(),
+    }
+
+# Function to describe the environment the benchmark ran in
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+def main():
+    args = parse_args()
+
+    if args.generate:
+        print(f"Generating the datasets for {args.sizes[0]} employees in {args.generate}...")
+        records, seconds = generate_datasets(args.generate, generator_parameters(args, args.sizes[0]))
+        print(f"Completed in {seconds:.1f}s: {records}")
+        return
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='pnl_benchmark_')
+    report = {'environment': environment(), 'repeat': args.repeat, 'cache': args.cache, 'runs': []}
+    try:
+        for employees in args.sizes:
+            parameters = generator_parameters(args, employees)
+            data_dir = os.path.join(work_dir, f"employees_{employees}")
+            print(f"Generating the datasets for {employees} employees...")
+            records, generate_seconds = generate_datasets(data_dir, parameters)
+            print(f"Completed! {records}")
+
+            print(f"Benchmarking the pipeline for {employees} employees...")
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                run = executor.submit(benchmark_dataset, data_dir, args.start_year, args.repeat, args.cache).result()
+            report['runs'].append({'parameters': parameters, 'records': records, 'generate_seconds': generate_seconds, **run})
+            for stage in run['stages']:
+                print(f"  {stage['stage']:<30} {stage['wall_seconds']:>10.3f}s {stage['peak_memory_bytes'] / 2**20:>10.1f} MiB {stage['rows_out'] if stage['rows_out'] is not None else '-':>12} rows")
+            print(f"  {'total':<30} {run['total_seconds']:>10.3f}s")
+
+            with open(args.output, 'w') as f: # Rewritten after each size <-- The completed sizes are kept if a larger one fails
+                json.dump(report, f, indent=2)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    print(f"Results written to {args.output}")
+
+if __name__ == "__main__": # Guard so that the worker process can import this script without running it
+    main()
@@ -5,167 +5,335 @@ or day before an event in their country with the exception of days with extreme
 Note that an employee does not incur more than one infraction for the same clock date or the same event. The results also includes the list of events the employee
 may have possibly attended.
 
-The approach is to join datasets on common keys and filter for conditions that match behavioral pattern criteria. (The resulting dataset is printed to drilldown.csv
-for manual double-checking of results.) The resulting dataset is then grouped by attendance date and then by event to count the number of events an employee attended.
+The approach is to join datasets on common keys and filter for conditions that match behavioral pattern criteria. (With --drilldown, the resulting dataset is
+printed to drilldown.csv for manual double-checking of results.) The number of events an employee attended is then the size of a maximum matching between their
+problem clock dates and events (see pnl/matching.py); the chosen (clock date, event) pairs are marked in the infraction column of the drilldown.
 
-test_results.py along with some manual checking in drilldown.csv can be used to double-check the results.
+test_results.py along with some manual checking in the drilldown can be used to double-check the results.
 
 Author: S. S.
 Created: January 3, 2024
 Last Modified: January 3, 2024
 
+The stages of the analysis are in pnl/pipeline.py. With --state-dir, the state needed to update the results incrementally is
+saved after a full run; later runs with --incremental only process the new attendance rows (and any new events or weather)
+and produce the same results.json as a full recompute (see pnl/incremental.py).
+
 Usage:
 - Ensure you have Python 3.12 installed.
-- Run the script: python identifies_employees.py
+- Run the script: python identifies_employees.py [--data-dir DATA_DIR] [--state-dir STATE_DIR] [--ndjson]
+- Run the data-quality checks, the analysis and the validation in one process, loading the data once: python run_pipeline.py
+- Also write the drilldown for double-checking: python identifies_employees.py --drilldown {csv,csv.gz,parquet} [--drilldown-columns COLUMNS]
+- Update the results with new attendance rows: python identifies_employees.py --state-dir STATE_DIR --incremental NEW_ATTENDANCE_JSON
+- Run the analysis in parallel per country (or per employee shard): python identifies_employees.py --shard-by country [--workers N]
+- Record the time, CPU time, peak RSS and rows of each stage in profile.json: python identifies_employees.py --profile [--cprofile FILE]
+- Compare policies (cutoffs, weather exclusions, window, threshold) in one pass: python identifies_employees.py --policies POLICIES_JSON [--backend {duckdb,calendar}]
+- Run the joins and filters out of core on DuckDB: python identifies_employees.py --backend duckdb [--memory-limit 4GB] [--workers N]
+- Find the candidate infractions with dense calendar matrices instead of joins (see pnl/calendar_matrix.py): python identifies_employees.py --backend calendar
+- Keep the data in memory and answer queries over HTTP (see pnl/service.py): python identifies_employees.py --serve [PORT] [--refresh-interval SECONDS]
 """
 
-import requests
+import argparse
 import json
-import pandas as pd
-import numpy as np
-from datetime import datetime
-
-# Function to fetch JSON data from the given API URL and convert it to a DataFrame
-def fetch_url_data(api_url, params=None):
-    response = requests.get(api_url, params=params)
-    if response.status_code == 200:
-        df = pd.DataFrame(response.json())
-        return df
+import sys
+from pnl.calendar_matrix import run_calendar
+from pnl.dataset import Dataset
+from pnl.drilldown import DRILLDOWN_FORMATS, check_drilldown_format, drilldown_path, select_drilldown_columns, start_drilldown
+from pnl.duckdb_backend import duckdb_available, run_duckdb
+from pnl.fetch import fetch_attendance_data
+from pnl.incremental import build_state, load_state, save_state, state_results, update_state
+from pnl.pipeline import add_hours_worked, average_hours_per_week, build_results, find_problem_clocks_absences, write_results
+from pnl.policies import compare_policies, evaluate_policies, join_candidates, load_policies
+from pnl.profiling import Profiler
+from pnl.service import DEFAULT_PORT, DEFAULT_REFRESH_INTERVAL, QueryService
+from pnl.sharding import run_sharded
+
+# Function to parse the command line arguments
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Identify employees with a pattern of problem clocks and absences around events in their country.")
+    parser.add_argument('--data-dir', default='.', help="Directory with employees.json and attendance.json, where the results are written (default: current directory)")
+    parser.add_argument('--state-dir', help="Directory to save the state for incremental updates in (full runs) or to read it from (--incremental runs)")
+    parser.add_argument('--incremental', metavar='NEW_ATTENDANCE_JSON', help="Update the saved state with the attendance records in this file instead of recomputing the full year")
+    parser.add_argument('--ndjson', action='store_true', help="Write the results as NDJSON (results.ndjson, one employee per line) instead of a JSON array")
+    parser.add_argument('--shard-by', choices=['country', 'employee'], help="Run the analysis in a process pool, one shard per country or per employee id hash")
+    parser.add_argument('--shards', type=int, help="Number of employee id hash shards (default: number of CPUs)")
+    parser.add_argument('--workers', type=int, help="Number of worker processes for --shard-by, or of DuckDB threads for --backend duckdb (default: number of CPUs)")
+    parser.add_argument('--drilldown', choices=DRILLDOWN_FORMATS, help="Also write the problem clocks and absences joined with events and weather, for double-checking "
+                                                                       "(drilldown.csv, drilldown.csv.gz or a drilldown directory of Parquet files partitioned by country)")
+    parser.add_argument('--drilldown-columns', help="Comma-separated columns to write in the drilldown (default: all)")
+    parser.add_argument('--profile', action='store_true', help="Record the time, CPU time, peak RSS and rows in and out of each stage in profile.json")
+    parser.add_argument('--cprofile', metavar='FILE', help="Write cProfile stats of the whole run to FILE (pstats format)")
+    parser.add_argument('--policies', metavar='POLICIES_JSON', help="Evaluate each policy in this JSON list of policy specs (see pnl/policies.py) over one join "
+                        "(or one run per policy with --backend duckdb or calendar) and write results_<name>.json per policy and policy_comparison.json "
+                        "instead of results.json")
+    parser.add_argument('--backend', choices=['pandas', 'duckdb', 'calendar'], default='pandas',
+                        help="Run the joins and filters in pandas (default), out of core on an embedded DuckDB database (needs duckdb) "
+                             "or as boolean employee x day calendar matrices")
+    parser.add_argument('--memory-limit', help="Memory DuckDB may use before spilling to disk with --backend duckdb, e.g. 4GB (default: 80%% of the RAM)")
+    parser.add_argument('--serve', type=int, nargs='?', const=DEFAULT_PORT, metavar='PORT',
+                        help=f"Keep the datasets in memory and answer queries over HTTP/JSON on PORT (default: {DEFAULT_PORT}) instead of writing results.json")
+    parser.add_argument('--host', default='127.0.0.1', help="Host to serve queries on with --serve (default: 127.0.0.1)")
+    parser.add_argument('--refresh-interval', type=int, default=DEFAULT_REFRESH_INTERVAL,
+                        help=f"Seconds between checks for new events or weather data with --serve (default: {DEFAULT_REFRESH_INTERVAL})")
+    args = parser.parse_args(argv)
+    if args.incremental and not args.state_dir:
+        parser.error("--incremental requires --state-dir")
+    if args.shard_by and (args.state_dir or args.incremental):
+        parser.error("--shard-by cannot be combined with --state-dir or --incremental")
+    if args.drilldown and (args.shard_by or args.incremental):
+        parser.error("--drilldown is only written by full runs (not with --shard-by or --incremental)")
+    if args.serve is not None and (args.state_dir or args.incremental or args.shard_by or args.drilldown or args.ndjson or args.profile):
+        parser.error("--serve cannot be combined with --state-dir, --incremental, --shard-by, --drilldown, --ndjson or --profile")
+    if args.policies and (args.state_dir or args.incremental or args.shard_by or args.drilldown or args.serve is not None):
+        parser.error("--policies cannot be combined with --state-dir, --incremental, --shard-by, --drilldown or --serve")
+    if args.backend != 'pandas' and (args.state_dir or args.incremental or args.shard_by or args.drilldown or args.serve is not None):
+        parser.error(f"--backend {args.backend} cannot be combined with --state-dir, --incremental, --shard-by, --drilldown or --serve")
+    if args.backend == 'duckdb' and not duckdb_available():
+        parser.error("--backend duckdb needs the duckdb package. Install it or use the pandas backend")
+    if args.memory_limit and args.backend != 'duckdb':
+        parser.error("--memory-limit requires --backend duckdb")
+    if args.drilldown_columns and not args.drilldown:
+        parser.error("--drilldown-columns requires --drilldown")
+    if args.drilldown and check_drilldown_format(args.drilldown):
+        parser.error(check_drilldown_format(args.drilldown))
+    args.drilldown_columns = args.drilldown_columns.split(',') if args.drilldown_columns else None
+    return args
+
+# Function to update the saved state with new attendance rows and write the results
+def run_incremental(args, dataset, file_path):
+    profiler = dataset.profiler
+    state = load_state(args.state_dir)
+    if state is None:
+        sys.exit(f"No saved state in {args.state_dir}. Run a full computation with --state-dir first.")
+    if 'rollups' not in state: # Saved before the weekly rollups were part of the state
+        sys.exit(f"The state in {args.state_dir} has no weekly rollups. Run a full computation with --state-dir again.")
+    if state['year'] != dataset.year:
+        sys.exit(f"The state in {args.state_dir} is for {state['year']}, not {dataset.year}. Run a full computation with --state-dir again.")
+
+    print("Fetching employee, new attendance, events and weather data...")
+    # Fetch employee data and the new attendance rows from local storage and events and weather data from URLs, keeping only 2023 records
+    employee_data, events_data, weather_data = dataset.reference_data # <-- Same country categories so the datasets join on their codes
+    new_attendance_data = profiler.run('fetch_new_attendance', fetch_attendance_data, args.incremental, year=state['year'])
+    print("Completed!")
+
+    print(f"Updating the infractions with {len(new_attendance_data)} new attendance records...")
+    state = profiler.run('update_state', update_state, state, employee_data, new_attendance_data, events_data, weather_data)
+    profiler.run('save_state', save_state, state, args.state_dir)
+    results = profiler.run('build_results', state_results, state, employee_data)
+    print("Completed!")
+
+    print(f"Printing results to {file_path}...")
+    profiler.run('write_results', write_results, results, file_path, ndjson=args.ndjson)
+    print("Completed!")
+
+# Function to evaluate several policies and write the results of each and their comparison
+# (over one join of the datasets with the pandas backend, or with one run of the duckdb or calendar backend per policy)
+def run_policies(args, dataset):
+    profiler = dataset.profiler
+    try:
+        policies = load_policies(args.policies)
+    except (OSError, ValueError) as e:
+        sys.exit(f"Error reading the policies in {args.policies}: {e}")
+
+    if args.backend == 'duckdb':
+        print("Fetching employee, events and weather data...")
+        # Only the small datasets are loaded into memory <-- The attendance is scanned by DuckDB
+        employee_data, events_data, weather_data = dataset.reference_data
+    else:
+        print("Fetching employee, attendance, events and weather data...")
+        # Fetch employee and attendance data from local storage and events and weather data from URLs concurrently, keeping only 2023 records
+        employee_data, attendance_data, events_data, weather_data = dataset.datasets
+    print("Completed!")
+
+    if args.backend == 'pandas':
+        print(f"Evaluating {len(policies)} policies over one join of the datasets...")
+        # Join once for the widest window and loosest cutoffs <-- Each policy is then a filter of the joined rows
+        candidates = profiler.run('join_candidates', join_candidates, employee_data, attendance_data, events_data, weather_data, policies, year=dataset.year)
+        results = profiler.run('evaluate_policies', evaluate_policies, employee_data, attendance_data, events_data, weather_data, policies,
+                               average_hours_per_week(dataset.seconds_worked), year=dataset.year, candidates=candidates)
     else:
-        print(f"Error fetching data from {api_url}. Status code: {response.status_code}")
-        return None
-
-# Function to fetch JSON data from local storage and convert it to a DataFrame
-def fetch_local_data(data_path):
-    with open(data_path, "r") as f:
-        data = json.load(f)
-    df = pd.DataFrame(data)
-    return df
-
-# URLs for events and weather data
-events_url = "https://www.pingtt.com/exam/events"
-weather_url = "https://www.pingtt.com/exam/weather"
-
-# Prompt the user for the path to the json files
-root_path = input("Enter the path to where your employees and attendance json files are stored on your machine: ")
-if root_path and not root_path.endswith('\\'):
-    root_path += '\\'
-employee_data_path = f"{root_path}employees.json"
-attendance_data_path = f"{root_path}attendance.json"
-
-print("Fetching employee and attendance data...")
-# Fetch employee and attendance data from local storage
-employee_data = fetch_local_data(employee_data_path)
-attendance_data = fetch_local_data(attendance_data_path)
-print("Completed!")
-
-print("Fetching events and weather data...")
-# Fetch events and weather data from URLs
-events_data = fetch_url_data(events_url)
-weather_data = fetch_url_data(weather_url)
-print("Completed!")
-
-# Filter the data for the year 2023
-events_data['event_date'] = pd.to_datetime(events_data['event_date'], format='%Y-%m-%d')
-weather_data['date'] = pd.to_datetime(weather_data['date'], format='%Y-%m-%d')
-attendance_data['date'] = pd.to_datetime(attendance_data['date'], format='%Y-%m-%d')
-events_data = events_data[events_data['event_date'].dt.year == 2023]
-weather_data = weather_data[weather_data['date'].dt.year == 2023]
-attendance_data = attendance_data[attendance_data['date'].dt.year == 2023]
-
-# Add the previous and following clock dates to the events data <-- This gives us clock dates before, after and of an event
-# Clock dates will be duplicated for events less than two days apart <-- Keep this in mind when counting infractions
-events_data.rename(columns={'id': 'event_id'}, inplace=True) # Rename unique identifier for events to event_id
-events_data['clock_date'] = events_data['event_date'] # Add clock date and set to event date
-previous_day = events_data.copy()
-previous_day['clock_date'] = previous_day['event_date'] - pd.to_timedelta(1, unit='d') # Add clock date and set to day before event date
-next_day = events_data.copy()
-next_day['clock_date'] = next_day['event_date'] + pd.to_timedelta(1, unit='d') # Add clock date and set to day after event date
-events_data = pd.concat([events_data, previous_day, next_day], ignore_index=True)
-events_data = events_data[events_data['clock_date'].dt.year == 2023] # Filter in case of Old Year's and New Year's events
-
-# Join events_data and weather_data on event_date and country and filter out weekend dates and dates where there was hail, blizzard, thunderstorm or hurricane weather <-- This gives us the weekdays before, after and of an event with good weather
-events_weather = pd.merge(events_data, weather_data, left_on=['clock_date', 'country'], right_on=['date', 'country'])
-exclude_values = ['hail', 'blizzard', 'thunderstorm', 'hurricane']
-events_weather = events_weather[
-    (~events_weather['condition'].isin(exclude_values)) &
-    (events_weather['max_temp'] <= 40) &
-    (events_weather['clock_date'].dt.dayofweek < 5)
-]
-
-# Calculate average hours worked per week for each employee and add as a column in attendance data <-- This detail is needed in the final result
-attendance_data['clock_in'] = pd.to_datetime(attendance_data['clock_in'], format='%H:%M:%S') # Convert 'clock_in' column to datetime object
-attendance_data['clock_out'] = pd.to_datetime(attendance_data['clock_out'], format='%H:%M:%S') # Convert 'clock_out' column to datetime object
-attendance_data['total_seconds_worked'] = (attendance_data['clock_out'] - attendance_data['clock_in']).dt.total_seconds() # Calculate total seconds worked for each record
-attendance_data['average_hours_per_week'] = attendance_data.groupby('employee_record_id')['total_seconds_worked'].transform('sum') / 3600 / 52 # Group by employee id to calculate weekly average for each employee
-
-# Join employee_data and attendance_data on employee_id and filter for late clock ins and early clock outs and absences <-- This gives us all problematic clocks and absences and the employee details needed for final result
-employee_attendance = pd.merge(employee_data, attendance_data, left_on=['record_id'], right_on=['employee_record_id'])
-employee_attendance['clock_in'] = pd.to_datetime(employee_attendance['clock_in'], format='%H:%M:%S') # Convert 'clock_in' column to datetime object
-employee_attendance['clock_out'] = pd.to_datetime(employee_attendance['clock_out'], format='%H:%M:%S') # Convert 'clock_out' column to datetime object
-employee_attendance = employee_attendance[
-    (employee_attendance['clock_in'].dt.time > pd.to_datetime('08:15:00', format='%H:%M:%S').time()) |
-    (employee_attendance['clock_out'].dt.time < pd.to_datetime('16:00:00', format='%H:%M:%S').time()) |
-    (employee_attendance['clock_in'].isnull() & employee_attendance['clock_out'].isnull())
-]
-
-print("Checking for problematic employee clocks and absences on weekdays with good weather the day before after and of an event in their country...")
-# Join employee_attendance with events_weather on clock_date and country <-- This give us all the problematic clocks and absences on weekdays with good weather the day before, after and of an event
-problem_clocks_absences = pd.merge(employee_attendance, events_weather, left_on=['date', 'country'], right_on=['clock_date', 'country'])
-problem_clocks_absences.to_csv(f"{root_path}drilldown.csv", index=False) # Print to csv for double-checking
-print("Completed!")
-
-print("Counting the number of infractions per employee..")
-# Create a separate dataframe to preserve the possibly attended events of each employee
-employee_events = problem_clocks_absences.groupby('record_id_x').agg({ # Group by employee id to generate a list of events for each possibly attended event
-	'event_name': lambda x: list(x),
-	'event_date': lambda x: list(x.dt.strftime('%Y-%m-%d')),
-	'country': lambda x: list(x)
-}).reset_index()
-employee_events['events'] = None # Add a new column to store events in JSON format
-employee_events['events'] = employee_events.apply(
-    lambda row: json.loads(pd.DataFrame({
-        'country': row['country'],
-        'event_name': row['event_name'],
-        'event_date': row['event_date']
-    }).drop_duplicates().reset_index(drop=True).to_json(orient='records')), axis=1
-)
-
-# Count the number of infractions per employee (An employee should not incur more than one infraction for the same clock date or the same event)
-problem_clocks_absences = problem_clocks_absences.sort_values(by=['record_id_x', 'clock_date', 'event_id']) # Sort so that 'first' aggregation function behavior is predictable
-problem_clocks_absences['count_empid_evt'] = problem_clocks_absences.groupby(['record_id_x', 'event_id']).transform('size') # Count event occurrences per employee
-problem_clocks_absences = problem_clocks_absences.loc[problem_clocks_absences.groupby(['record_id_x', 'clock_date'])['count_empid_evt'].idxmax()] # Flatten data by clock date to get one event (the one with max occurrences) per clock date.
-problem_clocks_absences = problem_clocks_absences.groupby(['record_id_x', 'event_id']).agg({ # Flatten data by event id
-    'name': 'first',
-    'work_id_number': 'first',
-    'email_address': 'first',
-    'country': 'first',
-    'phone_number': 'first',
-    'average_hours_per_week': 'first',
-    'clock_date': 'first', # One clock date per event
-}).reset_index()
-problem_clocks_absences['freq'] = 1 # Add a new column to count the infractions
-problem_clocks_absences = problem_clocks_absences.groupby(['record_id_x']).agg({
-    'name': 'first',
-    'work_id_number': 'first',
-    'email_address': 'first',
-    'country': 'first',
-    'phone_number': 'first',
-    'average_hours_per_week': 'first',
-    'freq': 'size', # Count the infractions per employee
-}).reset_index()
-
-# Filter for employees with more than 3 infractions and join with employee_events on employee id to get all possible events for each employee
-problem_freq = problem_clocks_absences[problem_clocks_absences['freq'] > 3].copy()
-problem_freq = pd.merge(problem_freq, employee_events[['record_id_x', 'events']], on='record_id_x')
-print("Completed!")
-
-print(f"Printing results to {root_path}results.json...")
-# Format and output results
-problem_freq = problem_freq.drop(columns=['freq']) # Remove columns not in example
-problem_freq.rename(columns={'record_id_x': 'record_id'}, inplace=True) # Rename columns to match example
-json_data = problem_freq.to_json(orient='records')
-file_path = f"{root_path}results.json"
-with open(file_path, 'w') as json_file:
-    json_file.write(json_data)
-print("Completed!")
+        print(f"Evaluating {len(policies)} policies with the {args.backend} backend, one run per policy...")
+        results = {}
+        for policy in policies: # The backend applies the cutoffs, weather exclusions and window of the policy <-- Its threshold is applied to the summary
+            if args.backend == 'duckdb':
+                summary, seconds_worked = profiler.run('run_duckdb', run_duckdb, employee_data, dataset.attendance_data_path, events_data, weather_data, year=dataset.year,
+                                                       cache_dir=dataset.cache_dir, memory_limit=args.memory_limit, threads=args.workers, policy=policy)
+            else:
+                summary = profiler.run('run_calendar', run_calendar, employee_data, attendance_data, events_data, weather_data, year=dataset.year, policy=policy)
+                seconds_worked = dataset.seconds_worked
+            results[policy['name']] = profiler.run('build_results', build_results, summary, employee_data, average_hours_per_week(seconds_worked),
+                                                   threshold=policy['threshold'])
+    print("Completed!")
+
+    extension = 'ndjson' if args.ndjson else 'json'
+    for policy in policies:
+        policy_path = dataset.path(f"results_{policy['name']}.{extension}")
+        print(f"Printing the results of policy {policy['name']} to {policy_path}...")
+        profiler.run('write_results', write_results, results[policy['name']], policy_path, ndjson=args.ndjson)
+    comparison = compare_policies(policies, results)
+    with open(dataset.path('policy_comparison.json'), 'w') as f:
+        json.dump(comparison, f, indent=2)
+    for row in comparison:
+        print(f"  {row['policy']['name']:<20} {row['flagged_employees']:>6} employees flagged ({len(row['added'])} added, {len(row['removed'])} removed vs {policies[0]['name']})")
+    print(f"Completed! The comparison was written to {dataset.path('policy_comparison.json')}")
+
+# Function to run the joins and filters out of core on DuckDB, scanning the attendance from disk, and write the results
+def run_out_of_core(args, dataset, file_path):
+    profiler = dataset.profiler
+    print("Fetching employee, events and weather data...")
+    # Only the small datasets are loaded into memory <-- The attendance is scanned by DuckDB
+    employee_data, events_data, weather_data = dataset.reference_data
+    print("Completed!")
+
+    print("Counting the number of infractions per employee on DuckDB...")
+    summary, seconds_worked = profiler.run('run_duckdb', run_duckdb, employee_data, dataset.attendance_data_path, events_data, weather_data, year=dataset.year,
+                                           cache_dir=dataset.cache_dir, memory_limit=args.memory_limit, threads=args.workers)
+    results = profiler.run('build_results', build_results, summary, employee_data, average_hours_per_week(seconds_worked))
+    print("Completed!")
+
+    print(f"Printing results to {file_path}...")
+    profiler.run('write_results', write_results, results, file_path, ndjson=args.ndjson)
+    print("Completed!")
+
+# Function to find the candidate infractions with the calendar matrices instead of the joins and write the results
+def run_calendar_matrices(args, dataset, file_path):
+    profiler = dataset.profiler
+    print("Fetching employee, attendance, events and weather data...")
+    # Fetch employee and attendance data from local storage and events and weather data from URLs concurrently, keeping only 2023 records
+    employee_data, attendance_data, events_data, weather_data = dataset.datasets
+    print("Completed!")
+
+    print("Counting the number of infractions per employee with the calendar matrices...")
+    summary = profiler.run('run_calendar', run_calendar, employee_data, attendance_data, events_data, weather_data, year=dataset.year)
+    results = profiler.run('build_results', build_results, summary, employee_data, average_hours_per_week(dataset.seconds_worked))
+    print("Completed!")
+
+    print(f"Printing results to {file_path}...")
+    profiler.run('write_results', write_results, results, file_path, ndjson=args.ndjson)
+    print("Completed!")
+
+# Function to run the analysis in a process pool, one shard at a time, and write the results
+def run_in_shards(args, dataset, file_path):
+    profiler = dataset.profiler
+    print("Fetching employee, attendance, events and weather data...")
+    # Fetch employee and attendance data from local storage and events and weather data from URLs concurrently, keeping only 2023 records
+    employee_data, attendance_data, events_data, weather_data = dataset.datasets
+    print("Completed!")
+
+    print(f"Counting the number of infractions per employee in shards by {args.shard_by}...")
+    summary, seconds_worked = profiler.run('run_sharded', run_sharded, employee_data, attendance_data, events_data, weather_data, year=dataset.year,
+                                           shard_by=args.shard_by, shards=args.shards, max_workers=args.workers)
+    results = profiler.run('build_results', build_results, summary, employee_data, average_hours_per_week(seconds_worked))
+    print("Completed!")
+
+    print(f"Printing results to {file_path}...")
+    profiler.run('write_results', write_results, results, file_path, ndjson=args.ndjson)
+    print("Completed!")
+
+# Function to run the full analysis and write the results
+# (The datasets and intermediate frames come from the dataset, see pnl/dataset.py <-- Computed once and shared with the other stages of the process)
+def run_full(args, dataset, file_path):
+    profiler = dataset.profiler
+    print("Fetching employee, attendance, events and weather data...")
+    # Fetch employee and attendance data from local storage and events and weather data from URLs concurrently, keeping only 2023 records
+    employee_data, attendance_data, events_data, weather_data = dataset.datasets
+    print("Completed!")
+
+    # Add the previous and following clock dates to the events data <-- This gives us clock dates before, after and of an event
+    # Join events_data and weather_data and filter out weekend dates and dates with extreme weather <-- This gives us the weekdays before, after and of an event with good weather
+    events_weather = dataset.events_weather
+
+    # Roll up the seconds worked, late arrivals, early departures and absences of each employee per week <-- The average hours per week are needed in the final result
+    rollups = dataset.rollups
+    seconds_worked = rollups.total_seconds_worked()
+
+    # Join employee_data and attendance_data and filter for late clock ins and early clock outs and absences <-- This gives us all problematic clocks and absences and the employee details needed for final result
+    employee_attendance = dataset.employee_attendance
+    if args.drilldown: # List the seconds worked and the employee's average hours per week next to each problem clock
+        employee_attendance = profiler.run('add_hours_worked', add_hours_worked, employee_attendance, seconds_worked)
+
+    print("Checking for problematic employee clocks and absences on weekdays with good weather the day before after and of an event in their country...")
+    # Join employee_attendance with events_weather on clock_date and country <-- This give us all the problematic clocks and absences on weekdays with good weather the day before, after and of an event
+    if args.drilldown: # The extra drilldown columns are ignored by the later stages, which only use the candidate columns
+        dataset.remember('problem_clocks_absences', profiler.run('find_problem_clocks_absences', find_problem_clocks_absences, employee_attendance, events_weather))
+    problem_clocks_absences = dataset.problem_clocks_absences
+    chosen = dataset.chosen # Choose one clock date per event and one event per clock date (a maximum matching)
+    if args.drilldown: # Print the drilldown for double-checking from a background thread while the infractions are counted
+        drilldown_file = drilldown_path(dataset.data_dir, args.drilldown)
+        try:
+            drilldown = select_drilldown_columns(problem_clocks_absences.assign(infraction=chosen), args.drilldown_columns, args.drilldown) # Mark the chosen (clock date, event) pairs
+        except ValueError as e:
+            sys.exit(str(e))
+        drilldown_future = start_drilldown(drilldown, drilldown_file, args.drilldown, profiler)
+    print("Completed!")
+
+    print("Counting the number of infractions per employee..")
+    # Count the number of infractions and list the possibly attended events per employee (An employee should not incur more than one infraction for the same clock date or the same event)
+    summary = dataset.summary
+
+    # Filter for employees with more than 3 infractions and add their details, average hours per week and possibly attended events
+    results = dataset.results
+    if args.state_dir: # Save the state needed to update the results incrementally
+        profiler.run('save_state', save_state, build_state(events_data, weather_data, employee_attendance, problem_clocks_absences, rollups, summary, year=dataset.year), args.state_dir)
+    print("Completed!")
+
+    print(f"Printing results to {file_path}...")
+    # Format and output results
+    profiler.run('write_results', write_results, results, file_path, ndjson=args.ndjson)
+    print("Completed!")
+
+    if args.drilldown:
+        print(f"Printing the drilldown to {drilldown_file}...")
+        drilldown_future.result() # Wait for the background write (and raise its error, if any)
+        print("Completed!")
+
+# Function to run the analysis chosen by the arguments on the dataset and write its results, returning the mode that was run
+def identify(args, dataset):
+    file_path = dataset.path('results.ndjson' if args.ndjson else 'results.json')
+    if args.policies:
+        run_policies(args, dataset)
+        return 'policies'
+    if args.incremental:
+        run_incremental(args, dataset, file_path)
+        return 'incremental'
+    if args.backend == 'duckdb':
+        run_out_of_core(args, dataset, file_path)
+        return 'duckdb'
+    if args.backend == 'calendar':
+        run_calendar_matrices(args, dataset, file_path)
+        return 'calendar'
+    if args.shard_by:
+        run_in_shards(args, dataset, file_path)
+        return f"sharded by {args.shard_by}"
+    run_full(args, dataset, file_path)
+    return 'full'
+
+# Function to write the profiles asked for with --cprofile and --profile
+def write_profiles(args, dataset, mode, arguments):
+    if args.cprofile:
+        dataset.profiler.dump_cprofile(args.cprofile)
+        print(f"cProfile stats written to {args.cprofile}")
+    if args.profile:
+        dataset.profiler.write(dataset.path('profile.json'), mode=mode, arguments=arguments)
+        print(f"Stage profile written to {dataset.path('profile.json')}")
+
+def main(argv=None):
+    args = parse_args(argv)
+    dataset = Dataset(args.data_dir, profiler=Profiler(enabled=args.profile)) # Records each stage with --profile, otherwise only runs it
+
+    if args.serve is not None: # Keep the datasets in memory and answer queries until interrupted
+        print("Fetching employee, attendance, events and weather data and indexing the results...")
+        service = QueryService(dataset.employee_data_path, dataset.attendance_data_path, dataset.events_url, dataset.weather_url, year=dataset.year,
+                               cache_dir=dataset.cache_dir, refresh_interval=args.refresh_interval)
+        service.load()
+        print("Completed!")
+        service.serve(args.host, args.serve)
+        return
+
+    if args.cprofile:
+        dataset.profiler.start_cprofile()
+    mode = identify(args, dataset)
+    write_profiles(args, dataset, mode, sys.argv[1:] if argv is None else argv)
+
+if __name__ == "__main__": # Guard so that worker processes can import this script without running it
+    main()
@@ -0,0 +1,4 @@
+"""
+Package Name: pnl
+Description: Shared code for the employee behavior analysis scripts (identify_employees.py, test_results.py, pnlanalyze.py and run_pipeline.py).
+"""
@@ -0,0 +1,150 @@
+"""
+Module Name: pnl/cache.py
+Description: Typed, partitioned columnar cache of the input datasets.
+
+Each dataset is stored once as Parquet files partitioned by year and/or country, together with a manifest recording the
+checksum of the source it was built from. When the source checksum is unchanged, later runs read only the partitions
+they need (the year filter is pushed down to the Parquet reader) and the data is memory-mapped instead of re-parsed.
+When the source changes, the dataset is rebuilt. Rows with a missing partition key (e.g. an employee without a country)
+are stored under NULL_PARTITION and read back as NaN, and a cached dataset that cannot be read is loaded from its source.
+
+pyarrow is an optional dependency. Without it cache_available() returns False and callers parse the sources directly.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import pandas as pd
+from pnl.compact import years
+
+try:
+    import pyarrow.parquet # noqa: F401 <-- Only needed to check that the Parquet engine is installed
+except ImportError:
+    pyarrow = None
+
+CACHE_FORMAT_VERSION = 2 # Bump to invalidate every cached dataset when the stored layout changes
+ROW_COLUMN = '_row' # Position of each row in the source, used to restore the source order across partitions
+NULL_PARTITION = '__null__' # Stored partition value of a missing partition key (e.g. an employee without a country), read back as NaN
+
+# Function to check whether the Parquet engine needed by the cache is installed
+def cache_available():
+    return pyarrow is not None
+
+# Function to calculate the checksum of a file on disk without reading it into memory at once
+def file_checksum(data_path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(data_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# Function to calculate the checksum of a payload already in memory (e.g. the body of an HTTP response)
+def content_checksum(content):
+    return hashlib.sha256(content).hexdigest()
+
+def _dataset_dir(cache_dir, name):
+    return os.path.join(cache_dir, name)
+
+def _manifest_path(cache_dir, name):
+    return os.path.join(cache_dir, f"{name}.manifest.json")
+
+# Function to read the manifest of a cached dataset, returning None if the dataset is not cached
+def _read_manifest(cache_dir, name):
+    try:
+        with open(_manifest_path(cache_dir, name), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+# Function to read a cached dataset if it was built from a source with the given checksum, returning None otherwise
+def read_cached_dataset(cache_dir, name, checksum, year=None):
+    manifest = _read_manifest(cache_dir, name)
+    if manifest is None or manifest['checksum'] != checksum or manifest['version'] != CACHE_FORMAT_VERSION:
+        return None
+    if not manifest['row_count']:
+        return pd.DataFrame(columns=manifest['columns'])
+    filters = None
+    if year is not None and 'year' in manifest['partition_cols']:
+        filters = [('year', '==', year)] # Push the year filter down so only that year's partitions are read
+    df = pd.read_parquet(_dataset_dir(cache_dir, name), filters=filters, memory_map=True)
+    df = df.sort_values(ROW_COLUMN, kind='stable') # Restore the source order of the rows
+    for col in manifest['partition_cols']: # Turn the missing partition keys back into NaN
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            if NULL_PARTITION in df[col].cat.categories:
+                df[col] = df[col].cat.remove_categories([NULL_PARTITION])
+        else:
+            df[col] = df[col].mask(df[col] == NULL_PARTITION)
+    return df[manifest['columns']].reset_index(drop=True)
+
+# Function to get the directory of the Parquet files of a cached dataset built from a source with the given checksum,
+# returning None if the dataset is not cached, is stale or has no rows <-- Lets other engines read the files directly
+def cached_dataset_dir(cache_dir, name, checksum):
+    manifest = _read_manifest(cache_dir, name)
+    if manifest is None or manifest['checksum'] != checksum or manifest['version'] != CACHE_FORMAT_VERSION or not manifest['row_count']:
+        return None
+    return _dataset_dir(cache_dir, name)
+
+# Function to replace the missing partition keys with NULL_PARTITION <-- Partitions with a null key cannot be read back
+def _fill_null_partitions(df, partition_cols):
+    for col in partition_cols:
+        if not df[col].isna().any():
+            continue
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].cat.add_categories([NULL_PARTITION]).fillna(NULL_PARTITION)
+        else:
+            df[col] = df[col].astype(object).fillna(NULL_PARTITION)
+    return df
+
+# Function to (re)write a cached dataset from an iterable of typed DataFrames and record the checksum of its source
+def write_cached_dataset(cache_dir, name, checksum, frames, partition_cols, date_column=None):
+    dataset_dir = _dataset_dir(cache_dir, name)
+    manifest_path = _manifest_path(cache_dir, name)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path) # Invalidate the old dataset before touching its files
+    shutil.rmtree(dataset_dir, ignore_errors=True)
+    os.makedirs(dataset_dir, exist_ok=True)
+
+    columns = None
+    row_count = 0
+    for batch_number, df in enumerate(frames):
+        if columns is None:
+            columns = list(df.columns)
+        if df.empty:
+            continue
+        df = df.copy()
+        df[ROW_COLUMN] = range(row_count, row_count + len(df))
+        if 'year' in partition_cols:
+            df['year'] = years(df[date_column])
+        df = _fill_null_partitions(df, partition_cols)
+        df.to_parquet(dataset_dir, engine='pyarrow', index=False, partition_cols=list(partition_cols),
+                      basename_template=f"part-{batch_number:06d}-{{i}}.parquet")
+        row_count += len(df)
+
+    manifest = {
+        'version': CACHE_FORMAT_VERSION,
+        'checksum': checksum,
+        'columns': columns or [],
+        'partition_cols': list(partition_cols),
+        'row_count': row_count,
+    }
+    with open(f"{manifest_path}.tmp", "w") as f:
+        json.dump(manifest, f)
+    os.replace(f"{manifest_path}.tmp", manifest_path) # Write the manifest last so a partially written dataset is never used
+
+# Function to load a dataset through the cache, building it with build(year) when the cache is missing or stale
+# source_checksum() returns the checksum of the source and is only called when the cache is used
+# build(year) must return a non-empty iterable of typed DataFrames, restricted to the given year unless year is None
+def load_cached_dataset(cache_dir, name, source_checksum, build, partition_cols, date_column=None, year=None):
+    if cache_dir is None or not cache_available():
+        return pd.concat(list(build(year)), ignore_index=True)
+    checksum = source_checksum()
+    try:
+        df = read_cached_dataset(cache_dir, name, checksum, year)
+        if df is None:
+            write_cached_dataset(cache_dir, name, checksum, build(None), partition_cols, date_column) # Cache every year of the source
+            df = read_cached_dataset(cache_dir, name, checksum, year)
+    except (OSError, ValueError) as e: # The cache is only a copy of the source <-- Never fail a run because of it
+        print(f"Error reading the cached {name} dataset ({e}). Loading it from the source.")
+        return pd.concat(list(build(year)), ignore_index=True)
+    return df
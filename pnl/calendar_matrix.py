@@ -0,0 +1,108 @@
+"""
+Module Name: pnl/calendar_matrix.py
+Description: Dense calendar-matrix engine for finding the candidate infractions without expanding or merging the events.
+
+Instead of tripling the events and merging them with the weather and the attendance on (date, country), run_calendar()
+builds two boolean matrices over the days of the year:
+- eligible: countries x days, True on the weekdays with good weather (a weather record, no excused condition and not over
+  the temperature cap) in the country,
+- problems: employees x days, True on the days the employee clocked in late, clocked out early or was absent.
+The problem days of the employees of a country are ANDed with the eligible days of that country once, and the candidate
+(clock date, event) pairs of an event are the True cells of the window of days around it (a slice of that matrix, read
+by indexed row lookups). The window width is a slice bound, so wider windows cost no extra copies of the events.
+Memory is predictable: one byte per employee per day of the year, whatever the number of events.
+
+The candidates are then matched and summarized like those of the pipeline (pnl/matching.py and pnl/pipeline.py), so the
+results are the same. The policy (cutoffs, weather exclusions, window and threshold) is a spec of pnl/policies.py.
+"""
+
+import numpy as np
+import pandas as pd
+from pnl.compact import MISSING_CLOCK, clock_seconds, day_of_week, year_bounds
+from pnl.matching import match_infractions
+from pnl.pipeline import CANDIDATE_COLUMNS, summarize_infractions, unique_employees
+from pnl.policies import DEFAULT_POLICY
+
+# Function to get the code of each value of a country column among the given countries (-1 for other countries)
+def country_codes(values, countries):
+    return pd.Categorical(values.astype(object), categories=countries).codes.astype(np.int64)
+
+# Function to build the countries x days matrix of the weekdays of the year with good weather in each country
+def eligible_days(weather_data, countries, year=2023, policy=DEFAULT_POLICY):
+    first_day, end_day = year_bounds(year)
+    days = weather_data['date'].to_numpy().astype(np.int64)
+    codes = country_codes(weather_data['country'], countries)
+    good = (
+        ~weather_data['condition'].isin(policy['extreme_weather']).to_numpy() &
+        (weather_data['max_temp'] <= policy['max_temp']).to_numpy() &
+        (codes >= 0) & (days >= first_day) & (days < end_day)
+    )
+    eligible = np.zeros((len(countries), end_day - first_day), dtype=bool)
+    eligible[codes[good], days[good] - first_day] = True # Any good weather record makes the day eligible
+    eligible &= day_of_week(np.arange(first_day, end_day)) < 5 # Keep the weekdays
+    return eligible
+
+# Function to build the employees x days matrix of the problem clocks (late clock in, early clock out or absence) of the year
+# employee_ids are the sorted ids of the rows
+def problem_days(employee_ids, attendance_data, year=2023, policy=DEFAULT_POLICY):
+    first_day, end_day = year_bounds(year)
+    clock_in = attendance_data['clock_in'].to_numpy()
+    clock_out = attendance_data['clock_out'].to_numpy()
+    days = attendance_data['date'].to_numpy().astype(np.int64)
+    problem = (
+        (clock_in > clock_seconds(policy['late_clock_in'])) |
+        ((clock_out != MISSING_CLOCK) & (clock_out < clock_seconds(policy['early_clock_out']))) |
+        ((clock_in == MISSING_CLOCK) & (clock_out == MISSING_CLOCK))
+    ) & (days >= first_day) & (days < end_day)
+    record_employees = attendance_data['employee_record_id'].to_numpy()[problem]
+    rows = np.minimum(np.searchsorted(employee_ids, record_employees), max(len(employee_ids) - 1, 0))
+    known = employee_ids[rows] == record_employees if len(employee_ids) else np.zeros(len(rows), dtype=bool) # Skip employees not in employee data
+    problems = np.zeros((len(employee_ids), end_day - first_day), dtype=bool)
+    problems[rows[known], days[problem][known] - first_day] = True
+    return problems
+
+# Function to find the candidate (clock date, event) pairs with the calendar matrices, returning them with the CANDIDATE_COLUMNS of the pipeline
+def find_candidates(employee_data, attendance_data, events_data, weather_data, year=2023, policy=DEFAULT_POLICY):
+    first_day, end_day = year_bounds(year)
+    employees = unique_employees(employee_data) # First row of each employee id, like the other engines
+    countries = employees['country'].dropna().astype(object).unique().tolist()
+    employee_ids = employees['record_id'].to_numpy()
+    order = np.argsort(employee_ids, kind='stable')
+    employee_ids = employee_ids[order]
+    employee_countries = country_codes(employees['country'], countries)[order]
+    eligible = eligible_days(weather_data, countries, year, policy)
+    problems = problem_days(employee_ids, attendance_data, year, policy)
+
+    event_codes = country_codes(events_data['country'], countries)
+    event_dates = events_data['event_date'].to_numpy().astype(np.int64)
+    window_days = policy['window_days']
+    record_ids, clock_dates, event_rows = [], [], []
+    for code in np.unique(event_codes[event_codes >= 0]):
+        rows = np.flatnonzero(employee_countries == code) # Employees of the country
+        country_problems = problems[rows] & eligible[code] # Problem clocks on the eligible days of the country
+        for event_row in np.flatnonzero(event_codes == code):
+            start = max(event_dates[event_row] - window_days - first_day, 0)
+            end = min(event_dates[event_row] + window_days + 1 - first_day, end_day - first_day)
+            if start >= end:
+                continue
+            employee_rows, window_offsets = np.nonzero(country_problems[:, start:end]) # The window of days around the event
+            record_ids.append(employee_ids[rows[employee_rows]])
+            clock_dates.append(window_offsets + start + first_day)
+            event_rows.append(np.full(len(employee_rows), event_row))
+    if not record_ids:
+        return pd.DataFrame({col: pd.Series(dtype='int64') for col in CANDIDATE_COLUMNS})
+    events = events_data.iloc[np.concatenate(event_rows)].reset_index(drop=True)
+    return pd.DataFrame({
+        'record_id_x': np.concatenate(record_ids),
+        'clock_date': np.concatenate(clock_dates).astype(np.int32),
+        'event_id': events['id'].to_numpy(),
+        'event_name': events['event_name'].to_numpy(),
+        'event_date': events['event_date'].to_numpy(),
+        'country': events['country'],
+    })[CANDIDATE_COLUMNS]
+
+# Function to run the analysis of the given year with the calendar matrices, returning the summary of each employee with
+# candidates (like pipeline.summarize_infractions)
+def run_calendar(employee_data, attendance_data, events_data, weather_data, year=2023, policy=DEFAULT_POLICY):
+    candidates = find_candidates(employee_data, attendance_data, events_data, weather_data, year, policy)
+    return summarize_infractions(candidates, match_infractions(candidates))
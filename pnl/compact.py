@@ -0,0 +1,104 @@
+"""
+Module Name: pnl/compact.py
+Description: Compact in-memory representation of the datasets.
+
+The loaders in pnl/fetch.py return the datasets with:
+- dates (date, event_date) as int32 day numbers (days since 1970-01-01),
+- clocks (clock_in, clock_out) as int32 seconds since midnight, with MISSING_CLOCK (-1) for a missing clock,
+- country and condition as categoricals,
+- ids as int32 (when they fit).
+so that the per-row working set is a few bytes per column and the date, weekday and clock filters are plain NumPy
+comparisons on integers. The functions below convert between this representation and strings or datetimes.
+"""
+
+import numpy as np
+import pandas as pd
+
+MISSING_CLOCK = -1 # Value of a missing clock in or clock out
+CATEGORICAL_COLUMNS = ['country', 'condition']
+ID_COLUMNS = ['id', 'record_id', 'employee_record_id']
+DATE_COLUMNS = ['date', 'event_date', 'clock_date']
+CLOCK_COLUMNS = ['clock_in', 'clock_out']
+_CLOCK_ORIGIN = pd.Timestamp('1900-01-01') # Date pd.to_datetime gives to times parsed without a date
+
+# Function to convert date strings ('%Y-%m-%d') to day numbers
+def parse_dates(dates):
+    days = pd.to_datetime(dates, format='%Y-%m-%d').to_numpy().astype('datetime64[D]').astype(np.int32)
+    return pd.Series(days, index=dates.index if isinstance(dates, pd.Series) else None)
+
+# Function to convert clock strings ('%H:%M:%S') to seconds since midnight, with MISSING_CLOCK for missing clocks
+def parse_clocks(clocks):
+    seconds = (pd.to_datetime(clocks, format='%H:%M:%S') - _CLOCK_ORIGIN).dt.total_seconds()
+    return seconds.fillna(MISSING_CLOCK).astype(np.int32)
+
+# Function to convert a time string ('%H:%M:%S') to seconds since midnight
+def clock_seconds(clock):
+    hours, minutes, seconds = (int(part) for part in clock.split(':'))
+    return hours * 3600 + minutes * 60 + seconds
+
+# Function to get the day numbers of the first day of a year and of the following year
+def year_bounds(year):
+    return int(np.datetime64(f"{year:04d}-01-01", 'D').astype(np.int64)), int(np.datetime64(f"{year + 1:04d}-01-01", 'D').astype(np.int64))
+
+# Function to check which day numbers fall in the given year
+def in_year(days, year):
+    first_day, end_day = year_bounds(year)
+    return (days >= first_day) & (days < end_day)
+
+# Function to get the year of each day number
+def years(days):
+    return np.asarray(days).astype('datetime64[D]').astype('datetime64[Y]').astype(np.int64) + 1970
+
+# Function to get the day of the week (Monday=0, Sunday=6) of each day number <-- Day 0 (1970-01-01) was a Thursday
+def day_of_week(days):
+    return (days + 3) % 7
+
+# Function to convert day numbers to date strings ('%Y-%m-%d')
+def format_dates(days):
+    return np.datetime_as_string(np.asarray(days).astype('datetime64[D]'), unit='D')
+
+# Function to convert day numbers to datetimes
+def to_datetimes(days):
+    return pd.Series(np.asarray(days).astype('datetime64[D]'), index=getattr(days, 'index', None)).astype('datetime64[s]')
+
+# Function to convert seconds since midnight to datetimes on 1900-01-01 (NaT for missing clocks), as pd.to_datetime parses times
+def to_clock_datetimes(seconds):
+    return (_CLOCK_ORIGIN + pd.to_timedelta(seconds.where(seconds != MISSING_CLOCK), unit='s')).astype('datetime64[s]')
+
+# Function to convert an id column to int32 if its values fit
+def compact_ids(ids):
+    if pd.api.types.is_integer_dtype(ids) and (ids.empty or (ids.min() >= np.iinfo(np.int32).min and ids.max() <= np.iinfo(np.int32).max)):
+        return ids.astype(np.int32)
+    return ids
+
+# Function to convert a freshly parsed DataFrame to the compact representation (in place)
+def compact_frame(df):
+    for col in df.columns:
+        if col in DATE_COLUMNS and not pd.api.types.is_integer_dtype(df[col]):
+            df[col] = parse_dates(df[col])
+        elif col in CLOCK_COLUMNS and not pd.api.types.is_integer_dtype(df[col]):
+            df[col] = parse_clocks(df[col])
+        elif col in CATEGORICAL_COLUMNS:
+            df[col] = df[col].astype('category')
+        elif col in ID_COLUMNS:
+            df[col] = compact_ids(df[col])
+    return df
+
+# Function to give the same categories to a categorical column of several DataFrames (in place), so they can be joined on their codes
+def unify_categories(frames, column):
+    frames = [df for df in frames if column in df.columns]
+    categories = sorted(set().union(*(df[column].dropna().unique().tolist() for df in frames)))
+    dtype = pd.CategoricalDtype(categories)
+    for df in frames:
+        df[column] = df[column].astype(dtype)
+
+# Function to convert the compact date and clock columns of a DataFrame back to datetimes (for code that still works on datetimes)
+def expand_dates_and_clocks(df):
+    df = df.copy()
+    for col in df.columns:
+        name = col[:-2] if col.endswith(('_x', '_y')) else col # Columns suffixed by a merge
+        if name in DATE_COLUMNS and pd.api.types.is_integer_dtype(df[col]):
+            df[col] = to_datetimes(df[col])
+        elif name in CLOCK_COLUMNS and pd.api.types.is_integer_dtype(df[col]):
+            df[col] = to_clock_datetimes(df[col])
+    return df
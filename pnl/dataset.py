@@ -0,0 +1,166 @@
+"""
+Module Name: pnl/dataset.py
+Description: Lazily loaded datasets and memoized intermediate frames, shared by the stages run in one process.
+
+pnlanalyze.py, identify_employees.py and test_results.py each load and parse the four datasets, so an analyze -> identify ->
+validate cycle run as three scripts loads everything three times. A Dataset holds the data directory, the URLs and the year
+and loads nothing until a stage asks for a value:
+- employee_data, events_data and weather_data only load the three small datasets (e.g. for the DuckDB backend, which scans
+  the attendance itself), attendance_data loads the attendance too (the four concurrently, see pnl/fetch.py),
+- sources are the checksums of the four inputs (enough for pnlanalyze.py to reuse a saved report without loading anything),
+- events_weather, employee_attendance, problem_clocks_absences, chosen, summary, rollups, results... are the intermediate
+  frames of the analysis (pnl/pipeline.py), and expected_infractions the recomputed infractions of pnl/validation.py.
+Each value is computed on first use (recorded as a stage by the profiler) and every later use, by the same or another
+stage, returns the same object. The memoized frames are shared, so the stages must not modify them in place.
+
+run_pipeline.py runs the three stages on one Dataset.
+"""
+
+import os
+import threading
+from pnl.compact import unify_categories
+from pnl.fetch import EVENTS_URL, WEATHER_URL, load_attendance_data, load_datasets, load_employee_data, load_events_data, load_weather_data, source_checksums
+from pnl.matching import match_infractions
+from pnl.pipeline import (average_hours_per_week, build_results, expand_event_windows, filter_problem_attendance, find_problem_clocks_absences,
+                          join_events_weather, summarize_infractions)
+from pnl.profiling import Profiler
+from pnl.quality import profile_datasets
+from pnl.rollups import WeeklyRollups
+from pnl.validation import recompute_infractions
+
+CACHE_DIR_NAME = '.pnl_cache' # Typed columnar copies of the datasets are cached here between runs
+
+# Class to load the datasets of a data directory and compute the intermediate frames of the analysis once, on first use
+class Dataset:
+    def __init__(self, data_dir='.', events_url=EVENTS_URL, weather_url=WEATHER_URL, year=2023, cache_dir=None, profiler=None):
+        self.data_dir = data_dir
+        self.events_url = events_url
+        self.weather_url = weather_url
+        self.year = year
+        self.cache_dir = cache_dir if cache_dir is not None else self.path(CACHE_DIR_NAME)
+        self.profiler = profiler or Profiler(enabled=False)
+        self._values = {} # Name -> memoized value
+        self._lock = threading.RLock() # Held while a value is computed <-- Values computed from other values take it again
+
+    # Function to get the path of a file in the data directory
+    def path(self, file_name):
+        return os.path.join(self.data_dir, file_name)
+
+    @property
+    def employee_data_path(self):
+        return self.path('employees.json')
+
+    @property
+    def attendance_data_path(self):
+        return self.path('attendance.json')
+
+    # Function to get the memoized value of the given name, computing it with func (recorded as the given profiler stage) on first use
+    def memoize(self, name, func, *args, stage=None, **kwargs):
+        with self._lock:
+            if name not in self._values:
+                self._values[name] = self.profiler.run(stage or name, func, *args, **kwargs)
+            return self._values[name]
+
+    # Function to store a value computed outside the dataset (e.g. with extra drilldown columns) unless one is already memoized
+    def remember(self, name, value):
+        with self._lock:
+            return self._values.setdefault(name, value)
+
+    # Function to check whether a value has been computed
+    def is_loaded(self, name):
+        return name in self._values
+
+    # Function to load the employees, events and weather (the small datasets), with the same country categories
+    def _load_reference_data(self):
+        employee_data = self.profiler.run('fetch_employees', load_employee_data, self.employee_data_path, self.cache_dir)
+        events_data = self.profiler.run('fetch_events', load_events_data, self.events_url, year=self.year, cache_dir=self.cache_dir)
+        weather_data = self.profiler.run('fetch_weather', load_weather_data, self.weather_url, year=self.year, cache_dir=self.cache_dir)
+        unify_categories([employee_data, events_data, weather_data], 'country') # Join on the category codes of country
+        return employee_data, events_data, weather_data
+
+    # Function to load the four datasets, only loading the attendance if the small datasets are already loaded
+    def _load_datasets(self):
+        if self.is_loaded('reference_data'):
+            employee_data, events_data, weather_data = self._values['reference_data']
+            attendance_data = self.profiler.run('fetch_attendance', load_attendance_data, self.attendance_data_path, self.year, self.cache_dir)
+            return employee_data, attendance_data, events_data, weather_data
+        return load_datasets(self.employee_data_path, self.attendance_data_path, self.events_url, self.weather_url, year=self.year,
+                             cache_dir=self.cache_dir, profiler=self.profiler)
+
+    @property
+    def sources(self):
+        return self.memoize('sources', source_checksums, self.employee_data_path, self.attendance_data_path, self.events_url, self.weather_url, cache_dir=self.cache_dir)
+
+    @property
+    def datasets(self):
+        return self.memoize('datasets', self._load_datasets, stage='load_datasets')
+
+    @property
+    def reference_data(self):
+        with self._lock:
+            if self.is_loaded('datasets'): # Already loaded with the attendance
+                employee_data, _, events_data, weather_data = self._values['datasets']
+                return employee_data, events_data, weather_data
+            return self.memoize('reference_data', self._load_reference_data, stage='load_reference_data')
+
+    @property
+    def employee_data(self):
+        return self.reference_data[0]
+
+    @property
+    def attendance_data(self):
+        return self.datasets[1]
+
+    @property
+    def events_data(self):
+        return self.reference_data[1]
+
+    @property
+    def weather_data(self):
+        return self.reference_data[2]
+
+    @property
+    def event_windows(self):
+        return self.memoize('event_windows', expand_event_windows, self.events_data, year=self.year, stage='expand_event_windows')
+
+    @property
+    def events_weather(self):
+        return self.memoize('events_weather', join_events_weather, self.event_windows, self.weather_data, stage='join_events_weather')
+
+    @property
+    def rollups(self):
+        return self.memoize('rollups', WeeklyRollups.from_attendance, self.attendance_data, stage='build_rollups')
+
+    @property
+    def seconds_worked(self):
+        return self.rollups.total_seconds_worked()
+
+    @property
+    def employee_attendance(self):
+        return self.memoize('employee_attendance', filter_problem_attendance, self.employee_data, self.attendance_data, stage='filter_problem_attendance')
+
+    @property
+    def problem_clocks_absences(self):
+        return self.memoize('problem_clocks_absences', find_problem_clocks_absences, self.employee_attendance, self.events_weather, stage='find_problem_clocks_absences')
+
+    @property
+    def chosen(self):
+        return self.memoize('chosen', match_infractions, self.problem_clocks_absences, stage='match_infractions')
+
+    @property
+    def summary(self):
+        return self.memoize('summary', summarize_infractions, self.problem_clocks_absences, self.chosen, stage='summarize_infractions')
+
+    @property
+    def results(self):
+        return self.memoize('results', build_results, self.summary, self.employee_data, average_hours_per_week(self.seconds_worked), stage='build_results')
+
+    @property
+    def quality_report(self):
+        return self.memoize('quality_report', profile_datasets, self.employee_data, self.attendance_data, self.events_data, self.weather_data, year=self.year,
+                            stage='profile_datasets')
+
+    @property
+    def expected_infractions(self):
+        return self.memoize('expected_infractions', recompute_infractions, self.employee_data, self.attendance_data, self.events_data, self.weather_data,
+                            stage='recompute_infractions')
@@ -0,0 +1,65 @@
+"""
+Module Name: pnl/drilldown.py
+Description: Opt-in drilldown output of the problem clocks and absences joined with events and weather.
+
+The drilldown (every problem clock or absence, the events around it and the weather of the day, with the chosen
+infractions marked) is only needed for manual double-checking, so identify_employees.py writes it only when asked with
+--drilldown FORMAT, optionally restricted to some columns with --drilldown-columns:
+- csv: drilldown.csv, as before,
+- csv.gz: drilldown.csv.gz, gzip-compressed,
+- parquet: a drilldown directory of zstd-compressed Parquet files partitioned by country (needs pyarrow).
+The file is written from a background thread (start_drilldown()) while the infractions are counted and the results are
+written, so the I/O is off the critical path of the run.
+"""
+
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from pnl.cache import cache_available
+from pnl.compact import expand_dates_and_clocks
+from pnl.profiling import Profiler
+
+DRILLDOWN_FORMATS = ['csv', 'csv.gz', 'parquet']
+
+# Function to get the path the drilldown is written to in the given format, in the given data directory
+def drilldown_path(data_dir, fmt):
+    return os.path.join(data_dir, 'drilldown' if fmt == 'parquet' else f"drilldown.{fmt}")
+
+# Function to check that a drilldown format can be written, returning an error message or None
+def check_drilldown_format(fmt):
+    if fmt not in DRILLDOWN_FORMATS:
+        return f"Unknown drilldown format: {fmt} (choose from {', '.join(DRILLDOWN_FORMATS)})"
+    if fmt == 'parquet' and not cache_available(): # The cache and the parquet drilldown both need the Parquet engine
+        return "The parquet drilldown format needs pyarrow. Install it or use --drilldown csv.gz"
+    return None
+
+# Function to select the drilldown columns (all if columns is None), raising ValueError for unknown columns
+# The country column is always kept in the parquet format, which is partitioned by it
+def select_drilldown_columns(problem_clocks_absences, columns=None, fmt='csv'):
+    if columns is None:
+        return problem_clocks_absences.copy()
+    unknown = [col for col in columns if col not in problem_clocks_absences.columns]
+    if unknown:
+        raise ValueError(f"Unknown drilldown columns: {', '.join(unknown)}. Available columns: {', '.join(problem_clocks_absences.columns)}")
+    if fmt == 'parquet' and 'country' not in columns:
+        columns = list(columns) + ['country']
+    return problem_clocks_absences[list(columns)].copy()
+
+# Function to write the drilldown in the given format, with readable dates and clocks
+def write_drilldown(drilldown, file_path, fmt='csv'):
+    drilldown = expand_dates_and_clocks(drilldown)
+    if fmt == 'parquet':
+        shutil.rmtree(file_path, ignore_errors=True) # Remove the partitions of a previous run
+        drilldown.to_parquet(file_path, engine='pyarrow', index=False, partition_cols=['country'], compression='zstd')
+    else:
+        drilldown.to_csv(file_path, index=False) # Compression is inferred from the .gz extension
+    return file_path
+
+# Function to start writing the drilldown in a background thread, returning a future of its path
+# (profiler can record the write as a stage, see pnl/profiling.py)
+def start_drilldown(drilldown, file_path, fmt='csv', profiler=None):
+    profiler = profiler or Profiler(enabled=False)
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='drilldown')
+    future = executor.submit(profiler.run, 'write_drilldown', write_drilldown, drilldown, file_path, fmt)
+    executor.shutdown(wait=False) # The thread exits once the drilldown is written
+    return future
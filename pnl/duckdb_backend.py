@@ -0,0 +1,115 @@
+"""
+Module Name: pnl/duckdb_backend.py
+Description: Out-of-core execution of the analysis on an embedded DuckDB database.
+
+The pandas pipeline needs the attendance of the year, the event windows and the merge of the problem attendance with the
+event windows in memory at once. run_duckdb() runs the same stages as SQL queries instead:
+- the event window expansion (day before, of and after each event by default, kept in the year),
+- the join with the weather and the exclusion of weekends and extreme weather,
+- the late clock in / early clock out / absence filter of the attendance and its join with the employees and event windows,
+- the total seconds worked by each employee.
+The attendance is scanned straight from attendance.json (a JSON array or NDJSON, filtered for the year while it is read)
+or, when it is cached and unchanged, from the Parquet files of pnl/cache.py, reading only the partition of the year.
+DuckDB runs the scans, joins and aggregations on all cores and spills to a temporary directory when they exceed the
+memory limit, so the attendance never has to fit in memory. Only the candidate (clock date, event) pairs, a small part of
+the attendance, come back to pandas, where they are matched (pnl/matching.py, a sequential greedy pass) and summarized
+exactly as in the pandas pipeline, so the results are the same.
+
+The cutoffs, weather exclusions and window come from a policy of pnl/policies.py (DEFAULT_POLICY by default).
+
+duckdb is an optional dependency. Without it duckdb_available() returns False and --backend duckdb is refused.
+"""
+
+import os
+import tempfile
+import pandas as pd
+from pnl.cache import cached_dataset_dir, file_checksum
+from pnl.compact import MISSING_CLOCK, clock_seconds, year_bounds
+from pnl.pipeline import CANDIDATE_COLUMNS, summarize_infractions, unique_employees
+from pnl.policies import DEFAULT_POLICY
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+# Function to check whether the duckdb package needed by the backend is installed
+def duckdb_available():
+    return duckdb is not None
+
+# Function to get the SQL of the attendance of the year, with dates as day numbers and clocks as seconds since midnight
+# (MISSING_CLOCK for a missing clock), read from the cached Parquet files if they are up to date or else from the JSON file
+def _attendance_source(attendance_data_path, year, cache_dir=None):
+    dataset_dir = cached_dataset_dir(cache_dir, 'attendance', file_checksum(attendance_data_path)) if cache_dir is not None else None
+    if dataset_dir is not None:
+        return (f"SELECT employee_record_id, date, clock_in, clock_out FROM read_parquet('{_sql_path(os.path.join(dataset_dir, '**', '*.parquet'))}', "
+                f"hive_partitioning = true) WHERE year = {int(year)}") # Only the partition of the year is read
+    def seconds(col):
+        return f"coalesce(hour(CAST({col} AS TIME)) * 3600 + minute(CAST({col} AS TIME)) * 60 + second(CAST({col} AS TIME)), {MISSING_CLOCK})"
+    return (f"SELECT employee_record_id, CAST(CAST(date AS DATE) - DATE '1970-01-01' AS INTEGER) AS date, "
+            f"{seconds('clock_in')} AS clock_in, {seconds('clock_out')} AS clock_out "
+            f"FROM read_json('{_sql_path(attendance_data_path)}', format = 'auto', "
+            f"columns = {{record_id: 'BIGINT', employee_record_id: 'BIGINT', date: 'VARCHAR', clock_in: 'VARCHAR', clock_out: 'VARCHAR'}}) "
+            f"WHERE date LIKE '{int(year):04d}-%'") # Filter for the year before the strings are converted
+
+# Function to quote a path for a SQL string literal
+def _sql_path(path):
+    return path.replace("'", "''")
+
+# Function to register a small pandas DataFrame as a table, with categoricals as plain strings so they join on their values
+def _register(con, name, df):
+    con.register(name, df.astype({col: object for col in df.columns if isinstance(df[col].dtype, pd.CategoricalDtype)}))
+
+# Function to run the analysis of the given year on DuckDB, returning the summary and the seconds worked by each employee
+# like run_sharded (see pnl/sharding.py). The employees, events and weather are the (small) typed DataFrames of pnl/fetch.py
+# and the attendance is scanned from attendance_data_path (or its cache). memory_limit (e.g. '4GB') and threads default to
+# DuckDB's (80% of the RAM and one thread per core); temp_dir is where DuckDB spills (default: a temporary directory).
+def run_duckdb(employee_data, attendance_data_path, events_data, weather_data, year=2023, cache_dir=None, memory_limit=None, threads=None, temp_dir=None,
+               policy=DEFAULT_POLICY):
+    first_day, end_day = year_bounds(year)
+    day_offsets = ', '.join(f"({offset})" for offset in range(-policy['window_days'], policy['window_days'] + 1))
+    extreme_weather = ', '.join("'{}'".format(condition.replace("'", "''")) for condition in policy['extreme_weather'])
+    good_condition = f"(w.condition IS NULL OR w.condition NOT IN ({extreme_weather}))" if extreme_weather else "TRUE"
+    with tempfile.TemporaryDirectory(prefix='pnl-duckdb-', dir=temp_dir) as spill_dir, duckdb.connect() as con:
+        con.execute(f"SET temp_directory = '{_sql_path(spill_dir)}'")
+        if memory_limit:
+            con.execute(f"SET memory_limit = '{memory_limit}'")
+        if threads:
+            con.execute(f"SET threads = {int(threads)}")
+        con.execute("SET preserve_insertion_order = false") # Let the joins and aggregations stream and spill freely
+        _register(con, 'employees', unique_employees(employee_data)[['record_id', 'country']]) # First row of each employee id, like the other engines
+        _register(con, 'events', events_data[['id', 'event_name', 'event_date', 'country']])
+        _register(con, 'weather', weather_data[['date', 'country', 'condition', 'max_temp']])
+        con.execute(f"CREATE TEMP VIEW attendance AS {_attendance_source(attendance_data_path, year, cache_dir)}")
+
+        # Add the previous and following clock dates to the events, join them with the weather and keep the weekdays with good weather
+        con.execute(f"""
+            CREATE TEMP TABLE events_weather AS
+            SELECT e.id AS event_id, e.event_name, e.event_date, e.country, e.event_date + o.day_offset AS clock_date
+            FROM events e CROSS JOIN (VALUES {day_offsets}) AS o(day_offset)
+            JOIN weather w ON w.date = e.event_date + o.day_offset AND w.country = e.country
+            WHERE e.event_date + o.day_offset >= {first_day} AND e.event_date + o.day_offset < {end_day}
+              AND {good_condition}
+              AND w.max_temp <= {float(policy['max_temp'])}
+              AND (e.event_date + o.day_offset + 3) % 7 < 5
+        """)
+
+        # Filter the attendance for late clock ins, early clock outs and absences and join it with the employees and the event windows
+        candidates = con.execute(f"""
+            SELECT emp.record_id AS record_id_x, ew.clock_date, ew.event_id, ew.event_name, ew.event_date, ew.country
+            FROM attendance a
+            JOIN employees emp ON emp.record_id = a.employee_record_id
+            JOIN events_weather ew ON ew.clock_date = a.date AND ew.country = emp.country
+            WHERE a.clock_in > {clock_seconds(policy['late_clock_in'])}
+               OR (a.clock_out <> {MISSING_CLOCK} AND a.clock_out < {clock_seconds(policy['early_clock_out'])})
+               OR (a.clock_in = {MISSING_CLOCK} AND a.clock_out = {MISSING_CLOCK})
+        """).df()[CANDIDATE_COLUMNS]
+
+        # Total the seconds worked by each employee (days with a missing clock count as 0 seconds)
+        seconds_worked = con.execute(f"""
+            SELECT employee_record_id,
+                   coalesce(sum(CASE WHEN clock_in <> {MISSING_CLOCK} AND clock_out <> {MISSING_CLOCK} THEN clock_out - clock_in END), 0) AS seconds
+            FROM attendance GROUP BY employee_record_id
+        """).df()
+    seconds_worked = pd.Series(seconds_worked['seconds'].to_numpy(dtype=float), index=seconds_worked['employee_record_id'].to_numpy())
+    return summarize_infractions(candidates), seconds_worked
@@ -0,0 +1,222 @@
+"""
+Module Name: pnl/fetch.py
+Description: Functions to fetch the employees, attendance, events and weather datasets and convert them to DataFrames.
+
+Attendance is by far the largest input, so it is never loaded with a single json.load. Instead the file is parsed incrementally
+(either a JSON array of records or NDJSON, one record per line) in fixed-size record batches. Each batch is filtered for the
+analysis year and given typed columns as it arrives, so records outside the analysis window never reach a DataFrame.
+
+The load_*_data functions return each dataset in the compact representation of pnl/compact.py, filtered for the analysis year, and go through the
+columnar cache in pnl/cache.py when a cache directory is given. Events and weather are fetched through the shared HTTP
+client in pnl/http_client.py, which keeps its response cache in the "http" subdirectory of the cache directory.
+load_datasets() loads all four datasets concurrently, so the load time approaches that of the slowest source.
+"""
+
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from pnl.cache import content_checksum, file_checksum, load_cached_dataset
+from pnl.compact import compact_frame, in_year, parse_dates, unify_categories
+from pnl.http_client import API_BASE_URL, DEFAULT_TTL, fetch_url_content
+from pnl.profiling import Profiler
+
+ATTENDANCE_COLUMNS = ['record_id', 'employee_record_id', 'date', 'clock_in', 'clock_out']
+DEFAULT_BATCH_SIZE = 50000 # Number of records parsed into each attendance batch
+DEFAULT_CHUNK_SIZE = 1 << 20 # Number of characters read from disk at a time
+EVENTS_URL = f"{API_BASE_URL}/events"
+WEATHER_URL = f"{API_BASE_URL}/weather"
+
+_WHITESPACE = re.compile(r'\s*') # Whitespace between the records and separators of a JSON array
+_MAX_TOKEN_LENGTH = 64 # Decode errors closer than this to the end of the buffer may be a number or literal cut by the end of the buffer
+
+# Function to fetch JSON data from the given API URL and convert it to a DataFrame
+def fetch_url_data(api_url, params=None, cache_dir=None):
+    return pd.DataFrame(json.loads(fetch_url_content(api_url, params, cache_dir=cache_dir)))
+
+# Function to fetch JSON data from local storage and convert it to a DataFrame
+def fetch_local_data(data_path):
+    with open(data_path, "r") as f:
+        data = json.load(f)
+    df = pd.DataFrame(data)
+    return df
+
+# Function to check that only whitespace follows the closing ']' of a JSON array (from pos in the buffer to the end of the file), as json.load does
+def _check_end_of_json(f, buffer, pos, offset, chunk_size):
+    while True:
+        end = _WHITESPACE.match(buffer, pos).end()
+        if end < len(buffer):
+            raise ValueError(f"Extra data after the JSON array at character {offset + end}")
+        offset += len(buffer)
+        buffer = f.read(chunk_size)
+        pos = 0
+        if not buffer:
+            return
+
+# Function to incrementally yield the records of a JSON array without holding the whole document in memory
+# Raises ValueError with the character offset in the file of a malformed record, a missing separator, a truncated array or trailing data
+def _iter_json_array(f, chunk_size):
+    decoder = json.JSONDecoder()
+    buffer = f.read(chunk_size).lstrip()
+    if not buffer.startswith('['):
+        raise ValueError("Expected a JSON array of records")
+    offset = 0 # Offset in the file of the start of the buffer
+    pos = 1
+    expected = 'first' # What comes next: 'first' (a record or ']'), 'record' (after a ',') or 'separator' (',' or ']')
+    while True:
+        pos = _WHITESPACE.match(buffer, pos).end()
+        if pos >= chunk_size or pos >= len(buffer): # Drop what was already read from the buffer and read more if it is used up
+            offset += pos
+            buffer = buffer[pos:]
+            pos = 0
+            if not buffer:
+                buffer = f.read(chunk_size)
+                if not buffer:
+                    raise ValueError(f"Unexpected end of JSON array at character {offset}")
+                continue
+        if expected == 'separator':
+            if buffer[pos] == ']':
+                _check_end_of_json(f, buffer, pos + 1, offset, chunk_size)
+                return
+            if buffer[pos] != ',':
+                raise ValueError(f"Expected ',' or ']' between the records of the JSON array at character {offset + pos}")
+            pos += 1
+            expected = 'record'
+            continue
+        if expected == 'first' and buffer[pos] == ']':
+            _check_end_of_json(f, buffer, pos + 1, offset, chunk_size)
+            return
+        try:
+            record, pos = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError as e:
+            # The record straddles the end of the buffer if the error is in its last characters (or in a string running up to the end)
+            if e.pos < len(buffer) - _MAX_TOKEN_LENGTH and not e.msg.startswith('Unterminated string'):
+                raise ValueError(f"Invalid record in the JSON array at character {offset + e.pos}: {e.msg}") from None
+            chunk = f.read(chunk_size) # <-- Read more and retry
+            if not chunk:
+                raise ValueError(f"Invalid or truncated record in the JSON array at character {offset + e.pos}: {e.msg}") from None
+            offset += pos
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            continue
+        yield record
+        expected = 'separator'
+
+# Function to yield the records of an NDJSON file (one JSON record per line)
+def _iter_ndjson(f):
+    for line in f:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+# Function to incrementally yield records from a JSON array or NDJSON file
+def iter_json_records(data_path, chunk_size=DEFAULT_CHUNK_SIZE):
+    with open(data_path, "r") as f:
+        head = f.read(chunk_size).lstrip()
+        f.seek(0)
+        if head.startswith('['):
+            yield from _iter_json_array(f, chunk_size)
+        else:
+            yield from _iter_ndjson(f)
+
+# Function to group the records of a JSON array or NDJSON file into lists of at most batch_size records
+def iter_record_batches(data_path, batch_size=DEFAULT_BATCH_SIZE):
+    batch = []
+    for record in iter_json_records(data_path):
+        batch.append(record)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+# Function to convert a list of attendance records to a DataFrame with compact date, clock and id columns
+def _typed_attendance_frame(records):
+    df = pd.DataFrame(records, columns=ATTENDANCE_COLUMNS) if not records else pd.DataFrame(records)
+    if not records:
+        df = df.astype({'record_id': 'int64', 'employee_record_id': 'int64'})
+    return compact_frame(df) # Convert 'date' to day numbers and 'clock_in'/'clock_out' to seconds since midnight
+
+# Function to stream typed attendance DataFrames from local storage in batches, keeping only the records for the given year
+# (all years if year is None). At least one, possibly empty, DataFrame is always yielded.
+def iter_attendance_frames(data_path, year=2023, batch_size=DEFAULT_BATCH_SIZE):
+    year_prefix = f"{year:04d}-" if year is not None else ""
+    yielded = False
+    for batch in iter_record_batches(data_path, batch_size):
+        # Filter the batch for the year before it becomes a DataFrame <-- Records with a missing or null date are dropped, as they are in no year
+        records = [record for record in batch if isinstance(record.get('date'), str) and record['date'].startswith(year_prefix)]
+        if records:
+            yield _typed_attendance_frame(records)
+            yielded = True
+    if not yielded:
+        yield _typed_attendance_frame([])
+
+# Function to stream attendance data from local storage in batches, keeping only the records for the given year
+def fetch_attendance_data(data_path, year=2023, batch_size=DEFAULT_BATCH_SIZE):
+    return pd.concat(list(iter_attendance_frames(data_path, year, batch_size)), ignore_index=True)
+
+# Function to convert a list of records to a compact DataFrame, keeping only the records for the given year
+def _typed_dated_frame(records, date_column, year):
+    df = pd.DataFrame(records)
+    df[date_column] = parse_dates(df[date_column]) # Convert date column to day numbers
+    if year is not None:
+        df = df[in_year(df[date_column], year)].reset_index(drop=True)
+    return compact_frame(df)
+
+# Function to get the directory of the HTTP response cache within a cache directory
+def _http_cache_dir(cache_dir):
+    return os.path.join(cache_dir, 'http') if cache_dir is not None else None
+
+# Function to load employee data from local storage, through the cache if a cache directory is given
+def load_employee_data(data_path, cache_dir=None):
+    return load_cached_dataset(cache_dir, 'employees', lambda: file_checksum(data_path),
+                               lambda year: [compact_frame(fetch_local_data(data_path))], partition_cols=['country'])
+
+# Function to load typed attendance data for the given year from local storage, through the cache if a cache directory is given
+def load_attendance_data(data_path, year=2023, cache_dir=None, batch_size=DEFAULT_BATCH_SIZE):
+    return load_cached_dataset(cache_dir, 'attendance', lambda: file_checksum(data_path),
+                               lambda year: iter_attendance_frames(data_path, year, batch_size),
+                               partition_cols=['year'], date_column='date', year=year)
+
+# Function to load typed events data for the given year from the given API URL, through the cache if a cache directory is given
+def load_events_data(api_url, year=2023, cache_dir=None):
+    content = fetch_url_content(api_url, cache_dir=_http_cache_dir(cache_dir))
+    return load_cached_dataset(cache_dir, 'events', lambda: content_checksum(content),
+                               lambda year: [_typed_dated_frame(json.loads(content), 'event_date', year)],
+                               partition_cols=['year', 'country'], date_column='event_date', year=year)
+
+# Function to load typed weather data for the given year from the given API URL, through the cache if a cache directory is given
+def load_weather_data(api_url, year=2023, cache_dir=None):
+    content = fetch_url_content(api_url, cache_dir=_http_cache_dir(cache_dir))
+    return load_cached_dataset(cache_dir, 'weather', lambda: content_checksum(content),
+                               lambda year: [_typed_dated_frame(json.loads(content), 'date', year)],
+                               partition_cols=['year', 'country'], date_column='date', year=year)
+
+# Function to get the checksum of the content of an API URL, fetched through the HTTP cache (revalidated if older than ttl seconds)
+def url_checksum(api_url, cache_dir=None, ttl=DEFAULT_TTL):
+    return content_checksum(fetch_url_content(api_url, cache_dir=_http_cache_dir(cache_dir), ttl=ttl))
+
+# Function to get the checksums of the four sources (the events and weather are fetched through the HTTP cache)
+# <-- Lets results derived from the datasets be reused until a source changes
+def source_checksums(employee_data_path, attendance_data_path, events_url=EVENTS_URL, weather_url=WEATHER_URL, cache_dir=None):
+    return {
+        'employees': file_checksum(employee_data_path),
+        'attendance': file_checksum(attendance_data_path),
+        'events': url_checksum(events_url, cache_dir),
+        'weather': url_checksum(weather_url, cache_dir),
+    }
+
+# Function to load the employees, attendance, events and weather datasets concurrently
+# Each dataset is typed and filtered as soon as it arrives, while the other sources are still being read or downloaded
+# (profiler can record each load as a stage, see pnl/profiling.py)
+def load_datasets(employee_data_path, attendance_data_path, events_url=EVENTS_URL, weather_url=WEATHER_URL, year=2023, cache_dir=None, profiler=None):
+    profiler = profiler or Profiler(enabled=False)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        events_future = executor.submit(profiler.run, 'fetch_events', load_events_data, events_url, year, cache_dir) # Start the downloads first
+        weather_future = executor.submit(profiler.run, 'fetch_weather', load_weather_data, weather_url, year, cache_dir)
+        attendance_future = executor.submit(profiler.run, 'fetch_attendance', load_attendance_data, attendance_data_path, year, cache_dir)
+        employee_future = executor.submit(profiler.run, 'fetch_employees', load_employee_data, employee_data_path, cache_dir)
+        employee_data, attendance_data, events_data, weather_data = employee_future.result(), attendance_future.result(), events_future.result(), weather_future.result()
+    unify_categories([employee_data, events_data, weather_data], 'country') # Join on the category codes of country
+    return employee_data, attendance_data, events_data, weather_data
@@ -0,0 +1,111 @@
+"""
+Module Name: pnl/http_client.py
+Description: Shared HTTP client for the events and weather endpoints.
+
+All requests go through one persistent requests.Session (connection pooling and retries with backoff). When a cache
+directory is given, response bodies are stored on disk with their ETag/Last-Modified validators:
+- within the TTL the cached body is served without touching the network,
+- after the TTL a conditional request is sent and a 304 Not Modified response is served from the cache,
+- if the server cannot be reached or returns an error, a cached body (however old) is served instead.
+Without a usable cached body, errors are raised rather than returned as None.
+
+The API base URL can be overridden with the PNL_API_BASE_URL environment variable (e.g. to point the scripts at a local
+stand-in server).
+"""
+
+import hashlib
+import json
+import os
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+API_BASE_URL = os.environ.get("PNL_API_BASE_URL", "https://www.pingtt.com/exam").rstrip('/')
+DEFAULT_TTL = 3600 # Seconds a cached response is served without revalidating it with the server
+DEFAULT_TIMEOUT = 30 # Seconds to wait for the server to respond
+
+_session = None
+
+# Function to get the shared session, creating it on first use
+def get_session():
+    global _session
+    if _session is None:
+        retries = Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504], allowed_methods=['GET'])
+        adapter = HTTPAdapter(max_retries=retries, pool_connections=4, pool_maxsize=8)
+        _session = requests.Session()
+        _session.mount('http://', adapter)
+        _session.mount('https://', adapter)
+    return _session
+
+# Function to get the paths of the cached body and metadata for a request
+def _cache_paths(cache_dir, api_url, params):
+    key = hashlib.sha256(json.dumps([api_url, sorted((params or {}).items())], default=str).encode()).hexdigest()
+    return os.path.join(cache_dir, f"{key}.body"), os.path.join(cache_dir, f"{key}.json")
+
+# Function to read a cached response, returning (metadata, body) or (None, None) if nothing is cached
+def _read_cached_response(cache_dir, api_url, params):
+    body_path, meta_path = _cache_paths(cache_dir, api_url, params)
+    try:
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+        with open(body_path, "rb") as f:
+            body = f.read()
+    except (OSError, ValueError):
+        return None, None
+    return meta, body
+
+# Function to store a response body and its validators on disk
+def _write_cached_response(cache_dir, api_url, params, meta, body=None):
+    os.makedirs(cache_dir, exist_ok=True)
+    body_path, meta_path = _cache_paths(cache_dir, api_url, params)
+    if body is not None:
+        with open(f"{body_path}.tmp", "wb") as f:
+            f.write(body)
+        os.replace(f"{body_path}.tmp", body_path)
+    with open(f"{meta_path}.tmp", "w") as f:
+        json.dump(meta, f)
+    os.replace(f"{meta_path}.tmp", meta_path) # Write the metadata last so it never describes a partially written body
+
+# Function to fetch the raw body of the given API URL, through the on-disk cache if a cache directory is given
+def fetch_url_content(api_url, params=None, cache_dir=None, ttl=DEFAULT_TTL, timeout=DEFAULT_TIMEOUT):
+    meta, body = (None, None) if cache_dir is None else _read_cached_response(cache_dir, api_url, params)
+    if meta is not None and time.time() - meta['fetched_at'] < ttl:
+        return body # Fresh enough <-- No request needed
+
+    headers = {}
+    if meta is not None: # Ask the server to only send the data if it has changed
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+    try:
+        response = get_session().get(api_url, params=params, headers=headers, timeout=timeout)
+    except requests.RequestException as e:
+        if body is not None:
+            print(f"Error fetching data from {api_url} ({e}). Using cached data.")
+            return body
+        raise
+
+    if response.status_code == 304 and body is not None:
+        meta['fetched_at'] = time.time()
+        _write_cached_response(cache_dir, api_url, params, meta)
+        return body
+    if response.status_code == 200:
+        if cache_dir is not None:
+            meta = {
+                'url': api_url,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'fetched_at': time.time(),
+            }
+            _write_cached_response(cache_dir, api_url, params, meta, response.content)
+        return response.content
+
+    if body is not None:
+        print(f"Error fetching data from {api_url}. Status code: {response.status_code}. Using cached data.")
+        return body
+    print(f"Error fetching data from {api_url}. Status code: {response.status_code}")
+    response.raise_for_status()
+    raise requests.HTTPError(f"Unexpected status code {response.status_code} from {api_url}", response=response) # e.g. a 304 without a cached body
@@ -0,0 +1,106 @@
+"""
+Module Name: pnl/incremental.py
+Description: Incremental (delta) computation of the infractions for newly ingested attendance days.
+
+The state persisted between runs holds, for the analysis year:
+- events and weather: the events and weather data the state was computed with,
+- problem_clocks: the late clock ins, early clock outs and absences of each employee (employee id, date and country),
+- candidates: the (clock date, event) pairs each problem clock could count towards (the matched clock dates and event ids),
+- rollups: the weekly rollups of the attendance of each employee (see pnl/rollups.py), which give the seconds worked,
+- summary: the number of infractions and the list of possibly attended events of each employee with candidates.
+
+update_state() only joins the new attendance rows against the events and weather, only re-joins the problem clocks on the
+(clock date, country) keys whose events or weather changed, and only re-counts the employees whose candidates changed.
+Every step uses the same functions as the full computation in pnl/pipeline.py, so the results are identical to a full
+recompute. New attendance rows are assumed to be new records (re-sending a day that was already ingested counts it twice)
+and changes to employee data (e.g. an employee moving country) require a full recompute.
+"""
+
+import os
+import pickle
+import pandas as pd
+from pnl.pipeline import (CANDIDATE_COLUMNS, average_hours_per_week, build_results, expand_event_windows, filter_problem_attendance,
+                          find_problem_clocks_absences, join_events_weather, summarize_infractions)
+
+STATE_FILE_NAME = 'state.pkl'
+PROBLEM_CLOCK_COLUMNS = ['record_id_x', 'date', 'country']
+
+# Function to read the state saved in the given directory, returning None if there is no saved state
+def load_state(state_dir):
+    try:
+        with open(os.path.join(state_dir, STATE_FILE_NAME), 'rb') as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
+
+# Function to save the state in the given directory
+def save_state(state, state_dir):
+    os.makedirs(state_dir, exist_ok=True)
+    state_path = os.path.join(state_dir, STATE_FILE_NAME)
+    with open(f"{state_path}.tmp", 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(f"{state_path}.tmp", state_path) # Replace the old state only once the new one is completely written
+
+# Function to build the state from the intermediate results of a full computation (see identify_employees.py)
+def build_state(events_data, weather_data, employee_attendance, problem_clocks_absences, rollups, summary, year=2023):
+    return {
+        'year': year,
+        'events': events_data,
+        'weather': weather_data,
+        'problem_clocks': employee_attendance[PROBLEM_CLOCK_COLUMNS].reset_index(drop=True),
+        'candidates': problem_clocks_absences[CANDIDATE_COLUMNS].reset_index(drop=True),
+        'rollups': rollups,
+        'summary': summary,
+    }
+
+# Function to find the rows of a DataFrame whose values for the given columns are among the given keys
+def _isin_keys(df, columns, keys):
+    return pd.MultiIndex.from_frame(df[columns]).isin(pd.MultiIndex.from_frame(keys))
+
+# Function to find the rows that were added, changed or removed between two versions of a dataset
+def _changed_rows(old, new):
+    return pd.concat([old, new], ignore_index=True).drop_duplicates(keep=False)
+
+# Function to update the state with new attendance rows and the latest events and weather data (all filtered for the state's year)
+def update_state(state, employee_data, new_attendance_data, events_data, weather_data):
+    year = state['year']
+    state = dict(state)
+    event_windows = expand_event_windows(events_data, year)
+    events_weather = join_events_weather(event_windows, weather_data)
+    candidates = state['candidates']
+    changed_employees = set()
+
+    # Find the (clock_date, country) keys whose events or weather changed and re-join the existing problem clocks on those keys only
+    changed_events = expand_event_windows(_changed_rows(state['events'], events_data), year)
+    changed_weather = _changed_rows(state['weather'], weather_data).rename(columns={'date': 'clock_date'})
+    changed_keys = pd.concat([changed_events[['clock_date', 'country']], changed_weather[['clock_date', 'country']]]).drop_duplicates()
+    if not changed_keys.empty:
+        stale = _isin_keys(candidates, ['clock_date', 'country'], changed_keys)
+        changed_employees.update(candidates.loc[stale, 'record_id_x'])
+        candidates = candidates[~stale]
+        problem_clocks = state['problem_clocks'][_isin_keys(state['problem_clocks'], ['date', 'country'], changed_keys.rename(columns={'clock_date': 'date'}))]
+        rejoined = find_problem_clocks_absences(problem_clocks, events_weather[_isin_keys(events_weather, ['clock_date', 'country'], changed_keys)])[CANDIDATE_COLUMNS]
+        changed_employees.update(rejoined['record_id_x'])
+        candidates = pd.concat([candidates, rejoined], ignore_index=True)
+
+    # Join only the new attendance rows with the events and weather data
+    new_problem_clocks = filter_problem_attendance(employee_data, new_attendance_data)
+    new_candidates = find_problem_clocks_absences(new_problem_clocks, events_weather)[CANDIDATE_COLUMNS]
+    changed_employees.update(new_candidates['record_id_x'])
+    candidates = pd.concat([candidates, new_candidates], ignore_index=True)
+    state['problem_clocks'] = pd.concat([state['problem_clocks'], new_problem_clocks[PROBLEM_CLOCK_COLUMNS]], ignore_index=True)
+    state['rollups'] = state['rollups'].update(new_attendance_data) # Add the new rows to the weekly sums of their employees
+
+    # Re-count the infractions of the employees whose candidates changed
+    summary = state['summary']
+    summary = summary[~summary['record_id_x'].isin(changed_employees)]
+    summary = pd.concat([summary, summarize_infractions(candidates[candidates['record_id_x'].isin(changed_employees)])], ignore_index=True)
+    state['summary'] = summary.sort_values('record_id_x').reset_index(drop=True)
+    state['candidates'] = candidates
+    state['events'] = events_data
+    state['weather'] = weather_data
+    return state
+
+# Function to build the results (employees with more than 3 infractions) from the state
+def state_results(state, employee_data):
+    return build_results(state['summary'], employee_data, average_hours_per_week(state['rollups'].total_seconds_worked()))
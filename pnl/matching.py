@@ -0,0 +1,40 @@
+"""
+Module Name: pnl/matching.py
+Description: Exact infraction matching engine.
+
+An employee does not incur more than one infraction for the same clock date or the same event, so the number of
+infractions is the size of a maximum matching between the employee's problem clock dates and the events whose window
+covers them. Every event covers the same number of days around its date (an interval of clock dates), which makes the
+greedy matching exact: taking the events in date order, match each one to the earliest of its clock dates not matched yet.
+Since all windows have the same width, the matched dates only ever increase, so "not matched yet" is simply "later than
+the last matched date" and the whole matching is a single pass over the candidates sorted by employee, event date and
+clock date, linear in the number of candidates.
+"""
+
+import numpy as np
+
+# Function to choose the (clock date, event) pairs counted as infractions, given the candidate pairs of problem_clocks_absences
+# Returns a boolean array marking the chosen rows of candidates (which needs record_id_x, event_date, event_id and clock_date columns)
+def match_infractions(candidates):
+    employees = candidates['record_id_x'].to_numpy()
+    events = candidates['event_id'].to_numpy()
+    event_dates = candidates['event_date'].to_numpy() # Dates are day numbers (see pnl/compact.py)
+    clock_dates = candidates['clock_date'].to_numpy()
+    order = np.lexsort((clock_dates, events, event_dates, employees)) # Sort by employee, then event date (ties by event id), then clock date
+    employees, events, clock_dates = employees[order].tolist(), events[order].tolist(), clock_dates[order].tolist()
+
+    matched = np.zeros(len(order), dtype=bool)
+    employee = event = None
+    for i in range(len(order)):
+        if employees[i] != employee: # New employee <-- Nothing matched yet
+            employee, event, last_matched = employees[i], None, None
+        if events[i] != event: # New event <-- Not matched yet
+            event, event_matched = events[i], False
+        if not event_matched and (last_matched is None or clock_dates[i] > last_matched):
+            matched[i] = True
+            event_matched = True
+            last_matched = clock_dates[i]
+
+    chosen = np.zeros(len(order), dtype=bool)
+    chosen[order] = matched # Map the chosen rows back to the order of candidates
+    return chosen
@@ -0,0 +1,156 @@
+"""
+Module Name: pnl/pipeline.py
+Description: The stages of the analysis in identify_employees.py, as functions that can be run on the full datasets or on
+subsets of them (see pnl/incremental.py).
+
+The approach is to join datasets on common keys and filter for conditions that match behavioral pattern criteria. The
+resulting dataset (problem_clocks_absences) is then matched clock date to event (see pnl/matching.py) to count the
+number of events an employee attended.
+"""
+
+import json
+import math
+import numpy as np
+import pandas as pd
+from pnl.compact import MISSING_CLOCK, clock_seconds, day_of_week, format_dates, in_year
+from pnl.matching import match_infractions
+
+EXTREME_WEATHER = ['hail', 'blizzard', 'thunderstorm', 'hurricane'] # Weather conditions that excuse a problem clock
+MAX_TEMP = 40 # Days hotter than this excuse a problem clock
+LATE_CLOCK_IN = '08:15:00' # Clock ins after this time are late
+EARLY_CLOCK_OUT = '16:00:00' # Clock outs before this time are early
+INFRACTION_THRESHOLD = 3 # A pattern is more than this many infractions in the year
+WEEKS_PER_YEAR = 52
+
+# Columns of problem_clocks_absences needed to count infractions and list the possibly attended events
+CANDIDATE_COLUMNS = ['record_id_x', 'clock_date', 'event_id', 'event_name', 'event_date', 'country']
+EMPLOYEE_COLUMNS = ['record_id', 'name', 'work_id_number', 'email_address', 'country', 'phone_number']
+
+# Function to keep one row per employee id, the first one <-- employees.json may list an id more than once (pnlanalyze.py checks for it)
+# Every engine joins the employees through this function, so duplicated ids are counted and listed once, with the first details
+def unique_employees(employee_data):
+    return employee_data.drop_duplicates('record_id')
+
+# Function to add the previous and following clock dates to the events data <-- This gives us clock dates before, after and of an event
+# Clock dates will be duplicated for events less than two days apart <-- Keep this in mind when counting infractions
+# (Dates are day numbers, see pnl/compact.py; window_days is the number of days before and after each event, see pnl/policies.py)
+def expand_event_windows(events_data, year=2023, window_days=1):
+    events_data = events_data.rename(columns={'id': 'event_id'}) # Rename unique identifier for events to event_id
+    windows = []
+    for offset in [0] + [sign * days for days in range(1, window_days + 1) for sign in (-1, 1)]: # Day of, then day before and after, then two days before and after...
+        window = events_data.copy()
+        window['clock_date'] = window['event_date'] + offset # Add clock date and set to event date plus the offset
+        windows.append(window)
+    events_data = pd.concat(windows, ignore_index=True)
+    return events_data[in_year(events_data['clock_date'], year)] # Filter in case of Old Year's and New Year's events
+
+# Function to join events_data and weather_data on event_date and country and filter out weekend dates and dates where there was hail, blizzard, thunderstorm or hurricane weather
+# <-- This gives us the weekdays before, after and of an event with good weather
+def join_events_weather(event_windows, weather_data):
+    events_weather = pd.merge(event_windows, weather_data, left_on=['clock_date', 'country'], right_on=['date', 'country'])
+    return events_weather[
+        (~events_weather['condition'].isin(EXTREME_WEATHER)) &
+        (events_weather['max_temp'] <= MAX_TEMP) &
+        (day_of_week(events_weather['clock_date']) < 5)
+    ]
+
+# Function to calculate the seconds worked for each record, or NaN if a clock is missing
+def _seconds_worked(attendance_data):
+    clock_in = attendance_data['clock_in'].to_numpy()
+    clock_out = attendance_data['clock_out'].to_numpy()
+    return np.where((clock_in != MISSING_CLOCK) & (clock_out != MISSING_CLOCK), clock_out - clock_in, np.nan)
+
+# Function to add the seconds worked of each record and the average hours worked per week of its employee, given the total
+# seconds worked by each employee (e.g. from pnl/rollups.py) <-- These details are listed in the drilldown
+def add_hours_worked(attendance_data, total_seconds):
+    attendance_data = attendance_data.copy()
+    attendance_data['total_seconds_worked'] = _seconds_worked(attendance_data) # Calculate total seconds worked for each record
+    attendance_data['average_hours_per_week'] = attendance_data['employee_record_id'].map(average_hours_per_week(total_seconds)) # Look up the weekly average of each employee
+    return attendance_data
+
+# Function to total the seconds worked by each employee
+def total_seconds_worked(attendance_data):
+    return pd.Series(_seconds_worked(attendance_data)).groupby(attendance_data['employee_record_id'].to_numpy()).sum()
+
+# Function to convert the total seconds worked by each employee to average hours per week
+def average_hours_per_week(total_seconds):
+    return total_seconds / 3600 / WEEKS_PER_YEAR
+
+# Function to join employee_data and attendance_data on employee_id and filter for late clock ins and early clock outs and absences
+# <-- This gives us all problematic clocks and absences and the employee details needed for final result
+# (Clocks are seconds since midnight, see pnl/compact.py, so the attendance is filtered with integer comparisons before the join)
+def filter_problem_attendance(employee_data, attendance_data):
+    clock_in = attendance_data['clock_in'].to_numpy()
+    clock_out = attendance_data['clock_out'].to_numpy()
+    attendance_data = attendance_data[
+        (clock_in > clock_seconds(LATE_CLOCK_IN)) |
+        ((clock_out != MISSING_CLOCK) & (clock_out < clock_seconds(EARLY_CLOCK_OUT))) |
+        ((clock_in == MISSING_CLOCK) & (clock_out == MISSING_CLOCK))
+    ]
+    return pd.merge(unique_employees(employee_data), attendance_data, left_on=['record_id'], right_on=['employee_record_id'])
+
+# Function to join employee_attendance with events_weather on clock_date and country
+# <-- This give us all the problematic clocks and absences on weekdays with good weather the day before, after and of an event
+def find_problem_clocks_absences(employee_attendance, events_weather):
+    return pd.merge(employee_attendance, events_weather, left_on=['date', 'country'], right_on=['clock_date', 'country'])
+
+# Function to build the list of possibly attended events of each employee
+def build_employee_events(problem_clocks_absences):
+    problem_clocks_absences = problem_clocks_absences.sort_values(by=['record_id_x', 'event_date', 'event_id']) # Sort so that events are listed in date order
+    employee_events = problem_clocks_absences[['record_id_x', 'country', 'event_name', 'event_date']].drop_duplicates() # One row per possibly attended event of each employee
+    event_dates = format_dates(employee_events['event_date']).tolist()
+    events = [{'country': country, 'event_name': event_name, 'event_date': event_date}
+              for country, event_name, event_date in zip(employee_events['country'].tolist(), employee_events['event_name'].tolist(), event_dates)]
+    record_ids, starts = np.unique(employee_events['record_id_x'].to_numpy(), return_index=True) # Rows are sorted by employee <-- Each employee's events are one slice
+    ends = np.append(starts[1:], len(events))
+    return pd.DataFrame({'record_id_x': record_ids, 'events': [events[start:end] for start, end in zip(starts.tolist(), ends.tolist())]})
+
+# Function to count the number of infractions per employee (An employee should not incur more than one infraction for the same clock date or the same event)
+# chosen can mark the rows of an already computed matching (see match_infractions)
+def count_infractions(problem_clocks_absences, chosen=None):
+    if chosen is None:
+        chosen = match_infractions(problem_clocks_absences)
+    infractions = problem_clocks_absences[chosen] # Keep the (clock date, event) pairs of a maximum matching
+    return infractions.groupby('record_id_x').size().rename('freq').reset_index() # Count the infractions per employee
+
+# Function to count the infractions and list the possibly attended events of each employee with problem clocks
+def summarize_infractions(problem_clocks_absences, chosen=None):
+    candidates = problem_clocks_absences[CANDIDATE_COLUMNS]
+    if candidates.empty:
+        return pd.DataFrame({'record_id_x': pd.Series(dtype='int64'), 'freq': pd.Series(dtype='int64'), 'events': pd.Series(dtype=object)})
+    return pd.merge(count_infractions(candidates, chosen), build_employee_events(candidates), on='record_id_x')
+
+# Function to filter for employees with more than 3 (threshold) infractions and add their details, average hours per week and possibly attended events
+def build_results(summary, employee_data, average_hours, threshold=INFRACTION_THRESHOLD):
+    problem_freq = summary[summary['freq'] > threshold]
+    problem_freq = pd.merge(unique_employees(employee_data)[EMPLOYEE_COLUMNS], problem_freq, left_on='record_id', right_on='record_id_x')
+    problem_freq['average_hours_per_week'] = problem_freq['record_id'].map(average_hours)
+    problem_freq = problem_freq.sort_values('record_id').reset_index(drop=True)
+    return problem_freq[EMPLOYEE_COLUMNS + ['average_hours_per_week', 'events']] # Remove columns not in example
+
+# Function to convert a value to one that can be written to JSON, rounding floats to the precision used by DataFrame.to_json
+def json_value(value):
+    if isinstance(value, float):
+        return None if math.isnan(value) else round(value, 10)
+    return value
+
+# Function to yield the results one JSON-serializable record (dict) at a time
+def iter_result_records(results):
+    columns = list(results.columns)
+    values = [results[col].tolist() for col in columns]
+    for row in zip(*values):
+        yield {col: json_value(value) for col, value in zip(columns, row)}
+
+# Function to write the results to a JSON file one record at a time, as a JSON array or as NDJSON (one record per line)
+def write_results(results, file_path, ndjson=False):
+    with open(file_path, 'w') as json_file:
+        if not ndjson:
+            json_file.write('[')
+        for i, result_record in enumerate(iter_result_records(results)):
+            record = json.dumps(result_record, separators=(',', ':'))
+            if ndjson:
+                json_file.write(f"{record}\n")
+            else:
+                json_file.write(f",{record}" if i else record)
+        if not ndjson:
+            json_file.write(']')
@@ -0,0 +1,143 @@
+"""
+Module Name: pnl/policies.py
+Description: Declarative infraction policies and a single-pass evaluator for comparing several of them ("what if" sweeps).
+
+A policy is a dict with the parameters that identify_employees.py otherwise takes from the constants of pnl/pipeline.py:
+- name: name of the policy (used in the file names of its results)
+- late_clock_in / early_clock_out: clock ins after and clock outs before these times ('%H:%M:%S') are problem clocks
+- max_temp: days hotter than this excuse a problem clock
+- extreme_weather: weather conditions that excuse a problem clock
+- window_days: number of days before and after an event that count towards it (1: the day before, of and after)
+- threshold: employees with more than this many infractions are listed
+Any parameter left out of a spec takes its default (DEFAULT_POLICY, the policy of identify_employees.py).
+
+evaluate_policies() loads nothing itself and joins the datasets once for all the policies: the events are expanded to the
+widest window, joined with the weather without excluding any condition or temperature, and joined with the attendance
+rows that are problem clocks under the loosest cutoffs. Each policy is then a vectorized mask over the shared candidate
+rows (window, weather and clock predicates), followed by the same matching and summary as the pipeline, so a sweep of N
+policies costs one join plus N cheap filters instead of N full runs. The results of DEFAULT_POLICY are those of results.json.
+"""
+
+import json
+import re
+import pandas as pd
+from pnl.compact import MISSING_CLOCK, clock_seconds, day_of_week
+from pnl.pipeline import (CANDIDATE_COLUMNS, EARLY_CLOCK_OUT, EXTREME_WEATHER, INFRACTION_THRESHOLD, LATE_CLOCK_IN, MAX_TEMP, build_employee_events,
+                          build_results, count_infractions, expand_event_windows, unique_employees)
+
+DEFAULT_POLICY = {
+    'name': 'default',
+    'late_clock_in': LATE_CLOCK_IN,
+    'early_clock_out': EARLY_CLOCK_OUT,
+    'max_temp': MAX_TEMP,
+    'extreme_weather': EXTREME_WEATHER,
+    'window_days': 1,
+    'threshold': INFRACTION_THRESHOLD,
+}
+POLICY_NAME = re.compile(r'^[A-Za-z0-9_.-]+$') # Policy names are used in file names
+
+# Function to complete a policy spec with the defaults and check it, raising ValueError for an invalid spec
+def make_policy(spec, name=None):
+    unknown = [key for key in spec if key not in DEFAULT_POLICY]
+    if unknown:
+        raise ValueError(f"Unknown policy parameters: {', '.join(unknown)}. Available parameters: {', '.join(DEFAULT_POLICY)}")
+    policy = {**DEFAULT_POLICY, 'name': name or DEFAULT_POLICY['name'], **spec}
+    if not isinstance(policy['name'], str) or not POLICY_NAME.match(policy['name']):
+        raise ValueError(f"Invalid policy name: {policy['name']!r} (use letters, digits, '_', '.' and '-')")
+    for key in ['late_clock_in', 'early_clock_out']:
+        try:
+            clock_seconds(policy[key])
+        except (AttributeError, ValueError):
+            raise ValueError(f"Invalid {key} in policy {policy['name']}: {policy[key]!r} (expected '%H:%M:%S')") from None
+    if not isinstance(policy['max_temp'], (int, float)) or isinstance(policy['max_temp'], bool):
+        raise ValueError(f"Invalid max_temp in policy {policy['name']}: {policy['max_temp']!r}")
+    if not isinstance(policy['extreme_weather'], list) or not all(isinstance(condition, str) for condition in policy['extreme_weather']):
+        raise ValueError(f"Invalid extreme_weather in policy {policy['name']}: {policy['extreme_weather']!r} (expected a list of conditions)")
+    for key in ['window_days', 'threshold']:
+        if not isinstance(policy[key], int) or isinstance(policy[key], bool) or policy[key] < 0:
+            raise ValueError(f"Invalid {key} in policy {policy['name']}: {policy[key]!r} (expected a non-negative integer)")
+    return policy
+
+# Function to read a JSON list of policy specs, returning the complete policies
+def load_policies(policies_path):
+    with open(policies_path, "r") as f:
+        specs = json.load(f)
+    if not isinstance(specs, list) or not specs or not all(isinstance(spec, dict) for spec in specs):
+        raise ValueError(f"{policies_path} must contain a non-empty JSON list of policy specs")
+    policies = [make_policy(spec, name=f"policy_{i + 1}") for i, spec in enumerate(specs)]
+    names = [policy['name'] for policy in policies]
+    duplicated = sorted({name for name in names if names.count(name) > 1})
+    if duplicated:
+        raise ValueError(f"Duplicate policy names: {', '.join(duplicated)}")
+    return policies
+
+# Function to join the datasets once for all the policies, returning the candidate (clock date, event) pairs of the loosest
+# policy with the clocks and weather each policy filters on
+def join_candidates(employee_data, attendance_data, events_data, weather_data, policies, year=2023):
+    # Expand the events to the widest window and keep the weekdays with a weather record <-- The weather is filtered per policy
+    event_windows = expand_event_windows(events_data, year, window_days=max(policy['window_days'] for policy in policies))
+    events_weather = pd.merge(event_windows, weather_data[['date', 'country', 'condition', 'max_temp']], left_on=['clock_date', 'country'], right_on=['date', 'country'])
+    events_weather = events_weather[day_of_week(events_weather['clock_date']) < 5]
+
+    # Keep the attendance rows that are problem clocks under the loosest cutoffs <-- The cutoffs are filtered per policy
+    clock_in = attendance_data['clock_in'].to_numpy()
+    clock_out = attendance_data['clock_out'].to_numpy()
+    attendance_data = attendance_data[
+        (clock_in > min(clock_seconds(policy['late_clock_in']) for policy in policies)) |
+        ((clock_out != MISSING_CLOCK) & (clock_out < max(clock_seconds(policy['early_clock_out']) for policy in policies))) |
+        ((clock_in == MISSING_CLOCK) & (clock_out == MISSING_CLOCK))
+    ]
+    employee_attendance = pd.merge(unique_employees(employee_data)[['record_id', 'country']], attendance_data[['record_id', 'employee_record_id', 'date', 'clock_in', 'clock_out']],
+                                   left_on=['record_id'], right_on=['employee_record_id'])
+    candidates = pd.merge(employee_attendance, events_weather, left_on=['date', 'country'], right_on=['clock_date', 'country'])
+    return candidates[CANDIDATE_COLUMNS + ['clock_in', 'clock_out', 'condition', 'max_temp']].reset_index(drop=True)
+
+# Function to mark the candidate rows that count under a policy (window, weather and clock predicates)
+def policy_mask(candidates, policy):
+    clock_in = candidates['clock_in'].to_numpy()
+    clock_out = candidates['clock_out'].to_numpy()
+    in_window = (candidates['clock_date'] - candidates['event_date']).abs().to_numpy() <= policy['window_days']
+    good_weather = (~candidates['condition'].isin(policy['extreme_weather']) & (candidates['max_temp'] <= policy['max_temp'])).to_numpy()
+    problem_clock = (
+        (clock_in > clock_seconds(policy['late_clock_in'])) |
+        ((clock_out != MISSING_CLOCK) & (clock_out < clock_seconds(policy['early_clock_out']))) |
+        ((clock_in == MISSING_CLOCK) & (clock_out == MISSING_CLOCK))
+    )
+    return in_window & good_weather & problem_clock
+
+# Function to get the key of the candidate filter of a policy <-- Policies that differ only in their threshold share the matching
+def _filter_key(policy):
+    return (policy['late_clock_in'], policy['early_clock_out'], policy['max_temp'], tuple(sorted(policy['extreme_weather'])), policy['window_days'])
+
+# Function to evaluate several policies over one join of the datasets, returning the results of each policy by name
+# (average_hours is the average hours per week of each employee, the same under every policy)
+def evaluate_policies(employee_data, attendance_data, events_data, weather_data, policies, average_hours, year=2023, candidates=None):
+    if candidates is None:
+        candidates = join_candidates(employee_data, attendance_data, events_data, weather_data, policies, year)
+    counted = {} # Filter key -> candidates of the policy and number of infractions per employee
+    results = {}
+    for policy in policies:
+        key = _filter_key(policy)
+        if key not in counted:
+            policy_candidates = candidates[policy_mask(candidates, policy)][CANDIDATE_COLUMNS]
+            counted[key] = policy_candidates, count_infractions(policy_candidates)
+        policy_candidates, freq = counted[key]
+        flagged = freq[freq['freq'] > policy['threshold']] # List the possibly attended events of the listed employees only
+        summary = pd.merge(flagged, build_employee_events(policy_candidates[policy_candidates['record_id_x'].isin(flagged['record_id_x'])]), on='record_id_x')
+        summary = summary.astype({'events': object}) # Lists of events, even when no employee is listed
+        results[policy['name']] = build_results(summary, employee_data, average_hours, threshold=policy['threshold'])
+    return results
+
+# Function to compare the results of the policies with those of the first one (the baseline)
+def compare_policies(policies, results):
+    baseline = set(results[policies[0]['name']]['record_id'].tolist())
+    comparison = []
+    for policy in policies:
+        flagged = set(results[policy['name']]['record_id'].tolist())
+        comparison.append({
+            'policy': policy,
+            'flagged_employees': len(flagged),
+            'added': sorted(flagged - baseline), # Flagged under this policy but not under the baseline
+            'removed': sorted(baseline - flagged), # Flagged under the baseline but not under this policy
+        })
+    return comparison
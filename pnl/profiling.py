@@ -0,0 +1,119 @@
+"""
+Module Name: pnl/profiling.py
+Description: Per-stage instrumentation of the analysis.
+
+A Profiler runs the named stages of a run (profiler.run(stage, func, *args)) and records for each one:
+- wall_seconds and cpu_seconds: the elapsed time and the CPU time of the thread that ran the stage,
+- peak_rss_bytes: the peak resident set size of the process when the stage finished (and peak_rss_increase_bytes, how much the
+  stage raised it), where the platform reports it,
+- rows_in and rows_out: the number of rows of the DataFrame (or Series or array) arguments and result of the stage,
+- peak_memory_bytes: the peak memory allocated during the stage, if the profiler was created with trace_memory=True (tracemalloc,
+  which slows the run down).
+Stages can run in several threads at once (e.g. the loaders in load_datasets()). A disabled profiler only calls the stage
+functions, so the code can always go through one. The records are written as JSON with write(); cProfile stats of a whole run
+can be dumped alongside them with start_cprofile() and dump_cprofile() (pstats format, e.g. for snakeviz; cProfile only sees the
+thread that started it, so the loader threads are covered by their stage records only).
+"""
+
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+try:
+    import resource
+except ImportError: # Not available on Windows <-- The peak RSS is not recorded there
+    resource = None
+
+# Function to get the peak resident set size of the process in bytes, or None if the platform does not report it
+def peak_rss():
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024 # ru_maxrss is in kilobytes except on macOS
+
+# Function to count the rows of the DataFrames, Series and arrays in a stage's arguments or result (None if there are none)
+def count_rows(*values):
+    rows = None
+    for value in values:
+        if isinstance(value, (tuple, list)):
+            value = count_rows(*value)
+        elif isinstance(value, (pd.DataFrame, pd.Series, np.ndarray)):
+            value = len(value)
+        else:
+            continue
+        if value is not None:
+            rows = (rows or 0) + value
+    return rows
+
+# Class to run the named stages of a run and record their measurements
+class Profiler:
+    def __init__(self, enabled=True, trace_memory=False):
+        self.enabled = enabled
+        self.trace_memory = trace_memory
+        self.stages = []
+        self._lock = threading.Lock()
+        self._cprofile = None
+        self._start, self._start_cpu = time.perf_counter(), time.process_time()
+
+    # Function to run a stage, recording its measurements if the profiler is enabled
+    def run(self, stage, func, *args, **kwargs):
+        if not self.enabled:
+            return func(*args, **kwargs)
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            traced_before = tracemalloc.get_traced_memory()[0]
+        rss_before = peak_rss()
+        start_wall, start_cpu = time.perf_counter(), time.thread_time()
+        result = func(*args, **kwargs)
+        wall_seconds, cpu_seconds = time.perf_counter() - start_wall, time.thread_time() - start_cpu
+        rss_after = peak_rss()
+        record = {
+            'stage': stage,
+            'thread': threading.current_thread().name,
+            'start_seconds': start_wall - self._start,
+            'wall_seconds': wall_seconds,
+            'cpu_seconds': cpu_seconds,
+            'peak_rss_bytes': rss_after,
+            'peak_rss_increase_bytes': rss_after - rss_before if rss_before is not None else None,
+            'rows_in': count_rows(*args, *kwargs.values()),
+            'rows_out': count_rows(result),
+        }
+        if self.trace_memory:
+            record['peak_memory_bytes'] = tracemalloc.get_traced_memory()[1] - traced_before
+        with self._lock:
+            self.stages.append(record)
+        return result
+
+    # Function to start collecting cProfile stats for the whole run
+    def start_cprofile(self):
+        self._cprofile = cProfile.Profile()
+        self._cprofile.enable()
+
+    # Function to stop collecting cProfile stats and write them to the given file (pstats format)
+    def dump_cprofile(self, file_path):
+        self._cprofile.disable()
+        self._cprofile.dump_stats(file_path)
+
+    # Function to get the records of the stages and the totals of the run
+    def report(self, **details):
+        return {
+            **details,
+            'pid': os.getpid(),
+            'total_wall_seconds': time.perf_counter() - self._start,
+            'total_cpu_seconds': time.process_time() - self._start_cpu, # All threads of the process
+            'peak_rss_bytes': peak_rss(),
+            'stages': self.stages,
+        }
+
+    # Function to write the report to a JSON file
+    def write(self, file_path, **details):
+        with open(file_path, 'w') as f:
+            json.dump(self.report(**details), f, indent=2)
@@ -0,0 +1,169 @@
+"""
+Module Name: pnl/quality.py
+Description: Data-quality profile of the employees, attendance, events and weather datasets, used by pnlanalyze.py.
+
+profile_datasets() runs the uniqueness, null and coverage checks of each dataset in one pass over its columns. The checks on
+key pairs (e.g. employee and date) combine the pair into one int64 key and sort the keys once: duplicates are equal
+neighbours, and the coverage of the weekdays of the year is the number of distinct (employee, weekday) keys of each employee,
+counted with np.bincount. No employees x weekdays frame is ever built, so the memory used is proportional to the size of the
+datasets, not to employees x days.
+
+The report is a JSON-serializable dict. save_report() writes it with the checksums of the sources it was computed from, and
+load_report() returns it only while those checksums are unchanged, so the profile is recomputed only when an input changes.
+"""
+
+import json
+import os
+import numpy as np
+import pandas as pd
+from pnl.compact import CLOCK_COLUMNS, MISSING_CLOCK, day_of_week, format_dates, year_bounds
+
+REPORT_VERSION = 2 # Bump to invalidate saved reports when the checks change
+MAX_LISTED = 10 # Number of employees (or countries) listed in the report for each kind of gap
+
+# Function to get the day numbers of the weekdays of a year
+def weekdays_of_year(year):
+    first_day, end_day = year_bounds(year)
+    days = np.arange(first_day, end_day)
+    return days[day_of_week(days) < 5]
+
+# Function to combine columns into one int64 key per row (equal keys for equal rows)
+def _row_keys(df, columns):
+    keys = np.zeros(len(df), dtype=np.int64)
+    for col in columns:
+        codes, uniques = pd.factorize(df[col], use_na_sentinel=False)
+        keys = pd.factorize(keys * len(uniques) + codes)[0].astype(np.int64) # Renumber the keys so that they never overflow
+    return keys
+
+# Function to count the rows whose key repeats the key of an earlier row, given the keys sorted
+def _duplicate_count(sorted_keys):
+    return int(np.count_nonzero(sorted_keys[1:] == sorted_keys[:-1]))
+
+# Function to count the rows that repeat another row on the given columns
+def duplicate_count(df, columns):
+    return _duplicate_count(np.sort(_row_keys(df, columns)))
+
+# Function to count the nulls of each column (a missing clock is a null)
+def null_counts(df):
+    counts = {}
+    for col in df.columns:
+        values = df[col]
+        counts[col] = int((values.to_numpy() == MISSING_CLOCK).sum() if col in CLOCK_COLUMNS else values.isna().sum())
+    return counts
+
+# Function to list the entries of a Series with the largest values (largest first)
+def _largest(counts, key_name, value_name):
+    counts = counts[counts > 0].sort_values(ascending=False, kind='stable').head(MAX_LISTED)
+    return [{key_name: key, value_name: int(value)} for key, value in zip(counts.index.tolist(), counts.tolist())]
+
+# Function to profile the employees dataset
+def profile_employees(employee_data):
+    return {
+        'rows': len(employee_data),
+        'duplicate_record_ids': duplicate_count(employee_data, ['record_id']),
+        'duplicate_name_email': duplicate_count(employee_data, ['name', 'email_address']),
+        'nulls': null_counts(employee_data),
+        'employees_per_country': {str(country): int(count) for country, count in employee_data['country'].value_counts(sort=False).items()},
+    }
+
+# Function to profile the attendance dataset for the given year: uniqueness, null clocks, unknown employees and weekday coverage
+def profile_attendance(attendance_data, employee_data, year=2023):
+    employee_ids = np.unique(employee_data['record_id'].to_numpy()) # Sorted, each id once <-- A duplicated employee is covered by the same records
+    record_employees = attendance_data['employee_record_id'].to_numpy().astype(np.int64)
+    days = attendance_data['date'].to_numpy().astype(np.int64)
+    clock_in_missing = attendance_data['clock_in'].to_numpy() == MISSING_CLOCK
+    clock_out_missing = attendance_data['clock_out'].to_numpy() == MISSING_CLOCK
+
+    # One sorted (employee, day) key per record <-- Shared by the duplicate and coverage checks
+    first_day, end_day = year_bounds(year)
+    base_day = int(days.min()) if len(days) else 0
+    span = int(days.max()) - base_day + 1 if len(days) else 1
+    keys = record_employees * span + (days - base_day)
+    order = np.argsort(keys, kind='stable')
+    sorted_keys, sorted_employees, sorted_days = keys[order], record_employees[order], days[order]
+
+    # Coverage: the distinct weekdays of the year each known employee has a record for
+    weekdays = weekdays_of_year(year)
+    positions = np.minimum(np.searchsorted(employee_ids, sorted_employees), max(len(employee_ids) - 1, 0))
+    known = (employee_ids[positions] == sorted_employees) if len(employee_ids) else np.zeros(len(sorted_employees), dtype=bool)
+    on_weekday = known & (day_of_week(sorted_days) < 5) & (sorted_days >= first_day) & (sorted_days < end_day)
+    distinct = on_weekday.copy()
+    distinct[1:] &= sorted_keys[1:] != sorted_keys[:-1] # Count each (employee, day) once
+    attended = np.bincount(positions[distinct], minlength=len(employee_ids))
+    missing = pd.Series(len(weekdays) - attended, index=employee_ids)
+
+    return {
+        'rows': len(attendance_data),
+        'duplicate_record_ids': duplicate_count(attendance_data, ['record_id']),
+        'duplicate_employee_dates': _duplicate_count(sorted_keys),
+        'clock_in_null_clock_out_not_null': int(np.count_nonzero(clock_in_missing & ~clock_out_missing)),
+        'clock_out_null_clock_in_not_null': int(np.count_nonzero(~clock_in_missing & clock_out_missing)),
+        'clock_in_and_clock_out_null': int(np.count_nonzero(clock_in_missing & clock_out_missing)),
+        'unknown_employee_records': int(np.count_nonzero(~known)),
+        'weekend_records': int(np.count_nonzero(day_of_week(days) >= 5)),
+        'weekdays_in_year': len(weekdays),
+        'employees_with_missing_weekdays': int(np.count_nonzero(missing.to_numpy() > 0)),
+        'missing_employee_weekdays': int(missing.sum()),
+        'most_missing_weekdays': _largest(missing, 'record_id', 'missing_weekdays'),
+    }
+
+# Function to profile the events dataset: uniqueness and events two days or fewer apart in the same country
+def profile_events(events_data):
+    events = events_data.sort_values(['country', 'event_date'], kind='stable')
+    countries = events['country'].to_numpy()
+    dates = events['event_date'].to_numpy().astype(np.int64)
+    close = (countries[1:] == countries[:-1]) & (dates[1:] - dates[:-1] <= 2)
+    return {
+        'rows': len(events_data),
+        'duplicate_ids': duplicate_count(events_data, ['id']),
+        'duplicate_name_date_country': duplicate_count(events_data, ['event_name', 'event_date', 'country']),
+        'events_two_days_or_fewer_apart': int(np.count_nonzero(close)),
+        'nulls': null_counts(events_data),
+    }
+
+# Function to profile the weather dataset for the given year: uniqueness and coverage of the weekdays in each country
+def profile_weather(weather_data, countries, year=2023):
+    weekdays = weekdays_of_year(year)
+    codes = pd.Categorical(weather_data['country'].astype(object), categories=countries).codes.astype(np.int64)
+    positions = np.searchsorted(weekdays, weather_data['date'].to_numpy())
+    on_weekday = (codes >= 0) & (positions < len(weekdays))
+    on_weekday[on_weekday] &= weekdays[positions[on_weekday]] == weather_data['date'].to_numpy()[on_weekday]
+    covered = np.unique(codes[on_weekday] * len(weekdays) + positions[on_weekday]) # Distinct (country, weekday) keys
+    missing = pd.Series(len(weekdays) - np.bincount(covered // max(len(weekdays), 1), minlength=len(countries)), index=list(countries))
+    return {
+        'rows': len(weather_data),
+        'duplicate_ids': duplicate_count(weather_data, ['id']),
+        'duplicate_date_country': duplicate_count(weather_data, ['date', 'country']),
+        'nulls': null_counts(weather_data),
+        'missing_weekdays_per_country': {str(country): int(count) for country, count in missing.items()},
+        'first_date': format_dates([weather_data['date'].min()])[0] if len(weather_data) else None,
+        'last_date': format_dates([weather_data['date'].max()])[0] if len(weather_data) else None,
+    }
+
+# Function to profile the four datasets (typed and filtered for the year, see pnl/fetch.py)
+def profile_datasets(employee_data, attendance_data, events_data, weather_data, year=2023):
+    countries = sorted(employee_data['country'].dropna().astype(object).unique().tolist())
+    return {
+        'year': year,
+        'employees': profile_employees(employee_data),
+        'attendance': profile_attendance(attendance_data, employee_data, year),
+        'events': profile_events(events_data),
+        'weather': profile_weather(weather_data, countries, year),
+    }
+
+# Function to read a saved report, returning None if there is none or it was computed from other sources or for another year
+def load_report(report_path, sources, year=2023):
+    try:
+        with open(report_path, "r") as f:
+            saved = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if saved.get('version') != REPORT_VERSION or saved.get('sources') != sources or saved.get('report', {}).get('year') != year:
+        return None
+    return saved['report']
+
+# Function to save a report with the checksums of the sources it was computed from
+def save_report(report_path, sources, report):
+    with open(f"{report_path}.tmp", "w") as f:
+        json.dump({'version': REPORT_VERSION, 'sources': sources, 'report': report}, f, indent=2)
+    os.replace(f"{report_path}.tmp", report_path) # Replace the old report only once the new one is completely written
@@ -0,0 +1,129 @@
+"""
+Module Name: pnl/rollups.py
+Description: Materialized per-employee weekly rollups of the attendance, with prefix sums for date range queries.
+
+WeeklyRollups holds, for each employee and each week (Monday to Sunday), the number of attendance records, the seconds
+worked (records with both clocks), the late arrivals, the early departures and the absences, built in one np.bincount pass
+over the attendance. Each metric is stored as cumulative sums over the weeks (an employees x (weeks + 1) array starting
+with a column of zeros), so the total of any range of weeks is one subtraction per employee:
+    total(first week, last week) = prefix[:, last week + 1] - prefix[:, first week]
+Date ranges are rounded out to the weeks containing their first and last days, and the average hours per week of a range
+divide by the number of those weeks rather than by a fixed 52.
+
+update() adds new attendance rows (as they are ingested by pnl/incremental.py) without touching the attendance already
+rolled up: the new rows are rolled up on their own and added to the cumulative sums, growing the employees and weeks as needed.
+"""
+
+import numpy as np
+import pandas as pd
+from pnl.compact import MISSING_CLOCK, clock_seconds, format_dates, parse_dates
+from pnl.pipeline import EARLY_CLOCK_OUT, LATE_CLOCK_IN
+
+ROLLUP_METRICS = ['records', 'seconds_worked', 'late_arrivals', 'early_departures', 'absences']
+
+# Function to get the week number (weeks since Monday 1969-12-29) of each day number <-- Day 0 (1970-01-01) was a Thursday
+def week_numbers(days):
+    return (np.asarray(days, dtype=np.int64) + 3) // 7
+
+# Function to get the day number of the Monday of each week number
+def week_start_days(weeks):
+    return np.asarray(weeks, dtype=np.int64) * 7 - 3
+
+# Function to get the value of each metric for each attendance record
+def _record_metrics(attendance_data):
+    clock_in = attendance_data['clock_in'].to_numpy()
+    clock_out = attendance_data['clock_out'].to_numpy()
+    worked = (clock_in != MISSING_CLOCK) & (clock_out != MISSING_CLOCK)
+    return {
+        'records': np.ones(len(attendance_data), dtype=np.int64),
+        'seconds_worked': np.where(worked, clock_out.astype(np.int64) - clock_in, 0),
+        'late_arrivals': clock_in > clock_seconds(LATE_CLOCK_IN),
+        'early_departures': (clock_out != MISSING_CLOCK) & (clock_out < clock_seconds(EARLY_CLOCK_OUT)),
+        'absences': (clock_in == MISSING_CLOCK) & (clock_out == MISSING_CLOCK),
+    }
+
+# Class to hold the cumulative weekly sums of each metric for each employee (never modified once built, update() returns a new one)
+class WeeklyRollups:
+    def __init__(self, employees, first_week, prefix):
+        self.employees = employees # Sorted employee ids <-- Row of each employee in the prefix sums
+        self.first_week = first_week # Week number of the first column of weekly sums
+        self.prefix = prefix # Metric -> employees x (weeks + 1) int64 cumulative sums
+
+    @property
+    def weeks(self):
+        return self.prefix['records'].shape[1] - 1
+
+    # Function to roll up typed attendance data (see pnl/compact.py)
+    @classmethod
+    def from_attendance(cls, attendance_data):
+        employees, rows = np.unique(attendance_data['employee_record_id'].to_numpy(), return_inverse=True)
+        weeks = week_numbers(attendance_data['date'].to_numpy())
+        first_week = int(weeks.min()) if len(weeks) else 0
+        n_weeks = int(weeks.max()) - first_week + 1 if len(weeks) else 0
+        cells = rows.astype(np.int64) * n_weeks + (weeks - first_week) # One cell per (employee, week)
+        prefix = {}
+        for metric, values in _record_metrics(attendance_data).items():
+            weekly = np.bincount(cells, weights=values, minlength=len(employees) * n_weeks).round().astype(np.int64) # Sums of integers, exact in float64
+            prefix[metric] = np.zeros((len(employees), n_weeks + 1), dtype=np.int64)
+            np.cumsum(weekly.reshape(len(employees), n_weeks), axis=1, out=prefix[metric][:, 1:])
+        return cls(employees, first_week, prefix)
+
+    # Function to align the prefix sums of a metric to other employees and weeks (which must include these ones)
+    def _aligned(self, metric, employees, first_week, n_weeks):
+        aligned = np.zeros((len(employees), n_weeks + 1), dtype=np.int64)
+        if not len(self.employees):
+            return aligned
+        rows = np.searchsorted(employees, self.employees)
+        start = self.first_week - first_week
+        aligned[rows, start:start + self.weeks + 1] = self.prefix[metric]
+        aligned[rows, start + self.weeks + 1:] = self.prefix[metric][:, -1:] # Carry the totals over the later weeks
+        return aligned
+
+    # Function to add new attendance rows to the rollups, returning the updated rollups
+    def update(self, new_attendance_data):
+        new = WeeklyRollups.from_attendance(new_attendance_data)
+        if not len(new.employees):
+            return self
+        if not len(self.employees):
+            return new
+        employees = np.union1d(self.employees, new.employees)
+        first_week = min(self.first_week, new.first_week)
+        n_weeks = max(self.first_week + self.weeks, new.first_week + new.weeks) - first_week
+        prefix = {metric: self._aligned(metric, employees, first_week, n_weeks) + new._aligned(metric, employees, first_week, n_weeks)
+                  for metric in ROLLUP_METRICS}
+        return WeeklyRollups(employees, first_week, prefix)
+
+    # Function to get the columns of the prefix sums covering the weeks of the given days (None for the first or last week)
+    def _week_range(self, start_day=None, end_day=None):
+        first = self.first_week if start_day is None else int(week_numbers(start_day))
+        last = self.first_week + self.weeks - 1 if end_day is None else int(week_numbers(end_day))
+        columns = np.clip([first - self.first_week, last + 1 - self.first_week], 0, self.weeks)
+        return int(columns[0]), int(columns[1]), max(last + 1 - first, 0)
+
+    # Function to total each metric for each employee over the weeks from the one of start_day to the one of end_day (day numbers,
+    # inclusive), also giving the number of weeks and the average hours worked per week
+    def range_totals(self, start_day=None, end_day=None):
+        start, end, weeks = self._week_range(start_day, end_day)
+        totals = pd.DataFrame({metric: self.prefix[metric][:, end] - self.prefix[metric][:, start] for metric in ROLLUP_METRICS},
+                              index=pd.Index(self.employees, name='record_id'))
+        totals['weeks'] = weeks
+        totals['average_hours_per_week'] = totals['seconds_worked'] / 3600 / weeks if weeks else np.nan
+        return totals
+
+    # Function to get the total seconds worked by each employee over all the rolled-up weeks (like pipeline.total_seconds_worked)
+    def total_seconds_worked(self):
+        return pd.Series(self.prefix['seconds_worked'][:, -1].astype(float), index=self.employees)
+
+    # Function to get the weekly values of each metric for one employee, or None if the employee has no attendance
+    def employee_weeks(self, record_id):
+        row = np.searchsorted(self.employees, record_id)
+        if row == len(self.employees) or self.employees[row] != record_id:
+            return None
+        weekly = pd.DataFrame({metric: np.diff(self.prefix[metric][row]) for metric in ROLLUP_METRICS})
+        weekly.insert(0, 'week_start', format_dates(week_start_days(np.arange(self.first_week, self.first_week + self.weeks))))
+        return weekly
+
+    # Function to total each metric for each employee between two date strings ('%Y-%m-%d', inclusive)
+    def date_range_totals(self, start_date=None, end_date=None):
+        start_day, end_day = (None if date is None else int(parse_dates([date])[0]) for date in (start_date, end_date))
+        return self.range_totals(start_day, end_day)
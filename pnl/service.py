@@ -0,0 +1,267 @@
+"""
+Module Name: pnl/service.py
+Description: Long-running query service that keeps the analysed datasets and their indexes in memory.
+
+QueryService loads the four datasets once, runs the analysis (the same stages as identify_employees.py) and builds a
+DatasetIndex of the results:
+- per employee: their details, infractions, average hours per week, possibly attended events and problem clocks (the
+  candidate rows of each employee are one slice of the candidates sorted by employee),
+- per (country, date): the events whose window covers the date with good weather and the problem clocks around events on it.
+Queries are answered from the index over a local HTTP/JSON API (GET only):
+- /status: when the data was loaded, the checksums of the events and weather it was loaded from and the dataset sizes
+- /employees/<record_id>: everything about one employee
+- /employees/<record_id>/weeks: the weekly rollups of one employee's attendance (see pnl/rollups.py)
+- /rollups[?start=YYYY-MM-DD&end=YYYY-MM-DD]: the rollups of every employee totalled over the weeks of a date range
+- /countries/<country>[?date=YYYY-MM-DD]: the employees, flagged employees and events of a country, or of one date in it
+- /report[?country=<country>]: the results (as in results.json), optionally for one country
+- /crossings?month=YYYY-MM: the employees who crossed the infraction threshold in that month (counting only problem clocks
+  up to the end of the month, and not up to the end of the previous month)
+A background thread revalidates the events and weather sources every refresh_interval seconds (through the HTTP cache, with
+conditional requests) and, when either changed, rebuilds the index and swaps it in; queries keep being answered from the
+previous index meanwhile. Changes to the employees and attendance files need a restart.
+"""
+
+import http.server
+import json
+import threading
+import time
+from urllib.parse import parse_qs, unquote, urlparse
+import numpy as np
+import pandas as pd
+from pnl.compact import format_dates, parse_dates
+from pnl.fetch import load_datasets, url_checksum
+from pnl.matching import match_infractions
+from pnl.pipeline import (CANDIDATE_COLUMNS, EMPLOYEE_COLUMNS, INFRACTION_THRESHOLD, average_hours_per_week, build_results, count_infractions,
+                          expand_event_windows, filter_problem_attendance, find_problem_clocks_absences, iter_result_records, join_events_weather,
+                          json_value, summarize_infractions, unique_employees)
+from pnl.rollups import WeeklyRollups
+
+DEFAULT_PORT = 8700
+DEFAULT_REFRESH_INTERVAL = 300 # Seconds between checks of the events and weather sources
+
+# Class to hold the results of one analysis run and the indexes used to answer queries (never modified once built)
+class DatasetIndex:
+    def __init__(self, employee_data, attendance_data, events_data, weather_data, year=2023, sources=None):
+        self.year = year
+        self.sources = sources or {}
+        self.loaded_at = time.time()
+        self.sizes = {'employees': len(employee_data), 'attendance': len(attendance_data), 'events': len(events_data), 'weather': len(weather_data)}
+
+        # Run the analysis
+        employee_data = unique_employees(employee_data) # First row of each employee id, like the other engines <-- The employee index needs unique ids
+        events_weather = join_events_weather(expand_event_windows(events_data, year), weather_data)
+        employee_attendance = filter_problem_attendance(employee_data, attendance_data)
+        candidates = find_problem_clocks_absences(employee_attendance, events_weather)[CANDIDATE_COLUMNS]
+        chosen = match_infractions(candidates)
+        summary = summarize_infractions(candidates, chosen)
+        self.rollups = WeeklyRollups.from_attendance(attendance_data)
+        hours = average_hours_per_week(self.rollups.total_seconds_worked())
+        self.results = build_results(summary, employee_data, hours)
+
+        # Per-employee index
+        self.employee_positions = pd.Index(employee_data['record_id'].to_numpy())
+        self.employee_records = list(iter_result_records(employee_data[EMPLOYEE_COLUMNS])) # JSON-serializable details of each employee
+        self.hours = hours
+        self.summary = summary.set_index('record_id_x')
+        self.candidates = candidates.assign(infraction=chosen).sort_values(['record_id_x', 'clock_date', 'event_date'], kind='stable').reset_index(drop=True)
+        self.candidate_employees = self.candidates['record_id_x'].to_numpy()
+
+        # Per-(country, date) index
+        self.events_weather = events_weather.reset_index(drop=True)
+        self.country_date_events = self.events_weather.groupby([self.events_weather['country'].astype(object), 'clock_date']).indices
+        self.country_date_candidates = self.candidates.groupby([self.candidates['country'].astype(object), 'clock_date']).indices
+        self.country_employees = employee_data.groupby(employee_data['country'].astype(object))['record_id'].agg(list).to_dict()
+        self.country_results = self.results.groupby(self.results['country'].astype(object)).indices
+
+    # Function to get the details of an employee, or None if there is no such employee
+    def _employee_details(self, record_id):
+        try:
+            position = self.employee_positions.get_loc(record_id)
+        except KeyError:
+            return None
+        return dict(self.employee_records[position])
+
+    # Function to answer a per-employee query, returning None for an unknown employee
+    def employee(self, record_id):
+        details = self._employee_details(record_id)
+        if details is None:
+            return None
+        start, end = np.searchsorted(self.candidate_employees, [record_id, record_id + 1]) # The employee's slice of the sorted candidates
+        clocks = self.candidates.iloc[start:end]
+        freq = int(self.summary.at[record_id, 'freq']) if record_id in self.summary.index else 0
+        hours = self.hours.get(record_id)
+        return {
+            **details,
+            'average_hours_per_week': None if hours is None else json_value(float(hours)), # Rounded like /report and results.json
+            'infractions': freq,
+            'flagged': freq > INFRACTION_THRESHOLD,
+            'events': self.summary.at[record_id, 'events'] if record_id in self.summary.index else [],
+            'problem_clocks': [
+                {'clock_date': clock_date, 'event_name': event_name, 'event_date': event_date, 'infraction': infraction}
+                for clock_date, event_name, event_date, infraction in zip(format_dates(clocks['clock_date']).tolist(), clocks['event_name'].tolist(),
+                                                                          format_dates(clocks['event_date']).tolist(), clocks['infraction'].tolist())
+            ],
+        }
+
+    # Function to list the weekly records, seconds worked, late arrivals, early departures and absences of an employee,
+    # returning None for an employee without attendance
+    def employee_weeks(self, record_id):
+        weekly = self.rollups.employee_weeks(record_id)
+        return None if weekly is None else list(iter_result_records(weekly))
+
+    # Function to total the weekly rollups of every employee over the weeks from start_date to end_date ('YYYY-MM-DD', inclusive)
+    def rollups_between(self, start_date=None, end_date=None):
+        return list(iter_result_records(self.rollups.date_range_totals(start_date, end_date).reset_index()))
+
+    # Function to answer a per-country query (optionally for one date), returning None for an unknown country
+    def country(self, country, date=None):
+        if country not in self.country_employees:
+            return None
+        flagged = self.results.iloc[self.country_results.get(country, [])]['record_id'].tolist()
+        answer = {'country': country, 'employees': len(self.country_employees[country]), 'flagged_employees': flagged}
+        if date is None:
+            events = self.events_weather[self.events_weather['country'].astype(object) == country].drop_duplicates('event_id')
+            answer['events'] = [{'event_name': name, 'event_date': event_date} for name, event_date in
+                                zip(events['event_name'].tolist(), format_dates(events['event_date']).tolist())]
+            return answer
+        day = int(parse_dates([date])[0])
+        events = self.events_weather.iloc[self.country_date_events.get((country, day), [])]
+        clocks = self.candidates.iloc[self.country_date_candidates.get((country, day), [])]
+        answer['date'] = date
+        answer['events'] = [{'event_name': name, 'event_date': event_date} for name, event_date in
+                            zip(events['event_name'].tolist(), format_dates(events['event_date']).tolist())]
+        answer['problem_clocks'] = sorted(set(clocks['record_id_x'].tolist()))
+        return answer
+
+    # Function to answer a full-report query (optionally for one country)
+    def report(self, country=None):
+        results = self.results if country is None else self.results.iloc[self.country_results.get(country, [])]
+        return list(iter_result_records(results))
+
+    # Function to find the employees who crossed the infraction threshold in the given month ('YYYY-MM')
+    def crossings(self, month):
+        period = pd.Period(month, freq='M')
+        start_day, end_day = (int(day) for day in parse_dates([f"{period}-01", f"{period + 1}-01"]))
+        candidates = self.candidates[CANDIDATE_COLUMNS]
+        clock_dates = candidates['clock_date'].to_numpy()
+        through = count_infractions(candidates[clock_dates < end_day]).set_index('record_id_x')['freq']
+        before = count_infractions(candidates[clock_dates < start_day]).set_index('record_id_x')['freq']
+        before = before.reindex(through.index, fill_value=0)
+        crossed = through[(through > INFRACTION_THRESHOLD) & (before <= INFRACTION_THRESHOLD)]
+        return [{**self._employee_details(record_id), 'infractions': int(freq), 'infractions_before': int(before[record_id])}
+                for record_id, freq in crossed.items()]
+
+    # Function to describe the index
+    def status(self):
+        return {
+            'year': self.year,
+            'loaded_at': time.strftime('%Y-%m-%dT%H:%M:%S%z', time.localtime(self.loaded_at)),
+            'sources': self.sources,
+            'sizes': self.sizes,
+            'flagged_employees': len(self.results),
+        }
+
+# Class to load the datasets, keep their index up to date and serve queries over HTTP
+class QueryService:
+    def __init__(self, employee_data_path, attendance_data_path, events_url, weather_url, year=2023, cache_dir=None,
+                 refresh_interval=DEFAULT_REFRESH_INTERVAL):
+        self.employee_data_path = employee_data_path
+        self.attendance_data_path = attendance_data_path
+        self.events_url = events_url
+        self.weather_url = weather_url
+        self.year = year
+        self.cache_dir = cache_dir
+        self.refresh_interval = refresh_interval
+        self.index = None
+        self._stop = threading.Event()
+
+    # Function to get the checksums of the events and weather sources, revalidating them if older than ttl seconds
+    def source_checksums(self, ttl=0):
+        return {'events': url_checksum(self.events_url, self.cache_dir, ttl), 'weather': url_checksum(self.weather_url, self.cache_dir, ttl)}
+
+    # Function to load the datasets and build a new index, which replaces the current one only once it is complete
+    def load(self):
+        sources = self.source_checksums()
+        datasets = load_datasets(self.employee_data_path, self.attendance_data_path, self.events_url, self.weather_url, self.year, self.cache_dir)
+        self.index = DatasetIndex(*datasets, year=self.year, sources=sources)
+        return self.index
+
+    # Function to reload the datasets if the events or weather sources changed, returning whether they did
+    def refresh(self):
+        if self.source_checksums() == self.index.sources:
+            return False
+        self.load()
+        return True
+
+    # Function to check the sources every refresh_interval seconds until the service is stopped
+    def _refresh_loop(self):
+        while not self._stop.wait(self.refresh_interval):
+            try:
+                if self.refresh():
+                    print(f"Events or weather data changed. Reloaded the datasets ({self.index.status()['loaded_at']}).")
+            except Exception as e: # Keep serving the current index <-- The sources may be temporarily unreachable
+                print(f"Error refreshing the datasets ({e}). Serving the data loaded at {self.index.status()['loaded_at']}.")
+
+    # Function to answer a GET request for the given path and query string, returning (status code, JSON-serializable body)
+    def handle(self, path, query):
+        index = self.index # The index of the whole request, even if a refresh swaps it meanwhile
+        parts = [unquote(part) for part in path.strip('/').split('/') if part]
+        params = {key: values[-1] for key, values in parse_qs(query).items()}
+        try:
+            if parts == ['status']:
+                return 200, index.status()
+            if len(parts) == 2 and parts[0] == 'employees':
+                answer = index.employee(int(parts[1]))
+                return (200, answer) if answer is not None else (404, {'error': f"Unknown employee: {parts[1]}"})
+            if len(parts) == 3 and parts[0] == 'employees' and parts[2] == 'weeks':
+                answer = index.employee_weeks(int(parts[1]))
+                return (200, answer) if answer is not None else (404, {'error': f"No attendance for employee: {parts[1]}"})
+            if parts == ['rollups']:
+                return 200, index.rollups_between(params.get('start'), params.get('end'))
+            if len(parts) == 2 and parts[0] == 'countries':
+                answer = index.country(parts[1], params.get('date'))
+                return (200, answer) if answer is not None else (404, {'error': f"Unknown country: {parts[1]}"})
+            if parts == ['report']:
+                return 200, index.report(params.get('country'))
+            if parts == ['crossings']:
+                if 'month' not in params:
+                    return 400, {'error': "The month parameter (YYYY-MM) is required"}
+                return 200, index.crossings(params['month'])
+        except ValueError as e: # Malformed record id, date or month
+            return 400, {'error': str(e)}
+        return 404, {'error': f"Unknown path: {path}"}
+
+    # Function to serve queries on the given host and port until interrupted, refreshing the data in the background
+    def serve(self, host='127.0.0.1', port=DEFAULT_PORT):
+        if self.index is None:
+            self.load()
+        service = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                try:
+                    status, body = service.handle(url.path, url.query)
+                except Exception as e: # Answer instead of dropping the connection
+                    status, body = 500, {'error': f"Error answering {url.path} ({e})"}
+                content = json.dumps(body, separators=(',', ':')).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, *args):
+                pass
+
+        server = http.server.ThreadingHTTPServer((host, port), Handler)
+        refresher = threading.Thread(target=self._refresh_loop, name='refresh', daemon=True)
+        refresher.start()
+        print(f"Serving queries on http://{host}:{server.server_address[1]} (press Ctrl+C to stop)...")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._stop.set()
+            server.server_close()
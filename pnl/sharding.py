@@ -0,0 +1,67 @@
+"""
+Module Name: pnl/sharding.py
+Description: Parallel execution of the analysis across country or employee shards.
+
+Country is the join key between employees, events and weather, so the analysis of each country is independent of the
+others; the infraction counting is also independent per employee. run_sharded() partitions the datasets by country (or
+by a hash of the employee id), runs the window join, weather and clock filters and infraction matching of each shard
+in a process pool and merges the per-employee summaries. Each worker only receives the rows and columns of its shard.
+Employees without a country are a country shard of their own, so every employee and attendance row is in exactly one shard.
+The merged summary and seconds worked are the same as those of the single-process pipeline.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from pnl.pipeline import (expand_event_windows, filter_problem_attendance, find_problem_clocks_absences, join_events_weather,
+                          summarize_infractions, total_seconds_worked, unique_employees)
+
+# Columns of each dataset needed by the workers
+SHARD_COLUMNS = {
+    'employees': ['record_id', 'country'],
+    'attendance': ['record_id', 'employee_record_id', 'date', 'clock_in', 'clock_out'],
+    'events': ['id', 'event_name', 'event_date', 'country'],
+    'weather': ['date', 'country', 'condition', 'max_temp'],
+}
+
+# Function to run the analysis for one shard in a worker process, returning the summary and seconds worked of its employees
+def _run_shard(shard):
+    employee_data, attendance_data, events_data, weather_data, year = shard
+    events_weather = join_events_weather(expand_event_windows(events_data, year), weather_data)
+    employee_attendance = filter_problem_attendance(employee_data, attendance_data)
+    problem_clocks_absences = find_problem_clocks_absences(employee_attendance, events_weather)
+    return summarize_infractions(problem_clocks_absences), total_seconds_worked(attendance_data)
+
+# Function to split the datasets into shards by country or by a hash of the employee id
+def shard_datasets(employee_data, attendance_data, events_data, weather_data, year=2023, shard_by='country', shards=None):
+    employee_data = unique_employees(employee_data)[SHARD_COLUMNS['employees']] # One row per employee id <-- The key lookup needs unique ids
+    attendance_data = attendance_data[SHARD_COLUMNS['attendance']]
+    events_data = events_data[SHARD_COLUMNS['events']]
+    weather_data = weather_data[SHARD_COLUMNS['weather']]
+
+    if shard_by == 'country':
+        employee_keys = pd.Series(pd.factorize(employee_data['country'], use_na_sentinel=False)[0], index=employee_data.index) # Employees without a country get a shard too
+    elif shard_by == 'employee':
+        employee_keys = employee_data['record_id'] % (shards or os.cpu_count() or 1)
+    else:
+        raise ValueError(f"Unknown shard key: {shard_by}")
+    attendance_keys = attendance_data['employee_record_id'].map(pd.Series(employee_keys.to_numpy(), index=employee_data['record_id']))
+
+    for key, employees in employee_data.groupby(employee_keys.to_numpy()):
+        countries = employees['country'].unique() # Only send the events and weather of the countries of the shard's employees
+        yield (
+            employees,
+            attendance_data[attendance_keys == key],
+            events_data[events_data['country'].isin(countries)],
+            weather_data[weather_data['country'].isin(countries)],
+            year,
+        )
+
+# Function to run the analysis in a process pool, one task per shard, and merge the summaries and seconds worked of the shards
+def run_sharded(employee_data, attendance_data, events_data, weather_data, year=2023, shard_by='country', shards=None, max_workers=None):
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(_run_shard, shard_datasets(employee_data, attendance_data, events_data, weather_data, year, shard_by, shards)))
+    summary = pd.concat([summary for summary, _ in results], ignore_index=True).sort_values('record_id_x').reset_index(drop=True)
+    summary = summary.astype({'record_id_x': employee_data['record_id'].dtype}) # <-- Shards without infractions (e.g. employees without a country) have int64 ids
+    seconds_worked = pd.concat([seconds for _, seconds in results]).sort_index()
+    return summary, seconds_worked
@@ -0,0 +1,142 @@
+"""
+Module Name: pnl/synthetic.py
+Description: Deterministic generator of synthetic employees, attendance, events and weather datasets.
+
+The datasets have the same records as the real JSON files (see README.md) and are written in the layout the scripts expect:
+employees.json, attendance.json, events.json and weather.json in one directory. The same parameters and seed always give
+the same files, so runs at different sizes or on different versions of the code can be compared.
+
+- Employees are spread evenly over the countries.
+- Attendance has one record per employee per weekday, in date order. Each record is late (clock in after 08:15), early
+  (clock out before 16:00) or an absence (no clocks) with the given probabilities, and on time otherwise.
+- Events fall on random days of each year, events_per_country per country per year.
+- Weather has one record per country per weekday, with the extreme conditions about as frequent as in the sample data.
+The attendance and weather span a few days either side of the years, like the real data, so that the year filters are exercised.
+Attendance is generated and written one block of days at a time (as NDJSON), so the size of the dataset is bounded by disk, not memory.
+"""
+
+import json
+import os
+import numpy as np
+import pandas as pd
+from pnl.compact import format_dates, year_bounds
+
+COUNTRIES = ['Canada', 'Mexico', 'Brazil', 'Argentina', 'Chile', 'Peru', 'Colombia', 'Uruguay']
+CONDITIONS = ['sunny', 'cloudy', 'rain', 'snow', 'blizzard', 'hail', 'thunderstorm', 'hurricane']
+CONDITION_WEIGHTS = [0.34, 0.31, 0.15, 0.06, 0.04, 0.04, 0.03, 0.03] # Roughly the frequencies in the sample weather data
+MARGIN_DAYS = 10 # Days of attendance and weather generated before and after the years
+ATTENDANCE_BATCH_SIZE = 1000000 # Approximate number of attendance records generated at a time
+
+# Clock strings for each minute of the day
+_CLOCK_STRINGS = np.array([f"{minute // 60:02d}:{minute % 60:02d}:00" for minute in range(24 * 60)], dtype=object)
+
+# Function to get the names of the given number of countries
+def country_names(countries):
+    return [COUNTRIES[i] if i < len(COUNTRIES) else f"Country {i + 1}" for i in range(countries)]
+
+# Function to get the day numbers of the weekdays from MARGIN_DAYS before the first year to MARGIN_DAYS after the last year
+def _weekdays(years):
+    first_day, end_day = year_bounds(years[0])[0] - MARGIN_DAYS, year_bounds(years[-1])[1] + MARGIN_DAYS
+    days = np.arange(first_day, end_day)
+    return days[(days + 3) % 7 < 5] # Day 0 (1970-01-01) was a Thursday
+
+# Function to generate the employees dataset
+def generate_employees(employees, countries, rng):
+    record_ids = np.arange(1, employees + 1)
+    work_ids = rng.integers(0, 1 << 63, size=(employees, 2), dtype=np.uint64)
+    return pd.DataFrame({
+        'record_id': record_ids,
+        'name': [f"Emp {i}" for i in record_ids.tolist()],
+        'work_id_number': [f"{high:016x}{low:016x}" for high, low in work_ids.tolist()],
+        'email_address': [f"e{i}@example.net" for i in record_ids.tolist()],
+        'country': np.array(country_names(countries), dtype=object)[(record_ids - 1) % countries],
+        'phone_number': [f"555-{i:07d}" for i in record_ids.tolist()],
+    })
+
+# Function to generate the events dataset, events_per_country events per country per year
+def generate_events(years, countries, events_per_country, rng):
+    frames = []
+    for year in years:
+        first_day, end_day = year_bounds(year)
+        for country in country_names(countries):
+            frames.append(pd.DataFrame({'event_date': rng.integers(first_day, end_day, size=events_per_country), 'country': country}))
+    events = pd.concat(frames, ignore_index=True)
+    ids = np.arange(1, len(events) + 1)
+    return pd.DataFrame({
+        'id': ids,
+        'event_name': [f"Event {i}" for i in ids.tolist()],
+        'event_date': format_dates(events['event_date']),
+        'country': events['country'],
+    })
+
+# Function to generate the weather dataset, one record per country per weekday
+def generate_weather(years, countries, rng):
+    days = _weekdays(years)
+    names = country_names(countries)
+    max_temp = rng.integers(-5, 46, size=len(days) * countries)
+    return pd.DataFrame({
+        'id': np.arange(1, len(days) * countries + 1),
+        'date': np.repeat(format_dates(days), countries),
+        'country': np.tile(np.array(names, dtype=object), len(days)),
+        'condition': rng.choice(np.array(CONDITIONS, dtype=object), size=len(days) * countries, p=CONDITION_WEIGHTS),
+        'max_temp': max_temp,
+        'min_temp': max_temp - rng.integers(5, 25, size=len(max_temp)),
+    })
+
+# Function to generate the attendance dataset in blocks of days, yielding one DataFrame per block
+def iter_attendance(employees, years, late_rate, early_rate, absence_rate, rng, batch_size=ATTENDANCE_BATCH_SIZE):
+    days = _weekdays(years)
+    days_per_block = max(1, batch_size // max(employees, 1))
+    employee_ids = np.arange(1, employees + 1)
+    record_id = 1
+    for start in range(0, len(days), days_per_block):
+        block = days[start:start + days_per_block]
+        size = len(block) * employees
+        clock_in = rng.integers(7 * 60 + 45, 8 * 60 + 16, size=size) # On time: 07:45 to 08:15
+        clock_out = rng.integers(16 * 60, 17 * 60 + 1, size=size) # On time: 16:00 to 17:00
+        kind = rng.random(size)
+        late = kind < late_rate
+        early = (kind >= late_rate) & (kind < late_rate + early_rate)
+        absent = (kind >= late_rate + early_rate) & (kind < late_rate + early_rate + absence_rate)
+        clock_in[late] = rng.integers(8 * 60 + 16, 10 * 60, size=late.sum()) # Late: 08:16 to 09:59
+        clock_out[early] = rng.integers(12 * 60, 16 * 60, size=early.sum()) # Early: 12:00 to 15:59
+        clock_in_strings = _CLOCK_STRINGS[clock_in]
+        clock_out_strings = _CLOCK_STRINGS[clock_out]
+        clock_in_strings[absent] = None
+        clock_out_strings[absent] = None
+        yield pd.DataFrame({
+            'record_id': np.arange(record_id, record_id + size),
+            'employee_record_id': np.tile(employee_ids, len(block)),
+            'date': np.repeat(format_dates(block), employees),
+            'clock_in': clock_in_strings,
+            'clock_out': clock_out_strings,
+        })
+        record_id += size
+
+# Function to write a DataFrame to a JSON file as an array of records
+def _write_json(df, file_path):
+    with open(file_path, 'w') as f:
+        json.dump(df.to_dict(orient='records'), f)
+
+# Function to generate the four datasets and write them to the given directory, returning the number of records of each
+# (years is the number of years generated, starting with start_year)
+def write_synthetic_datasets(out_dir, employees=1000, years=1, start_year=2023, countries=3, events_per_country=40,
+                             late_rate=0.04, early_rate=0.03, absence_rate=0.02, seed=0):
+    rng = np.random.default_rng(seed)
+    year_list = list(range(start_year, start_year + years))
+    os.makedirs(out_dir, exist_ok=True)
+
+    employee_data = generate_employees(employees, countries, rng)
+    events_data = generate_events(year_list, countries, events_per_country, rng)
+    weather_data = generate_weather(year_list, countries, rng)
+    _write_json(employee_data, os.path.join(out_dir, 'employees.json'))
+    _write_json(events_data, os.path.join(out_dir, 'events.json'))
+    _write_json(weather_data, os.path.join(out_dir, 'weather.json'))
+
+    attendance_records = 0
+    with open(os.path.join(out_dir, 'attendance.json'), 'w') as f: # NDJSON, written one block of days at a time
+        for attendance_data in iter_attendance(employees, year_list, late_rate, early_rate, absence_rate, rng):
+            attendance_data.to_json(f, orient='records', lines=True)
+            attendance_records += len(attendance_data)
+
+    return {'employees': len(employee_data), 'attendance': attendance_records, 'events': len(events_data), 'weather': len(weather_data)}
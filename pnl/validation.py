@@ -0,0 +1,147 @@
+"""
+Module Name: pnl/validation.py
+Description: Exhaustive validation of results.json, used by test_results.py.
+
+recompute_infractions() recomputes the infractions of every employee independently of pnl/pipeline.py and pnl/matching.py:
+- the problem clocks (late clock in, early clock out or absence) are found on the attendance alone and kept on weekdays with
+  good weather in the employee's country,
+- each problem clock is paired with the events of the employee's country whose day before, day of or day after it falls on,
+- the pairs are matched from the clock date side: taking each employee's clock dates in order, each one is matched to the
+  unmatched event covering it that ends first (the earliest event date). This is the classic greedy for matching points to
+  intervals, and gives a maximum matching like the event-side greedy of pnl/matching.py, so the counts must agree.
+reconcile_results() then diffs the recomputed infractions, possibly attended events, average hours and employee details of
+every employee against results.json in a few merges, and returns one row per mismatch.
+An id listed more than once in employee data is checked against its first row, the rule of pipeline.unique_employees, and
+duplicate_employee_ids() lists those ids so they can be reported.
+"""
+
+import numpy as np
+import pandas as pd
+from pnl.compact import MISSING_CLOCK, clock_seconds, day_of_week, format_dates
+from pnl.pipeline import EARLY_CLOCK_OUT, EMPLOYEE_COLUMNS, EXTREME_WEATHER, INFRACTION_THRESHOLD, LATE_CLOCK_IN, MAX_TEMP, WEEKS_PER_YEAR, unique_employees
+
+MISMATCH_COLUMNS = ['record_id', 'check', 'expected', 'actual']
+EVENT_COLUMNS = ['country', 'event_name', 'event_date']
+
+# Function to find the problem clocks of each employee on weekdays with good weather in their country
+def _problem_clocks(employee_data, attendance_data, weather_data):
+    clock_in = attendance_data['clock_in'].to_numpy()
+    clock_out = attendance_data['clock_out'].to_numpy()
+    late = clock_in > clock_seconds(LATE_CLOCK_IN)
+    early = (clock_out != MISSING_CLOCK) & (clock_out < clock_seconds(EARLY_CLOCK_OUT))
+    absent = (clock_in == MISSING_CLOCK) & (clock_out == MISSING_CLOCK)
+    problems = attendance_data.loc[late | early | absent, ['employee_record_id', 'date']]
+    problems = problems.assign(country=problems['employee_record_id'].map(unique_employees(employee_data).set_index('record_id')['country']))
+
+    good_weather = weather_data[
+        ~weather_data['condition'].isin(EXTREME_WEATHER) & (weather_data['max_temp'] <= MAX_TEMP) & (day_of_week(weather_data['date']) < 5)
+    ]
+    good_days = pd.MultiIndex.from_frame(good_weather[['country', 'date']].astype({'country': object}))
+    return problems[pd.MultiIndex.from_frame(problems[['country', 'date']].astype({'country': object})).isin(good_days)]
+
+# Function to pair each problem clock with the events whose day before, day of or day after it falls on
+def _candidate_pairs(problems, events_data):
+    windows = pd.concat([events_data.assign(date=events_data['event_date'] + offset) for offset in (-1, 0, 1)], ignore_index=True)
+    windows = windows.astype({'country': object})
+    return pd.merge(problems.astype({'country': object}), windows[['id', 'event_name', 'event_date', 'country', 'date']], on=['country', 'date'])
+
+# Function to count the infractions of each employee by matching each clock date, in order, to the covering unmatched event that ends first
+def _count_matches(candidates):
+    candidates = candidates.sort_values(['employee_record_id', 'date', 'event_date', 'id'])
+    employees = candidates['employee_record_id'].tolist()
+    dates = candidates['date'].tolist()
+    events = candidates['id'].tolist()
+    counts = {}
+    employee = date = None
+    for i in range(len(employees)):
+        if employees[i] != employee: # New employee <-- No event matched yet
+            employee, date, matched_events = employees[i], None, set()
+            counts[employee] = 0
+        if dates[i] != date: # New clock date <-- Not matched yet
+            date, date_matched = dates[i], False
+        if not date_matched and events[i] not in matched_events:
+            matched_events.add(events[i])
+            date_matched = True
+            counts[employee] += 1
+    return pd.Series(counts, dtype='int64')
+
+# Function to recompute the number of infractions, the possibly attended events and the average hours per week of every employee
+# Returns a DataFrame with one row per employee (record_id, freq, flagged, average_hours_per_week) and a DataFrame of their events
+def recompute_infractions(employee_data, attendance_data, events_data, weather_data):
+    problems = _problem_clocks(employee_data, attendance_data, weather_data)
+    candidates = _candidate_pairs(problems, events_data)
+
+    expected = unique_employees(employee_data)[['record_id']].copy()
+    expected['freq'] = expected['record_id'].map(_count_matches(candidates)).fillna(0).astype('int64')
+    expected['flagged'] = expected['freq'] > INFRACTION_THRESHOLD
+    clock_in = attendance_data['clock_in'].to_numpy()
+    clock_out = attendance_data['clock_out'].to_numpy()
+    worked = pd.Series(np.where((clock_in != MISSING_CLOCK) & (clock_out != MISSING_CLOCK), clock_out - clock_in, 0)) # Days with a missing clock count as 0 seconds
+    hours = worked.groupby(attendance_data['employee_record_id'].to_numpy()).sum() / 3600 / WEEKS_PER_YEAR
+    expected['average_hours_per_week'] = expected['record_id'].map(hours) # NaN for employees without attendance
+
+    expected_events = candidates[['employee_record_id', 'country', 'event_name', 'event_date']].drop_duplicates()
+    expected_events = expected_events.rename(columns={'employee_record_id': 'record_id'})
+    expected_events['event_date'] = format_dates(expected_events['event_date'])
+    return expected.reset_index(drop=True), expected_events.reset_index(drop=True)
+
+# Function to list the employee ids that appear more than once in employee data (each is checked against its first row)
+def duplicate_employee_ids(employee_data):
+    return sorted(employee_data.loc[employee_data['record_id'].duplicated(), 'record_id'].unique().tolist())
+
+# Function to turn the rows of a DataFrame into mismatch rows
+def _mismatches(rows, check, expected, actual):
+    return pd.DataFrame({'record_id': rows['record_id'].to_numpy(), 'check': check, 'expected': expected, 'actual': actual}, columns=MISMATCH_COLUMNS)
+
+# Function to diff results.json against the recomputed infractions, returning one row per mismatch (record_id, check, expected, actual)
+def reconcile_results(results_data, employee_data, expected, expected_events):
+    mismatches = []
+    if results_data.empty:
+        results_data = pd.DataFrame(columns=EMPLOYEE_COLUMNS + ['average_hours_per_week', 'events'])
+
+    # Every employee is listed at most once
+    duplicated = results_data[results_data['record_id'].duplicated()]
+    mismatches.append(_mismatches(duplicated, 'listed once', 1, 'listed again'))
+
+    # Exactly the employees with more than 3 infractions are listed
+    listed = expected['record_id'].isin(results_data['record_id'])
+    missing = expected[expected['flagged'] & ~listed]
+    mismatches.append(_mismatches(missing, 'listed', [f"listed ({freq} infractions)" for freq in missing['freq'].tolist()], 'not listed'))
+    unexpected = expected[~expected['flagged'] & listed]
+    mismatches.append(_mismatches(unexpected, 'listed', [f"not listed ({freq} infractions)" for freq in unexpected['freq'].tolist()], 'listed'))
+    unknown = results_data[~results_data['record_id'].isin(employee_data['record_id'])]
+    mismatches.append(_mismatches(unknown, 'known employee', 'in employee data', 'not in employee data'))
+
+    # The employee details and average hours per week of each listed employee are correct
+    listed_results = results_data.drop_duplicates('record_id')
+    compared = pd.merge(listed_results, unique_employees(employee_data)[EMPLOYEE_COLUMNS], on='record_id', suffixes=('', '_expected'))
+    for col in EMPLOYEE_COLUMNS[1:]:
+        actual, expected_values = compared[col].astype(object), compared[f"{col}_expected"].astype(object)
+        different = compared[~((actual == expected_values) | (actual.isna() & expected_values.isna()))]
+        mismatches.append(_mismatches(different, col, different[f"{col}_expected"].tolist(), different[col].tolist()))
+    compared = pd.merge(listed_results[['record_id', 'average_hours_per_week']], expected[['record_id', 'average_hours_per_week']],
+                        on='record_id', suffixes=('', '_expected'))
+    actual_hours = pd.to_numeric(compared['average_hours_per_week'], errors='coerce').to_numpy(dtype=float)
+    expected_hours = compared['average_hours_per_week_expected'].to_numpy(dtype=float)
+    different = compared[~np.isclose(actual_hours, expected_hours, rtol=1e-9, atol=1e-9, equal_nan=True)]
+    mismatches.append(_mismatches(different, 'average_hours_per_week', different['average_hours_per_week_expected'].tolist(), different['average_hours_per_week'].tolist()))
+
+    # The possibly attended events of each listed employee are exactly the events around their recomputed problem clocks
+    listed_events = listed_results[['record_id', 'events']].explode('events').dropna(subset=['events'])
+    listed_events = pd.concat([listed_events[['record_id']].reset_index(drop=True),
+                               pd.DataFrame(listed_events['events'].tolist(), columns=EVENT_COLUMNS)], axis=1)
+    flagged_events = expected_events[expected_events['record_id'].isin(expected.loc[expected['flagged'], 'record_id'])]
+    flagged_events = flagged_events[flagged_events['record_id'].isin(listed_results['record_id'])]
+    events = pd.merge(flagged_events.astype({'country': object}), listed_events.astype({'country': object}),
+                      on=['record_id'] + EVENT_COLUMNS, how='outer', indicator=True)
+    events = events[events['record_id'].isin(expected.loc[expected['flagged'], 'record_id'])] # Unexpected employees are reported above
+    descriptions = (events['event_name'] + ' on ' + events['event_date'] + ' in ' + events['country']).tolist()
+    is_missing = (events['_merge'] == 'left_only').to_numpy()
+    is_extra = (events['_merge'] == 'right_only').to_numpy()
+    mismatches.append(_mismatches(events[is_missing], 'events', [d for d, m in zip(descriptions, is_missing) if m], 'not listed'))
+    mismatches.append(_mismatches(events[is_extra], 'events', 'not listed', [d for d, m in zip(descriptions, is_extra) if m]))
+
+    mismatches = [df for df in mismatches if not df.empty]
+    if not mismatches:
+        return pd.DataFrame(columns=MISMATCH_COLUMNS)
+    return pd.concat(mismatches, ignore_index=True).sort_values(['record_id', 'check'], kind='stable').reset_index(drop=True)
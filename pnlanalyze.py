@@ -1,148 +1,127 @@
-import requests
-import json
-import pandas as pd
-from datetime import datetime
-
-# Function to fetch JSON data from the given API URL and convert it to a DataFrame
-def fetch_url_data(api_url, params=None):
-    response = requests.get(api_url, params=params)
-    if response.status_code == 200:
-        df = pd.DataFrame(response.json())
-        return df
+"""
+Script Name: pnlanalyze.py
+Description: This script answers questions about the structure and quality of the employees, attendance, events and weather data
+that the approach in identify_employees.py relies on (unique identifiers, null clocks, missing attendance and weather records,
+events close together).
+
+The checks are computed in one pass per dataset by pnl/quality.py, without building an employees x weekdays frame, and saved
+to data_quality.json with the checksums of the inputs. Later runs reuse the saved report until one of the inputs changes.
+
+Usage:
+- Ensure you have Python 3.12 installed.
+- Run the script: python pnlanalyze.py [--data-dir DATA_DIR]
+- Run it with the analysis and the validation on the same loaded data: python run_pipeline.py
+"""
+
+import argparse
+from pnl.dataset import Dataset
+from pnl.quality import load_report, save_report
+
+# Function to parse the command line arguments
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Answer questions about the structure and quality of the employees, attendance, events and weather data.")
+    parser.add_argument('--data-dir', default='.', help="Directory with employees.json and attendance.json, where data_quality.json is written (default: current directory)")
+    return parser.parse_args(argv)
+
+# Function to get the data-quality report of the dataset, reusing the saved report if none of the inputs changed since it was computed
+def analyze(dataset):
+    report_path = dataset.path('data_quality.json')
+    report = load_report(report_path, dataset.sources, year=dataset.year)
+    if report is not None:
+        print(f"The inputs are unchanged. Using the data-quality report in {report_path}")
+        return report
+
+    print("Fetching employee, attendance, events and weather data...")
+    # Fetch employee and attendance data from local storage and events and weather data from URLs concurrently, keeping only 2023 records
+    dataset.datasets # <-- Loaded once per process, later stages reuse the same DataFrames
+    print("Completed!")
+
+    print("Profiling the data...")
+    report = dataset.quality_report
+    save_report(report_path, dataset.sources, report)
+    print(f"Completed! The data-quality report was written to {report_path}")
+    return report
+
+# Function to print the answers of the data-quality report
+def print_answers(report):
+    employees = report['employees']
+    attendance = report['attendance']
+    events = report['events']
+    weather = report['weather']
+
+    print("\nIs record_id in employee data unique?")
+    if not employees['duplicate_record_ids']:
+        print("Yes. record_id in employee data is unique.\n")
+        print("Does each record_id in employee_data uniquely identify an employee?")
+        if not employees['duplicate_name_email']:
+            print("Yes. Each record_id uniquely identifies an employee.\n")
+        else:
+            print(f"No. There are multiple record_id's for the same employee ({employees['duplicate_name_email']} duplicates). <-- Data must be sanitized.\n")
     else:
-        print(f"Error fetching data from {api_url}. Status code: {response.status_code}")
-        return None
-
-# Function to fetch JSON data from local storage and convert it to a DataFrame
-def fetch_local_data(data_path):
-    with open(data_path, "r") as f:
-        data = json.load(f)
-    df = pd.DataFrame(data)
-    return df
-
-# URLs for events and weather data
-events_url = "https://www.pingtt.com/exam/events"
-weather_url = "https://www.pingtt.com/exam/weather"
-
-# Prompt the user for the path to the json files
-root_path = input("Enter the path to where your employees and attendance json files are stored on your machine: ")
-
-if root_path and not root_path.endswith('\\'):
-    root_path += '\\'
-
-employee_data_path = f"{root_path}employees.json"
-attendance_data_path = f"{root_path}attendance.json"
-
-print("Fetching employee and attendance data...")
-# Fetch employee and attendance data from local storage
-employee_data = fetch_local_data(employee_data_path)
-attendance_data = fetch_local_data(attendance_data_path)
-print("Completed!")
-
-print("Fetching events and weather data...")
-# Fetch events and weather data from URLs
-events_data = fetch_url_data(events_url)
-weather_data = fetch_url_data(weather_url)
-print("Completed!")
-
-# Filter the data for the year 2023
-events_data['event_date'] = pd.to_datetime(events_data['event_date'], format='%Y-%m-%d')
-weather_data['date'] = pd.to_datetime(weather_data['date'], format='%Y-%m-%d')
-attendance_data['date'] = pd.to_datetime(attendance_data['date'], format='%Y-%m-%d')
-events_data = events_data[events_data['event_date'].dt.year == 2023]
-weather_data = weather_data[weather_data['date'].dt.year == 2023]
-attendance_data = attendance_data[attendance_data['date'].dt.year == 2023]
-
-print("\nIs record_id in employee data unique?")
-if not employee_data.duplicated(subset=['record_id']).any():
-    print("Yes. record_id in employee data is unique.\n")
-    print("Does each record_id in employee_data uniquely identify an employee?")
-    if not employee_data.duplicated(subset=['name', 'email_address']).any():
-        print("Yes. Each record_id uniquely identifies an employee.\n")
+        print(f"No ({employees['duplicate_record_ids']} duplicates). There must be some other way to uniquely identify employees.\n")
+
+    print("Does each record_id in attendance_data uniquely identifies an employee's attendance record?")
+    if not attendance['duplicate_employee_dates']:
+        print("Yes. Each id record_id in attendance_data uniquely identify an employee's attendance record.\n")
+    else:
+        print(f"No. There are multiple id's for the same attendance record ({attendance['duplicate_employee_dates']} duplicates). <-- Data must be sanitized.\n")
+
+    print("Is there a record in attendance data for every employee on each weekday of 2023?")
+    if not attendance['missing_employee_weekdays']:
+        print("Yes. There is a record in attendance data for every employee on each weekday of 2023 <-- There must be a different way to test for absences from checking for missing records.\n")
+    else:
+        print(f"No. There are missing records for some employees on some weekdays of 2023 ({attendance['missing_employee_weekdays']} records missing for "
+              f"{attendance['employees_with_missing_weekdays']} employees). <-- A missing record must indicate an absence.\n")
+    if attendance['unknown_employee_records']:
+        print(f"Note: {attendance['unknown_employee_records']} attendance records are for employees not in employee data.\n")
+
+    print("Are there null clocks in attendance data?")
+    if attendance['clock_in_null_clock_out_not_null']:
+        print("There are null clock ins with non-null clock-outs. <-- Handle these when checking for late clock ins.\n")
+    else:
+        print("No null clock ins with non-null clock-outs")
+    if attendance['clock_out_null_clock_in_not_null']:
+        print("There are null clock outs with non-null clock-ins. <-- Handle these when checking for early clock outs.\n")
+    else:
+        print("No null clock outs with non-null clock-ins")
+    if attendance['clock_in_and_clock_out_null']:
+        print("There are null clock outs with null clock-ins. <-- These would be the absences.\n")
+    else:
+        print("No null clock outs with null clock-ins. <-- There must be a different way to test for absences from checking for null clock ins and outs.\n")
+
+    print("Is id a unique identifier for events?")
+    if not events['duplicate_ids']:
+        print("Yes. ID is a unique identifier for events.\n")
+        print("Does each id in events_data uniquely identify an event?")
+        if not events['duplicate_name_date_country']:
+            print("Yes. Each id uniquely identifies an event.\n")
+        else:
+            print("No. There are multiple id's for the same event. <-- Data must be sanitized.\n")
     else:
-        print("No. There are multiple record_id's for the same employee. <-- Data must be sanitized.\n")
-else:
-    print("No. There must be some other way to uniquely identify employees.\n")
-
-print("Does each record_id in attendance_data uniquely identifies an employee's attendance record?")
-if not attendance_data.duplicated(subset=['employee_record_id', 'date']).any():
-    print("Yes. Each id record_id in attendance_data uniquely identify an employee's attendance record.\n")
-else:
-    print("No. There are multiple id's for the same attendance record. <-- Data must be sanitized.\n")
-
-print("Is there a record in attendance data for every employee on each weekday of 2023?")
-# Create a DataFrame with every weekday in 2023
-weekdays_2023_range = pd.date_range(start='2023-01-01', end='2023-12-31', freq='B')
-weekdays_2023 = pd.DataFrame({'date': weekdays_2023_range})
-weekdays_2023['key'] = 1 # Create a key column with the same constant value in both DataFrames
-employee_data['key'] = 1
-
-# Join employee_data with  weekdays_2023 <-- This gives us a record for each employee for each weekday in 2023
-employees_weekdays_2023 = pd.merge(employee_data, weekdays_2023)
-employees_weekdays_2023 = employees_weekdays_2023.drop('key', axis=1)
-
-# Join employees_weekdays_2023 with attendance_data on date and employee_id keeping all data on the left <-- This gives us a null on the right if the employee_id does not exist on the right
-employees_weekdays_2023['date'] = pd.to_datetime(employees_weekdays_2023['date'], format='%Y-%m-%d')
-attendance_data['date'] = pd.to_datetime(attendance_data['date'], format='%Y-%m-%d')
-employees_weekdays_2023_attendance = pd.merge(employees_weekdays_2023, attendance_data, left_on=['date', 'record_id'], right_on=['date', 'employee_record_id'], how='left')
-missing_emp_wday_2023_att = employees_weekdays_2023_attendance[employees_weekdays_2023_attendance['record_id_y'].isnull()]
-
-if missing_emp_wday_2023_att.empty:
-    print("Yes. There is a record in attendance data for every employee on each weekday of 2023 <-- There must be a different way to test for absences from checking for missing records.\n")
-else:
-    print("No. There are missing records for some employees on some weekdays of 2023. <-- A missing record must indicate an absence.\n")
-
-print("Are there null clocks in attendance data?")
-case_1 = attendance_data[(attendance_data['clock_in'].isnull()) & (~attendance_data['clock_out'].isnull())]
-case_2 = attendance_data[(~attendance_data['clock_in'].isnull()) & (attendance_data['clock_out'].isnull())]
-case_3 = attendance_data[(attendance_data['clock_in'].isnull()) & (attendance_data['clock_out'].isnull())]
-
-if not case_1.empty:
-    print("There are null clock ins with non-null clock-outs. <-- Handle these when checking for late clock ins.\n")
-else:
-    print("No null clock ins with non-null clock-outs")
-if not case_2.empty:
-    print("There are null clock outs with non-null clock-ins. <-- Handle these when checking for early clock outs.\n")
-else:
-    print("No null clock outs with non-null clock-ins")
-if not case_3.empty:
-    print("There are null clock outs with null clock-ins. <-- These would be the absences.\n")
-else:
-    print("No null clock outs with null clock-ins. <-- There must be a different way to test for absences from checking for null clock ins and outs.\n")
-
-print("Is id a unique identifier for events?")
-if not events_data.duplicated(subset=['id']).any():
-    print("Yes. ID is a unique identifier for events.\n")
-    print("Does each id in events_data uniquely identify an event?")
-    if not events_data.duplicated(subset=['event_name', 'event_date', 'country']).any():
-        print("Yes. Each id uniquely identifies an event.\n")
+        print("No. There must be some other way to uniquely identify events.\n")
+
+    print("Are there events two days or fewer apart in the same country in event data?")
+    if events['events_two_days_or_fewer_apart']:
+        print("Yes. There are events two days or fewer apart in the same country. <-- Handle multiple possible events for the same clock date.\n")
+    else:
+        print("No. There are no events two days or fewer apart in the same country. <-- Each clock date represents a single event.\n")
+
+    print("Is there a record in weather data for each weekday of 2023?")
+    missing_weather = {country: count for country, count in weather['missing_weekdays_per_country'].items() if count}
+    if not missing_weather:
+        print("Yes. There is a record in weather data for each weekday of 2023 <-- There must be a column to test for good weather.\n")
     else:
-        print("No. There are multiple id's for the same event. <-- Data must be sanitized.\n")
-else:
-    print("No. There must be some other way to uniquely identify events.\n")
-
-print("Are there events two days or fewer apart in the same country in event data?")
-events_data['event_date'] = pd.to_datetime(events_data['event_date'], format='%Y-%m-%d') # Convert 'event_date' to datetime type
-events_data = events_data.sort_values(by=['country', 'event_date']) # Sort DataFrame based on 'country' and 'event_date'
-consecutive_dates = events_data.groupby('country')['event_date'].diff().le(pd.Timedelta(days=2)) # Check for consecutive dates in the same country
-
-if consecutive_dates.any():
-    print("Yes. There are events two days or fewer apart in the same country. <-- Handle multiple possible events for the same clock date.\n")
-else:
-    print("No. There are no events two days or fewer apart in the same country. <-- Each clock date represents a single event.\n")
-
-print("Is there a record in weather data for each weekday of 2023?")
-# Join weekdays_2023 with weather_data on date all data on the left <-- This gives us a null on the right if the date does not exist on the right
-weekdays_2023_weather = pd.merge(weekdays_2023, weather_data, on='date', how='left')
-missing_wday_2023_wthr = weekdays_2023_weather[weekdays_2023_weather['id'].isnull()]
-
-if missing_emp_wday_2023_att.empty:
-    print("Yes. There is a record in weather data for each weekday of 2023 <-- There must be a column to test for good weather.\n")
-else:
-    print("No. There are missing records for weather on some weekdays of 2023. <-- Assume good weather on days without weather data.\n")
-
-print("Is date&country a unique identifier for weather?")
-if not weather_data.duplicated(subset=['date', 'country']).any():
-    print("Yes. date&country is a unique identifier for weather. <-- Use date&country to test for weather conditions.")
-else:
-    print("No. There are multiple weather records for the same day in the same country. <-- Handle multiple possible weather conditions per day.")
+        print(f"No. There are missing records for weather on some weekdays of 2023 ({missing_weather}). <-- Assume good weather on days without weather data.\n")
+
+    print("Is date&country a unique identifier for weather?")
+    if not weather['duplicate_date_country']:
+        print("Yes. date&country is a unique identifier for weather. <-- Use date&country to test for weather conditions.")
+    else:
+        print("No. There are multiple weather records for the same day in the same country. <-- Handle multiple possible weather conditions per day.")
+
+def main(argv=None):
+    args = parse_args(argv)
+    print_answers(analyze(Dataset(args.data_dir)))
+
+if __name__ == "__main__": # Guard so that run_pipeline.py can import this script without running it
+    main()
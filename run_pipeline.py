@@ -0,0 +1,67 @@
+"""
+Script Name: run_pipeline.py
+Description: This script runs the data-quality checks of pnlanalyze.py, the analysis of identify_employees.py and the validation of its
+results by test_results.py in one process, on one shared Dataset (see pnl/dataset.py).
+
+Run as three scripts, the cycle loads and parses the four datasets three times. Here the datasets are loaded the first time a stage
+needs them and every later stage reuses the same DataFrames (and any intermediate frame already computed), so the full cycle costs
+one load. Stages that are not run cost nothing: with an unchanged data_quality.json, the checks only compare the checksums of the inputs.
+
+Usage:
+- Ensure you have Python 3.12 installed.
+- Run the three stages: python run_pipeline.py [--data-dir DATA_DIR]
+- Run some of them: python run_pipeline.py --stages identify,validate
+- Any other option is passed to identify_employees.py: python run_pipeline.py --data-dir DATA_DIR --drilldown csv --profile
+"""
+
+import argparse
+import sys
+import identify_employees
+import pnlanalyze
+import test_results
+from pnl.dataset import Dataset
+from pnl.profiling import Profiler
+
+STAGES = ['analyze', 'identify', 'validate'] # Run in this order
+
+# Function to parse the command line arguments, returning the stages to run and the arguments of identify_employees.py
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the data-quality checks, the analysis and the validation of its results in one process, loading the data once. "
+                                                 "Any other option is passed to identify_employees.py (see python identify_employees.py --help).")
+    parser.add_argument('--stages', default=','.join(STAGES), help="Comma-separated stages to run (default: %(default)s)")
+    args, identify_argv = parser.parse_known_args(argv)
+    stages = args.stages.split(',')
+    unknown = [stage for stage in stages if stage not in STAGES]
+    if unknown:
+        parser.error(f"Unknown stages: {', '.join(unknown)} (choose from {', '.join(STAGES)})")
+    identify_args = identify_employees.parse_args(identify_argv)
+    if identify_args.serve is not None:
+        parser.error("--serve cannot be combined with the other stages. Run identify_employees.py --serve instead")
+    if 'validate' in stages and (identify_args.ndjson or identify_args.policies):
+        parser.error("The validate stage checks results.json (not written with --ndjson or --policies)")
+    return [stage for stage in STAGES if stage in stages], identify_args
+
+def main(argv=None):
+    stages, args = parse_args(argv)
+    dataset = Dataset(args.data_dir, profiler=Profiler(enabled=args.profile)) # Shared by the stages <-- Each dataset and frame is loaded or computed once
+    if args.cprofile:
+        dataset.profiler.start_cprofile()
+
+    mismatches = 0
+    modes = []
+    for stage in stages:
+        print(f"\n=== {stage} ===")
+        if stage == 'analyze':
+            pnlanalyze.print_answers(pnlanalyze.analyze(dataset))
+        elif stage == 'identify':
+            modes.append(identify_employees.identify(args, dataset))
+        else:
+            mismatches = test_results.validate(dataset)
+
+    identify_employees.write_profiles(args, dataset, f"pipeline: {', '.join(stages)}" + (f" ({modes[0]})" if modes else ''),
+                                      sys.argv[1:] if argv is None else argv)
+    if mismatches:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,4 @@
+"""
+Package Name: tests
+Description: Regression checks of the pnl package, run with python -m pytest from the repository root.
+"""
@@ -0,0 +1,32 @@
+"""
+Module Name: tests/test_fetch.py
+Description: Checks of the streaming attendance loader of pnl/fetch.py.
+"""
+
+import json
+import pytest
+from pnl.fetch import fetch_attendance_data
+
+# Function to write attendance records to a JSON array in the given directory, returning its path
+def _write_attendance(tmp_path, records):
+    data_path = tmp_path / 'attendance.json'
+    data_path.write_text(json.dumps(records))
+    return str(data_path)
+
+def _record(record_id, **fields):
+    return {'record_id': record_id, 'employee_record_id': 1, 'date': '2023-01-02', 'clock_in': '08:00:00', 'clock_out': '17:00:00', **fields}
+
+def test_records_without_a_date_are_dropped(tmp_path):
+    no_date = _record(3)
+    del no_date['date']
+    data_path = _write_attendance(tmp_path, [_record(1), _record(2, date=None), no_date, _record(4, date='2022-12-30')])
+    assert fetch_attendance_data(data_path, year=2023)['record_id'].tolist() == [1]
+    assert fetch_attendance_data(data_path, year=None)['record_id'].tolist() == [1, 4]
+
+def test_data_after_the_array_is_rejected(tmp_path):
+    data_path = tmp_path / 'attendance.json'
+    data_path.write_text(json.dumps([_record(1)]) + '\n ]')
+    with pytest.raises(ValueError, match='Extra data after the JSON array'):
+        fetch_attendance_data(str(data_path))
+    data_path.write_text(json.dumps([_record(1)]) + '\n\n')
+    assert fetch_attendance_data(str(data_path))['record_id'].tolist() == [1]
@@ -0,0 +1,69 @@
+"""
+Module Name: tests/test_incremental.py
+Description: Checks that the incremental computation of pnl/incremental.py gives the same results as a full computation.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+from pnl.compact import compact_frame, in_year, parse_dates, unify_categories
+from pnl.incremental import build_state, state_results, update_state
+from pnl.matching import match_infractions
+from pnl.pipeline import (average_hours_per_week, build_results, expand_event_windows, filter_problem_attendance, find_problem_clocks_absences,
+                          join_events_weather, summarize_infractions)
+from pnl.rollups import WeeklyRollups
+from pnl.synthetic import generate_employees, generate_events, generate_weather, iter_attendance
+
+YEAR = 2023
+
+# Function to convert a generated dataset to the typed representation of pnl/fetch.py, keeping only the records for YEAR
+def _typed(df, date_column):
+    df = df.copy()
+    df[date_column] = parse_dates(df[date_column])
+    return compact_frame(df[in_year(df[date_column], YEAR)].reset_index(drop=True))
+
+# Function to generate small typed datasets for YEAR, with enough late clock ins, early clock outs and absences to flag employees
+def _datasets(seed=0):
+    rng = np.random.default_rng(seed)
+    employee_data = compact_frame(generate_employees(60, 3, rng))
+    events_data = _typed(generate_events([YEAR], 3, 40, rng), 'event_date')
+    weather_data = _typed(generate_weather([YEAR], 3, rng), 'date')
+    attendance_data = _typed(pd.concat(iter_attendance(60, [YEAR], 0.1, 0.1, 0.05, rng), ignore_index=True), 'date')
+    unify_categories([employee_data, events_data, weather_data], 'country')
+    return employee_data, attendance_data, events_data, weather_data
+
+# Function to run the full computation, returning its intermediate frames and results
+def _full_run(employee_data, attendance_data, events_data, weather_data):
+    events_weather = join_events_weather(expand_event_windows(events_data, YEAR), weather_data)
+    employee_attendance = filter_problem_attendance(employee_data, attendance_data)
+    problem_clocks_absences = find_problem_clocks_absences(employee_attendance, events_weather)
+    summary = summarize_infractions(problem_clocks_absences, match_infractions(problem_clocks_absences))
+    rollups = WeeklyRollups.from_attendance(attendance_data)
+    results = build_results(summary, employee_data, average_hours_per_week(rollups.total_seconds_worked()))
+    return employee_attendance, problem_clocks_absences, rollups, summary, results
+
+# Function to build the state of a full computation on the given attendance
+def _state(employee_data, attendance_data, events_data, weather_data):
+    employee_attendance, problem_clocks_absences, rollups, summary, _ = _full_run(employee_data, attendance_data, events_data, weather_data)
+    return build_state(events_data, weather_data, employee_attendance, problem_clocks_absences, rollups, summary, year=YEAR)
+
+@pytest.mark.parametrize('cutoff', ['2023-03-15', '2023-07-01', '2023-12-20'])
+def test_new_attendance_days_give_the_full_results(cutoff):
+    employee_data, attendance_data, events_data, weather_data = _datasets()
+    old = attendance_data['date'] < int(parse_dates([cutoff])[0])
+    state = _state(employee_data, attendance_data[old], events_data, weather_data)
+    state = update_state(state, employee_data, attendance_data[~old], events_data, weather_data)
+    results = _full_run(employee_data, attendance_data, events_data, weather_data)[4]
+    assert len(results) > 0
+    pd.testing.assert_frame_equal(state_results(state, employee_data), results)
+
+def test_changed_events_and_weather_give_the_full_results():
+    employee_data, attendance_data, events_data, weather_data = _datasets(seed=1)
+    old = attendance_data['date'] < int(parse_dates(['2023-09-01'])[0])
+    state = _state(employee_data, attendance_data[old], events_data.iloc[5:], weather_data)
+    # Some events are added back, and the weather of some days changes to an extreme condition
+    weather_data = weather_data.copy()
+    weather_data.loc[weather_data.index[::17], 'condition'] = 'hurricane'
+    state = update_state(state, employee_data, attendance_data[~old], events_data, weather_data)
+    results = _full_run(employee_data, attendance_data, events_data, weather_data)[4]
+    pd.testing.assert_frame_equal(state_results(state, employee_data), results)
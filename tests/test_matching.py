@@ -0,0 +1,62 @@
+"""
+Module Name: tests/test_matching.py
+Description: Checks of the exact infraction matching of pnl/matching.py against a brute-force maximum matching.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+from pnl.matching import match_infractions
+
+# Function to generate random candidate (clock date, event) pairs: the problem clock dates of each employee within window_days of their events
+def _random_candidates(rng, employees, window_days):
+    rows = []
+    event_id = 0
+    for employee in range(1, employees + 1):
+        event_dates = rng.integers(0, 20, size=rng.integers(0, 7))
+        clock_dates = np.flatnonzero(rng.random(24) < rng.random()) # Some days are problem clocks, at random densities
+        clock_dates = np.concatenate([clock_dates, rng.choice(clock_dates, size=min(2, len(clock_dates)))]) if len(clock_dates) else clock_dates # Repeated clock dates (duplicated attendance)
+        for event_date in event_dates.tolist():
+            event_id += 1
+            for clock_date in clock_dates.tolist():
+                if abs(clock_date - event_date) <= window_days:
+                    rows.append((employee, event_id, event_date, clock_date))
+    candidates = pd.DataFrame(rows, columns=['record_id_x', 'event_id', 'event_date', 'clock_date'])
+    return candidates.sample(frac=1, random_state=int(rng.integers(1 << 31))).reset_index(drop=True) # In no particular order
+
+# Function to get the size of a maximum matching between the clock dates and events of one employee with augmenting paths
+def _maximum_matching_size(pairs):
+    clock_dates_of_event = {}
+    for event_id, clock_date in pairs:
+        clock_dates_of_event.setdefault(event_id, set()).add(clock_date)
+    event_of_clock_date = {}
+
+    def augment(event_id, visited):
+        for clock_date in clock_dates_of_event[event_id]:
+            if clock_date not in visited:
+                visited.add(clock_date)
+                if clock_date not in event_of_clock_date or augment(event_of_clock_date[clock_date], visited):
+                    event_of_clock_date[clock_date] = event_id
+                    return True
+        return False
+
+    return sum(augment(event_id, set()) for event_id in clock_dates_of_event)
+
+@pytest.mark.parametrize('window_days', [0, 1, 2, 3])
+def test_matching_is_a_maximum_matching(window_days):
+    rng = np.random.default_rng(window_days)
+    for _ in range(50):
+        candidates = _random_candidates(rng, employees=8, window_days=window_days)
+        chosen = match_infractions(candidates)
+        infractions = candidates[chosen]
+        # A valid matching: one infraction at most per clock date and per event of each employee
+        assert not infractions.duplicated(['record_id_x', 'clock_date']).any()
+        assert not infractions.duplicated(['record_id_x', 'event_id']).any()
+        # A maximum matching: as many infractions as the brute-force matching for every employee
+        for employee, pairs in candidates.groupby('record_id_x'):
+            expected = _maximum_matching_size(zip(pairs['event_id'].tolist(), pairs['clock_date'].tolist()))
+            assert int(chosen[candidates['record_id_x'].to_numpy() == employee].sum()) == expected
+
+def test_no_candidates():
+    candidates = pd.DataFrame({'record_id_x': [], 'event_id': [], 'event_date': [], 'clock_date': []}, dtype='int64')
+    assert len(match_infractions(candidates)) == 0
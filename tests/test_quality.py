@@ -0,0 +1,42 @@
+"""
+Module Name: tests/test_quality.py
+Description: Checks of the data-quality profile of pnl/quality.py.
+"""
+
+import numpy as np
+import pandas as pd
+from pnl.compact import compact_frame
+from pnl.quality import profile_attendance, weekdays_of_year
+from pnl.synthetic import generate_employees, iter_attendance
+
+# Function to generate small typed employees and attendance datasets for 2023, with a record for every weekday of every employee
+def _datasets(employees=5):
+    rng = np.random.default_rng(0)
+    employee_data = compact_frame(generate_employees(employees, 2, rng))
+    attendance_data = compact_frame(pd.concat(iter_attendance(employees, [2023], 0.1, 0.1, 0.1, rng), ignore_index=True))
+    return employee_data, attendance_data
+
+def test_full_attendance_has_no_missing_weekdays():
+    employee_data, attendance_data = _datasets()
+    report = profile_attendance(attendance_data, employee_data, 2023)
+    assert report['weekdays_in_year'] == len(weekdays_of_year(2023))
+    assert report['employees_with_missing_weekdays'] == 0
+    assert report['missing_employee_weekdays'] == 0
+
+def test_duplicated_employee_id_is_covered_by_its_records():
+    employee_data, attendance_data = _datasets()
+    employee_data = pd.concat([employee_data, employee_data.iloc[[2]]], ignore_index=True) # The third employee is listed twice
+    report = profile_attendance(attendance_data, employee_data, 2023)
+    assert report['employees_with_missing_weekdays'] == 0
+    assert report['missing_employee_weekdays'] == 0
+    assert report['most_missing_weekdays'] == []
+    assert report['unknown_employee_records'] == 0
+
+def test_missing_weekdays_are_counted_once_per_employee():
+    employee_data, attendance_data = _datasets()
+    employee_data = pd.concat([employee_data, employee_data.iloc[[2]]], ignore_index=True)
+    dropped = attendance_data['employee_record_id'] == employee_data['record_id'].iloc[2]
+    dropped &= attendance_data['date'].isin(weekdays_of_year(2023)[:7]) # Drop the first 7 weekdays of the duplicated employee
+    report = profile_attendance(attendance_data[~dropped], employee_data, 2023)
+    assert report['employees_with_missing_weekdays'] == 1
+    assert report['most_missing_weekdays'] == [{'record_id': int(employee_data['record_id'].iloc[2]), 'missing_weekdays': 7}]